@@ -77,6 +77,7 @@ using google_breakpad::MinidumpMemoryInfo;
 using google_breakpad::MinidumpMemoryInfoList;
 using google_breakpad::MinidumpMiscInfo;
 using google_breakpad::MinidumpModule;
+using google_breakpad::MinidumpModuleList;
 using google_breakpad::MinidumpProcessor;
 using google_breakpad::PathnameStripper;
 using google_breakpad::ProcessResult;
@@ -1112,88 +1113,221 @@ static void PrintProcessStateMachineReadable(const ProcessState& process_state)
 
 void usage() {
   fprintf(stderr, "Usage: stackwalker [options] <minidump> [<symbol paths]\n");
+  fprintf(stderr, "       stackwalker [options] --pipe-server [<symbol paths]\n");
   fprintf(stderr, "Options:\n");
   fprintf(stderr, "\t--pretty\tPretty-print JSON output.\n");
   fprintf(stderr, "\t--pipe-dump\tProduce pipe-delimited output in addition to JSON output\n");
   fprintf(stderr, "\t--raw-json\tAn input file with the raw annotations as JSON\n");
+  fprintf(stderr, "\t--pipe-server\tRead '<raw json path>\\t<minidump path>' requests from\n"
+                  "\t\t\tstdin, one per line, and answer each with one line of JSON\n");
+  fprintf(stderr, "\t--symbol-cache-max-bytes\tWith --pipe-server, the size of the symbol\n"
+                  "\t\t\tfiles to keep loaded between dumps (default: no limit)\n");
   http_commandline_usage();
   fprintf(stderr, "\t--help\tDisplay this help text.\n");
 }
 
-} // namespace
-int main(int argc, char** argv)
-{
-  bool pretty = false;
-  bool pipe = false;
-  char* json_path = nullptr;
-  // Yeah, this is ugly.
-  vector<char*> symbols_urls;
-  char* symbols_cache = nullptr;
-  const char* symbols_tmp = "/tmp";
-  static struct option long_options[] = {
-    {"pretty", no_argument, nullptr, 'p'},
-    {"pipe-dump", no_argument, nullptr, 'i'},
-    {"raw-json", required_argument, nullptr, 'r'},
-    HTTP_COMMANDLINE_OPTIONS
-    {"help", no_argument, nullptr, 'h'},
-    {nullptr, 0, nullptr, 0}
+// The symbol cache of --pipe-server mode.  The long-lived resolver keeps
+// every symbol file it has parsed, which is what makes walking the next dump
+// cheap, so this keeps track of what it holds:
+//
+// * BasicSourceLineResolver keys its modules by code file alone, so before a
+//   dump is walked any module loaded for a previous dump under the same code
+//   file but a different debug id is unloaded, or the wrong symbols would be
+//   used.
+// * The size of the symbol files that have been loaded is accounted, and once
+//   it grows past |max_bytes| the least recently used modules are unloaded.
+class ResolverSymbolCache {
+public:
+  ResolverSymbolCache(BasicSourceLineResolver* resolver, uint64_t max_bytes)
+    : resolver_(resolver), max_bytes_(max_bytes), total_bytes_(0), clock_(0),
+      evictions_(0) {}
+
+  ~ResolverSymbolCache() {
+    for (map<string, Entry>::iterator it = entries_.begin();
+         it != entries_.end(); ++it) {
+      delete it->second.module;
+    }
+  }
+
+  void BeginDump(Minidump& minidump) {
+    evictions_ = 0;
+    pending_sizes_.clear();
+    MinidumpModuleList* module_list = minidump.GetModuleList();
+    if (!module_list)
+      return;
+    for (unsigned int i = 0; i < module_list->module_count(); ++i) {
+      const MinidumpModule* module = module_list->GetModuleAtIndex(i);
+      if (!module)
+        continue;
+      map<string, Entry>::iterator loaded =
+        entries_.find(module->code_file());
+      if (loaded != entries_.end() &&
+          loaded->second.debug_identifier != module->debug_identifier()) {
+        Unload(loaded);
+      }
+    }
+  }
+
+  // Called by SizeRecordingSymbolSupplier whenever the resolver is handed
+  // the contents of a symbol file.
+  void RecordSymbolSize(const CodeModule* module, size_t size) {
+    pending_sizes_[module->code_file()] = size;
+  }
+
+  void EndDump(const ProcessState& process_state, Json::Value& stats) {
+    ++clock_;
+    unsigned int hits = 0;
+    unsigned int misses = 0;
+    const CodeModules* modules = process_state.modules();
+    if (modules) {
+      for (unsigned int i = 0; i < modules->module_count(); ++i) {
+        const CodeModule* module = modules->GetModuleAtSequence(i);
+        if (!resolver_->HasModule(module))
+          continue;
+        map<string, Entry>::iterator loaded =
+          entries_.find(module->code_file());
+        if (loaded != entries_.end()) {
+          ++hits;
+          loaded->second.last_used = clock_;
+          continue;
+        }
+        ++misses;
+        Entry entry;
+        entry.module = module->Copy();
+        entry.debug_identifier = module->debug_identifier();
+        map<string, size_t>::const_iterator size =
+          pending_sizes_.find(module->code_file());
+        entry.size = size == pending_sizes_.end() ? 0 : size->second;
+        entry.last_used = clock_;
+        entries_[module->code_file()] = entry;
+        total_bytes_ += entry.size;
+      }
+    }
+    pending_sizes_.clear();
+    Evict();
+
+    stats["hits"] = hits;
+    stats["misses"] = misses;
+    stats["evictions"] = evictions_;
+    stats["loaded_modules"] = static_cast<Json::UInt>(entries_.size());
+    stats["loaded_bytes"] = static_cast<double>(total_bytes_);
+  }
+
+private:
+  struct Entry {
+    const CodeModule* module;
+    string debug_identifier;
+    uint64_t size;
+    uint64_t last_used;
   };
-  int arg;
-  int option_index = 0;
-  while((arg = getopt_long(argc, argv, "", long_options, &option_index))
-        != -1) {
-    switch(arg) {
-    case 0:
-      if (long_options[option_index].flag != 0)
-          break;
-      break;
-    case 'p':
-      pretty = true;
-      break;
-    case 'i':
-      pipe = true;
-      break;
-    case 'r':
-      json_path = optarg;
-      break;
-    HANDLE_HTTP_COMMANDLINE_OPTIONS
-    case 'h':
-      usage();
-      return 0;
-    case '?':
-      break;
-    default:
-      fprintf(stderr, "Unknown option: -%c\n", (char)arg);
-      usage();
-      return 1;
+
+  void Unload(map<string, Entry>::iterator loaded) {
+    resolver_->UnloadModule(loaded->second.module);
+    total_bytes_ -= loaded->second.size;
+    delete loaded->second.module;
+    entries_.erase(loaded);
+    ++evictions_;
+  }
+
+  // Unload least recently used modules until the cache fits in max_bytes_.
+  // Modules used by the dump that was just walked are never evicted.
+  void Evict() {
+    while (max_bytes_ && total_bytes_ > max_bytes_) {
+      map<string, Entry>::iterator oldest = entries_.end();
+      for (map<string, Entry>::iterator it = entries_.begin();
+           it != entries_.end(); ++it) {
+        if (it->second.last_used == clock_)
+          continue;
+        if (oldest == entries_.end() ||
+            it->second.last_used < oldest->second.last_used) {
+          oldest = it;
+        }
+      }
+      if (oldest == entries_.end())
+        break;
+      Unload(oldest);
     }
   }
 
-  if (optind >= argc) {
-    usage();
-    return 1;
+  BasicSourceLineResolver* resolver_;
+  uint64_t max_bytes_;
+  uint64_t total_bytes_;
+  uint64_t clock_;
+  unsigned int evictions_;
+  map<string, Entry> entries_;
+  map<string, size_t> pending_sizes_;
+};
+
+// A SymbolSupplier that forwards to another one, telling the
+// ResolverSymbolCache how large each symbol file handed to the resolver is.
+class SizeRecordingSymbolSupplier : public SymbolSupplier {
+public:
+  SizeRecordingSymbolSupplier(SymbolSupplier* supplier,
+                              ResolverSymbolCache* cache)
+    : supplier_(supplier), cache_(cache) {}
+
+  virtual SymbolResult GetSymbolFile(const CodeModule* module,
+                                     const SystemInfo* system_info,
+                                     string* symbol_file) {
+    return supplier_->GetSymbolFile(module, system_info, symbol_file);
   }
 
-  if (!check_http_commandline_options(symbols_urls,
-                                      symbols_cache,
-                                      symbols_tmp)) {
-    usage();
-    return 1;
+  virtual SymbolResult GetSymbolFile(const CodeModule* module,
+                                     const SystemInfo* system_info,
+                                     string* symbol_file,
+                                     string* symbol_data) {
+    SymbolResult result = supplier_->GetSymbolFile(module, system_info,
+                                                   symbol_file, symbol_data);
+    if (result == FOUND)
+      cache_->RecordSymbolSize(module, symbol_data->size());
+    return result;
   }
 
-  Minidump minidump(argv[optind]);
-  vector<string> symbol_paths;
-  // allow symbol paths to be passed on the commandline.
-  for (int i = optind + 1; i < argc; i++) {
-    symbol_paths.push_back(argv[i]);
+  virtual SymbolResult GetCStringSymbolData(const CodeModule* module,
+                                            const SystemInfo* system_info,
+                                            string* symbol_file,
+                                            char** symbol_data,
+                                            size_t* size) {
+    SymbolResult result = supplier_->GetCStringSymbolData(module, system_info,
+                                                          symbol_file,
+                                                          symbol_data, size);
+    if (result == FOUND)
+      cache_->RecordSymbolSize(module, *size);
+    return result;
+  }
+
+  virtual void FreeSymbolData(const CodeModule* module) {
+    supplier_->FreeSymbolData(module);
   }
 
+private:
+  SymbolSupplier* supplier_;
+  ResolverSymbolCache* cache_;
+};
+
+// Walk the stacks of a single minidump and fill |root| with the JSON
+// representation of the result.  The symbol supplier and symbolizer are
+// created anew for every dump so that no per-dump state leaks from one dump
+// to the next; only |resolver| (and with it the parsed symbol files) is
+// shared when running as a --pipe-server.
+static void ProcessMinidump(const char* minidump_path,
+                            const char* json_path,
+                            const vector<char*>& symbols_urls,
+                            const char* symbols_cache,
+                            const char* symbols_tmp,
+                            const vector<string>& symbol_paths,
+                            BasicSourceLineResolver& resolver,
+                            ResolverSymbolCache* cache,
+                            bool pipe,
+                            Json::Value& root) {
+  Minidump minidump(minidump_path);
   minidump.Read();
+  if (cache)
+    cache->BeginDump(minidump);
   // process minidump
   // bug 950710 - Bad symbol files are causing the stackwalker to
   // run amok. Disabling this until we get an upstream fix.
   //Stackwalker::set_max_frames(UINT32_MAX);
-  Json::Value root;
   scoped_ptr<SymbolSupplier> symbol_supplier;
   HTTPSymbolSupplier* http_symbol_supplier = nullptr;
   if (!symbols_urls.empty()) {
@@ -1206,9 +1340,14 @@ int main(int argc, char** argv)
   } else if (!symbol_paths.empty()) {
     symbol_supplier.reset(new SimpleSymbolSupplier(symbol_paths));
   }
+  SymbolSupplier* supplier = symbol_supplier.get();
+  scoped_ptr<SymbolSupplier> recording_supplier;
+  if (cache && supplier) {
+    recording_supplier.reset(new SizeRecordingSymbolSupplier(supplier, cache));
+    supplier = recording_supplier.get();
+  }
 
-  BasicSourceLineResolver resolver;
-  StackFrameSymbolizerForward symbolizer(symbol_supplier.get(), &resolver);
+  StackFrameSymbolizerForward symbolizer(supplier, &resolver);
   MinidumpProcessor minidump_processor(&symbolizer, true);
   ProcessState process_state;
   ProcessResult result =
@@ -1265,6 +1404,144 @@ int main(int argc, char** argv)
     }
   }
 
+  // Symbols are only evicted once the JSON no longer needs them.
+  if (cache) {
+    Json::Value cache_stats(Json::objectValue);
+    cache->EndDump(process_state, cache_stats);
+    root["symbol_cache_stats"] = cache_stats;
+  }
+}
+
+// --pipe-server mode: stay resident, answering one request per line of
+// stdin.  A request is "<raw json path>\t<minidump path>" (the raw json path
+// may be empty), the answer is the JSON document for that dump on a single
+// line of stdout.  Symbol files parsed for one dump stay loaded in the
+// resolver for the dumps that follow, up to |symbol_cache_max_bytes| worth of
+// symbol files (0 for no limit).  Each answer carries the statistics of the
+// symbol cache in "symbol_cache_stats".
+static int RunPipeServer(const vector<char*>& symbols_urls,
+                         const char* symbols_cache,
+                         const char* symbols_tmp,
+                         const vector<string>& symbol_paths,
+                         uint64_t symbol_cache_max_bytes) {
+  BasicSourceLineResolver resolver;
+  ResolverSymbolCache cache(&resolver, symbol_cache_max_bytes);
+  Json::FastWriter writer;
+  string request;
+  while (std::getline(std::cin, request)) {
+    if (request.empty())
+      continue;
+    string json_path;
+    string minidump_path;
+    size_t tab = request.find('\t');
+    if (tab == string::npos) {
+      minidump_path = request;
+    } else {
+      json_path = request.substr(0, tab);
+      minidump_path = request.substr(tab + 1);
+    }
+
+    Json::Value root;
+    ProcessMinidump(minidump_path.c_str(),
+                    json_path.empty() ? nullptr : json_path.c_str(),
+                    symbols_urls, symbols_cache, symbols_tmp, symbol_paths,
+                    resolver, &cache, false, root);
+    // FastWriter terminates the document with a newline, which is the
+    // end-of-response marker the client waits for.
+    string response = writer.write(root);
+    fwrite(response.data(), 1, response.size(), stdout);
+    fflush(stdout);
+  }
+  return 0;
+}
+
+} // namespace
+int main(int argc, char** argv)
+{
+  bool pretty = false;
+  bool pipe = false;
+  bool server = false;
+  uint64_t symbol_cache_max_bytes = 0;
+  char* json_path = nullptr;
+  // Yeah, this is ugly.
+  vector<char*> symbols_urls;
+  char* symbols_cache = nullptr;
+  const char* symbols_tmp = "/tmp";
+  static struct option long_options[] = {
+    {"pretty", no_argument, nullptr, 'p'},
+    {"pipe-dump", no_argument, nullptr, 'i'},
+    {"raw-json", required_argument, nullptr, 'r'},
+    {"pipe-server", no_argument, nullptr, 'e'},
+    {"symbol-cache-max-bytes", required_argument, nullptr, 'm'},
+    HTTP_COMMANDLINE_OPTIONS
+    {"help", no_argument, nullptr, 'h'},
+    {nullptr, 0, nullptr, 0}
+  };
+  int arg;
+  int option_index = 0;
+  while((arg = getopt_long(argc, argv, "", long_options, &option_index))
+        != -1) {
+    switch(arg) {
+    case 0:
+      if (long_options[option_index].flag != 0)
+          break;
+      break;
+    case 'p':
+      pretty = true;
+      break;
+    case 'i':
+      pipe = true;
+      break;
+    case 'r':
+      json_path = optarg;
+      break;
+    case 'e':
+      server = true;
+      break;
+    case 'm':
+      symbol_cache_max_bytes = strtoull(optarg, nullptr, 10);
+      break;
+    HANDLE_HTTP_COMMANDLINE_OPTIONS
+    case 'h':
+      usage();
+      return 0;
+    case '?':
+      break;
+    default:
+      fprintf(stderr, "Unknown option: -%c\n", (char)arg);
+      usage();
+      return 1;
+    }
+  }
+
+  if (!server && optind >= argc) {
+    usage();
+    return 1;
+  }
+
+  if (!check_http_commandline_options(symbols_urls,
+                                      symbols_cache,
+                                      symbols_tmp)) {
+    usage();
+    return 1;
+  }
+
+  vector<string> symbol_paths;
+  // allow symbol paths to be passed on the commandline.
+  for (int i = server ? optind : optind + 1; i < argc; i++) {
+    symbol_paths.push_back(argv[i]);
+  }
+
+  if (server) {
+    return RunPipeServer(symbols_urls, symbols_cache, symbols_tmp,
+                         symbol_paths, symbol_cache_max_bytes);
+  }
+
+  Json::Value root;
+  BasicSourceLineResolver resolver;
+  ProcessMinidump(argv[optind], json_path, symbols_urls, symbols_cache,
+                  symbols_tmp, symbol_paths, resolver, nullptr, pipe, root);
+
   scoped_ptr<Json::Writer> writer;
   if (pretty)
     writer.reset(new Json::StyledWriter());
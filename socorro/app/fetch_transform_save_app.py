@@ -33,6 +33,7 @@ from configman import Namespace
 from configman.converters import class_converter
 
 from socorro.lib.task_manager import respond_to_SIGTERM
+from socorro.lib.util import DotDict
 from socorro.app.generic_app import App, main  # main not used here, but
                                                # is imported from generic_app
                                                # into this scope to offer to
@@ -107,6 +108,9 @@ class FetchTransformSaveApp(App):
     def __init__(self, config):
         super(FetchTransformSaveApp, self).__init__(config)
         self.waiting_func = None
+        # in a worker process forked by a process based task manager, the
+        # attributes inherited from the parent.  None in the parent.
+        self._inherited_from_parent = None
         # select the iterator type based on the "number_of_submissions" config
         self.source_iterator = {
             'forever': self._infinite_iterator,
@@ -262,10 +266,24 @@ class FetchTransformSaveApp(App):
                 )
 
     def _transform(self, crash_id):
-        """this default transform function only transfers raw data from the
-        source to the destination without changing the data.  While this may
-        be good enough for the raw crashmover, the processor would override
-        this method to create and save processed crashes"""
+        """fetch a crash, transform it and save it.  The stages are separate
+        methods so that a task manager, like the PipelinedTaskManager, can
+        run each of them in its own pool of threads."""
+        crash = self._fetch(crash_id)
+        if crash is None:
+            return
+        try:
+            self._process(crash)
+            self._save(crash)
+        finally:
+            self._finish(crash)
+
+    def _fetch(self, crash_id):
+        """the fetch stage: read the crash from the source.
+
+        returns:
+            a DotDict holding the state of the crash as it passes through
+            the stages, or None if there is nothing more to do with it"""
         try:
             raw_crash = self.source.get_raw_crash(crash_id)
         except Exception as x:
@@ -284,8 +302,24 @@ class FetchTransformSaveApp(App):
                 exc_info=True
             )
             dumps = {}
+        return DotDict(crash_id=crash_id, raw_crash=raw_crash, dumps=dumps)
+
+    def _process(self, crash):
+        """the transform stage.  This default only transfers raw data from
+        the source to the destination without changing the data.  While this
+        may be good enough for the raw crashmover, the processor overrides
+        this method to create processed crashes"""
+        pass
+
+    def _save(self, crash):
+        """the save stage: write the crash to the destination"""
+        crash_id = crash.crash_id
         try:
-            self.destination.save_raw_crash(raw_crash, dumps, crash_id)
+            self.destination.save_raw_crash(
+                crash.raw_crash,
+                crash.dumps,
+                crash_id
+            )
             self.config.logger.info('saved - %s', crash_id)
         except Exception as x:
             self.config.logger.error(
@@ -303,6 +337,11 @@ class FetchTransformSaveApp(App):
                     exc_info=True
                 )
 
+    def _finish(self, crash):
+        """called once a fetched crash is done with, whether or not the
+        other stages succeeded"""
+        pass
+
     def quit_check(self):
         self.task_manager.quit_check()
 
@@ -355,6 +394,28 @@ class FetchTransformSaveApp(App):
                 task_func=self.transform
             )
         self.config.executor_identity = self.task_manager.executor_identity
+        # task managers that run the tasks in forked processes, like the
+        # ProcessPoolTaskManager, need each of those processes to have its
+        # own crash storage connections.
+        if hasattr(self.task_manager, 'worker_setup_func'):
+            self.task_manager.worker_setup_func = self._setup_worker_process
+            self.task_manager.worker_close_func = self.close
+        # task managers that pipeline the stages of a transform, like the
+        # PipelinedTaskManager, run each stage separately.
+        if hasattr(self.task_manager, 'fetch_func'):
+            self.task_manager.fetch_func = self._fetch
+            self.task_manager.process_func = self._process
+            self.task_manager.save_func = self._save
+            self.task_manager.finish_func = self._finish
+
+    def _setup_worker_process(self):
+        """called in each worker process forked by a process based task
+        manager before it starts transforming crashes.  The crash storage
+        objects inherited from the parent share its sockets and files, so
+        they are set aside, never to be used or closed, and new ones are
+        made."""
+        self._inherited_from_parent = dict(self.__dict__)
+        self._setup_source_and_destination()
 
     def close(self):
         try:
@@ -398,14 +459,32 @@ class FetchTransformSaveWithSeparateNewCrashSourceApp(FetchTransformSaveApp):
         # also typically tied to a crashstorage class, it doesn't have to be
         # the same class as the "source".  For example, the "source" may be
         # AmazonS3 but the stream of crash_ids may be from RabbitMQ or a
-        # PG query
-        return self.new_crash_source.new_crashes()
+        # PG query.  As the crash_ids are queued, the "source" is told about
+        # them so that, if it can, it fetches them before a worker asks.
+        # Workers forked by a process based task manager have sources of
+        # their own that would never see what was prefetched here.
+        if hasattr(getattr(self, 'task_manager', None), 'worker_setup_func'):
+            prefetch = None
+        else:
+            prefetch = getattr(self.source, 'prefetch', None)
+        for x in self.new_crash_source.new_crashes():
+            if prefetch is not None and x is not None:
+                if isinstance(x, tuple):
+                    crash_id = x[0][0]
+                else:
+                    crash_id = x
+                prefetch(crash_id)
+            yield x
 
     def _setup_source_and_destination(self):
         """use the base class to setup the source and destinations but add to
         that setup the instantiation of the "new_crash_source" """
         super(FetchTransformSaveWithSeparateNewCrashSourceApp, self) \
             ._setup_source_and_destination()
+        if self._inherited_from_parent is not None:
+            # a worker process only transforms the crashes the parent
+            # queues, it never reads the "new_crash_source"
+            return
         if self.config.new_crash_source.new_crash_source_class:
             self.new_crash_source = \
                 self.config.new_crash_source.new_crash_source_class(
@@ -420,7 +499,12 @@ class FetchTransformSaveWithSeparateNewCrashSourceApp(FetchTransformSaveApp):
 
     def close(self):
         super(FetchTransformSaveWithSeparateNewCrashSourceApp, self).close()
-        if self.source != self.new_crash_source:
+        # a worker process's "new_crash_source" is the parent's, it is left
+        # alone
+        if (
+            self._inherited_from_parent is None and
+            self.source != self.new_crash_source
+        ):
             try:
                 self.new_crash_source.close()
             except AttributeError:
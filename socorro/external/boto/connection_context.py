@@ -3,18 +3,24 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import json
+import os
 import socket
 import datetime
 import contextlib
+import threading
+import zlib
 
 import boto
 import boto.s3.connection
 import boto.exception
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 
 from configman import Namespace, RequiredConfig, class_converter
 from configman.converters import str_to_boolean
 
 from socorro.lib.converters import change_default
+from socorro.lib.lru_cache import LRUCache
 from socorro.lib.ooid import dateFromOoid
 
 
@@ -29,6 +35,29 @@ class JSONISOEncoder(json.JSONEncoder):
         raise NotImplementedError("Don't know about {0!r}".format(obj))
 
 
+def _gzip_encode(data):
+    # the wbits of 16 + MAX_WBITS give the gzip format rather than the zlib
+    # one, so the objects can be read by any tool that understands the
+    # content encoding
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION,
+        zlib.DEFLATED,
+        16 + zlib.MAX_WBITS
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def _gzip_decode(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+# the codecs that things can be stored with, by the value of the
+# Content-Encoding header that marks them
+content_codecs = {
+    'gzip': (_gzip_encode, _gzip_decode),
+}
+
+
 class KeyBuilderBase(object):
     """Base key builder for s3 pseudo-filenames"""
     def build_keys(self, prefix, name_of_thing, id):
@@ -117,6 +146,74 @@ class SimpleDatePrefixKeyBuilder(KeyBuilderBase):
         return keys
 
 
+class KeyLocationIndex(object):
+    """remembers at which of the keys built for a thing it was found, so
+    that the next fetch of that thing, or of a thing of the same kind from
+    the same day, tries that key first.
+
+    The positions are remembered by crash id for the 'size' most recently
+    fetched things, and by the date encoded in the crash id for all of them.
+    Things saved on the same day are all saved with the same layout, so the
+    date predicts the key of things never fetched before.  If 'pathname' is
+    set, the positions by date are kept in that file and outlive the
+    process."""
+
+    def __init__(self, size, pathname=''):
+        self.pathname = pathname
+        self._by_id = LRUCache(size)
+        self._by_date = {}
+        self._lock = threading.Lock()
+        if pathname:
+            self._load()
+
+    @staticmethod
+    def _date_key(name_of_thing, id):
+        datestamp = dateFromOoid(id)
+        if datestamp is None:
+            return None
+        return '%s/%s' % (name_of_thing, datestamp.strftime('%Y%m%d'))
+
+    def predict(self, name_of_thing, id):
+        """return the position of the key most likely to hold the thing, or
+        None if nothing is known about it"""
+        position = self._by_id.get((name_of_thing, id))
+        if position is None:
+            date_key = self._date_key(name_of_thing, id)
+            if date_key is not None:
+                with self._lock:
+                    position = self._by_date.get(date_key)
+        return position
+
+    def learn(self, name_of_thing, id, position):
+        """record the position of the key that held the thing"""
+        self._by_id.put((name_of_thing, id), position)
+        date_key = self._date_key(name_of_thing, id)
+        if date_key is None:
+            return
+        with self._lock:
+            if self._by_date.get(date_key) == position:
+                return
+            self._by_date[date_key] = position
+            if self.pathname:
+                self._save()
+
+    def _load(self):
+        try:
+            with open(self.pathname) as f:
+                self._by_date = json.load(f)
+        except (IOError, ValueError):
+            # a missing or damaged index only costs a few extra probes
+            # until it has been learned again
+            self._by_date = {}
+
+    def _save(self):
+        # written aside and renamed, so that a reader never sees half a file
+        temporary_pathname = '%s.tmp' % self.pathname
+        with open(temporary_pathname, 'w') as f:
+            json.dump(self._by_date, f)
+        os.rename(temporary_pathname, self.pathname)
+
+
 class ConnectionContextBase(RequiredConfig):
 
     required_config = Namespace()
@@ -159,6 +256,28 @@ class ConnectionContextBase(RequiredConfig):
         reference_value_from='resource.boto',
         likely_to_be_changed=True,
     )
+    required_config.add_option(
+        'number_of_fetch_threads',
+        doc="the maximum number of objects fetched at the same time by "
+            "'fetch_many'",
+        default=8,
+        reference_value_from='resource.boto',
+    )
+    required_config.add_option(
+        'key_location_index_size',
+        doc="the number of things whose key is remembered by id, so that "
+            "fetching them again tries the right key first",
+        default=10000,
+        reference_value_from='resource.boto',
+    )
+    required_config.add_option(
+        'key_location_index_pathname',
+        doc="a file in which to keep the keys that things were found at by "
+            "the date of their id, so that they outlive the process (leave "
+            "blank to keep them in memory only)",
+        default='',
+        reference_value_from='resource.boto',
+    )
 
     operational_exceptions = (
         socket.timeout,
@@ -190,9 +309,16 @@ class ConnectionContextBase(RequiredConfig):
             KeyNotFound
         )
         self.keybuilder = config.keybuilder_class()
+        self.key_location_index = KeyLocationIndex(
+            config.key_location_index_size,
+            config.key_location_index_pathname
+        )
 
         self._bucket_cache = {}
 
+        self._fetch_executor = None
+        self._fetch_executor_lock = threading.Lock()
+
     def _connect(self):
         try:
             return self.connection
@@ -227,12 +353,24 @@ class ConnectionContextBase(RequiredConfig):
             self._bucket_cache[bucket_name] = conn.create_bucket(bucket_name)
             return self._bucket_cache[bucket_name]
 
-    def submit(self, id, name_of_thing, thing):
+    def submit(self, id, name_of_thing, thing, content_encoding=None):
         """submit something to boto.
+
+        If 'content_encoding' is one of the 'content_codecs', the thing is
+        encoded with it and stored with a Content-Encoding header that
+        'fetch' uses to decode it.
         """
         # can only submit strings to boto
         assert isinstance(thing, basestring), type(thing)
 
+        if content_encoding:
+            try:
+                encode, decode = content_codecs[content_encoding]
+            except KeyError:
+                raise ValueError(
+                    'unknown content encoding: %r' % content_encoding
+                )
+
         conn = self._connect()
         bucket = self._get_or_create_bucket(conn, self.config.bucket_name)
 
@@ -240,19 +378,77 @@ class ConnectionContextBase(RequiredConfig):
         # Always submit using the first key
         key = all_keys[0]
         key_object = bucket.new_key(key)
-        key_object.set_contents_from_string(thing)
+        if content_encoding:
+            key_object.set_contents_from_string(
+                encode(thing),
+                headers={'Content-Encoding': content_encoding}
+            )
+        else:
+            key_object.set_contents_from_string(thing)
+        if len(all_keys) > 1:
+            self.key_location_index.learn(name_of_thing, id, 0)
 
     def fetch(self, id, name_of_thing):
-        """retrieve something from boto.
+        """retrieve something from boto.  Things that were stored with a
+        content encoding are decoded.
+        """
+        return self._fetch(id, name_of_thing, self._get_decoded_contents)
+
+    @staticmethod
+    def _get_decoded_contents(key_object):
+        contents = key_object.get_contents_as_string()
+        # the Content-Encoding header of the response is known once the
+        # contents have been read
+        if key_object.content_encoding in content_codecs:
+            encode, decode = content_codecs[key_object.content_encoding]
+            contents = decode(contents)
+        return contents
+
+    def fetch_to_file(self, id, name_of_thing, pathname):
+        """retrieve something from boto, streaming it into the file at
+        'pathname' rather than holding it in memory.  The file holds the
+        thing as it is stored, it is not decoded.
         """
+        self._fetch(
+            id,
+            name_of_thing,
+            lambda key_object: key_object.get_contents_to_filename(pathname)
+        )
+        return pathname
+
+    def _fetch(self, id, name_of_thing, get_contents):
         conn = self._connect()
         bucket = self._get_bucket(conn, self.config.bucket_name)
 
         all_keys = self.build_keys(self.config.prefix, name_of_thing, id)
-        for key in all_keys:
-            key_object = bucket.get_key(key)
-            if key_object is not None:
-                return key_object.get_contents_as_string()
+        positions = range(len(all_keys))
+        if len(all_keys) > 1:
+            predicted_position = self.key_location_index.predict(
+                name_of_thing,
+                id
+            )
+            if predicted_position in positions:
+                positions.remove(predicted_position)
+                positions.insert(0, predicted_position)
+        probes = 0
+        try:
+            for position in positions:
+                # without validation, 'get_key' doesn't make a HEAD request
+                # to find out if the key exists.  The GET answers that
+                # question.
+                key_object = bucket.get_key(all_keys[position], validate=False)
+                probes += 1
+                try:
+                    contents = get_contents(key_object)
+                except boto.exception.StorageResponseError as x:
+                    if x.status != 404:
+                        raise
+                    continue
+                if len(all_keys) > 1:
+                    self.key_location_index.learn(name_of_thing, id, position)
+                return contents
+        finally:
+            self._capture_stat('histogram', 'fetch.probes', probes)
 
         # None of the keys worked, so raise an error
         raise KeyNotFound(
@@ -263,6 +459,70 @@ class ConnectionContextBase(RequiredConfig):
             )
         )
 
+    def _capture_stat(self, method_name, key, value=1):
+        try:
+            metrics = self.config.metrics
+        except (AttributeError, KeyError):
+            # not every app that uses boto has metrics
+            return
+        try:
+            getattr(metrics, method_name)('boto.%s' % key, value)
+        except Exception:
+            # the stats are not worth failing a fetch over
+            self.config.logger.exception(
+                'something went wrong when capturing boto stats'
+            )
+
+    def _get_fetch_executor(self):
+        with self._fetch_executor_lock:
+            if self._fetch_executor is None:
+                self._fetch_executor = ThreadPoolExecutor(
+                    max_workers=self.config.number_of_fetch_threads
+                )
+            return self._fetch_executor
+
+    def fetch_many(self, id, names_of_things, optional=(), pathnames=None):
+        """retrieve several things from boto at the same time.
+
+        returns a mapping of the names of the things to what was fetched.
+        Things named in 'optional' are left out of it if they are not
+        found.  Any other thing that is not found raises KeyNotFound.
+
+        Things that have a pathname in 'pathnames' are streamed into that
+        file rather than held in memory, and the pathname is returned in
+        their place."""
+        if pathnames is None:
+            pathnames = {}
+        # connect before fanning out, so that the fetches share a connection
+        self._get_bucket(self._connect(), self.config.bucket_name)
+        executor = self._get_fetch_executor()
+        futures = {}
+        for name_of_thing in names_of_things:
+            if name_of_thing in pathnames:
+                futures[name_of_thing] = executor.submit(
+                    self.fetch_to_file,
+                    id,
+                    name_of_thing,
+                    pathnames[name_of_thing]
+                )
+            else:
+                futures[name_of_thing] = executor.submit(
+                    self.fetch,
+                    id,
+                    name_of_thing
+                )
+        # nothing is raised until every fetch is over, so that none is left
+        # writing to a file that the caller may want to clean up
+        concurrent.futures.wait(futures.values())
+        things = {}
+        for name_of_thing, future in futures.items():
+            try:
+                things[name_of_thing] = future.result()
+            except KeyNotFound:
+                if name_of_thing not in optional:
+                    raise
+        return things
+
     def _convert_mapping_to_string(self, a_mapping):
         return json.dumps(a_mapping, cls=JSONISOEncoder)
 
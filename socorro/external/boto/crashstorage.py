@@ -3,6 +3,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/
 
 import json
+import os
+import sys
 import time
 
 import json_schema_reducer
@@ -14,9 +16,11 @@ from configman.converters import class_converter, py_obj_to_str
 from socorro.external.crashstorage_base import (
     CrashStorageBase,
     CrashIDNotFound,
+    FileDumpsMapping,
     MemoryDumpsMapping,
 )
 from socorro.external.boto.connection_context import (
+    KeyNotFound,
     SimpleDatePrefixKeyBuilder
 )
 from socorro.external.es.super_search_fields import SuperSearchFields
@@ -74,6 +78,13 @@ class BotoCrashStorage(CrashStorageBase):
         default='socorro.lib.util.DotDict',
         from_string_converter=class_converter,
     )
+    required_config.add_option(
+        'processed_crash_content_encoding',
+        doc="the encoding of the processed crashes saved to boto: empty for "
+            "plain JSON, or 'gzip' to compress them.  Either way, they are "
+            "read back as JSON.",
+        default='',
+    )
 
     def is_operational_exception(self, x):
         if "not found, no value returned" in str(x):
@@ -145,7 +156,11 @@ class BotoCrashStorage(CrashStorageBase):
         self.transaction(self.do_save_raw_crash, raw_crash, dumps, crash_id)
 
     @staticmethod
-    def _do_save_processed(boto_connection, processed_crash):
+    def _do_save_processed(
+        boto_connection,
+        processed_crash,
+        content_encoding=None
+    ):
         crash_id = processed_crash['uuid']
         processed_crash_as_string = boto_connection._convert_mapping_to_string(
             processed_crash
@@ -153,11 +168,16 @@ class BotoCrashStorage(CrashStorageBase):
         boto_connection.submit(
             crash_id,
             "processed_crash",
-            processed_crash_as_string
+            processed_crash_as_string,
+            content_encoding=content_encoding
         )
 
     def save_processed(self, processed_crash):
-        self.transaction(self._do_save_processed, processed_crash)
+        self.transaction(
+            self._do_save_processed,
+            processed_crash,
+            content_encoding=self.config.processed_crash_content_encoding
+        )
 
     def save_raw_and_processed(
         self,
@@ -216,26 +236,76 @@ class BotoCrashStorage(CrashStorageBase):
         return self.transaction_for_get(self.do_get_raw_dump, crash_id, name)
 
     @staticmethod
-    def do_get_raw_dumps(boto_connection, crash_id):
+    def _fetch_dumps(boto_connection, crash_id, pathname_for=None):
+        """fetch all the dumps of a crash, in parallel.
+
+        returns a mapping of the dump names to the dumps.  If
+        'pathname_for', a function that gives the pathname of the file for
+        a dump name, is given, the dumps are streamed into files and the
+        mapping is to their pathnames."""
+        pathnames = {}
+
+        def get_pathnames(dump_names):
+            if pathname_for is not None:
+                for dump_name in dump_names:
+                    pathnames[dump_name] = pathname_for(dump_name)
+            return pathnames
+
         try:
-            dump_names_as_string = boto_connection.fetch(
+            # nearly every crash has a dump called 'dump', so it is fetched
+            # along with the names of the dumps rather than after them
+            things = boto_connection.fetch_many(
                 crash_id,
-                "dump_names"
-            )
-            dump_names = boto_connection._convert_string_to_list(
-                dump_names_as_string
+                ["dump_names", "dump"],
+                optional=("dump",),
+                pathnames=get_pathnames(["dump"])
             )
+            dump_names = [
+                'dump' if dump_name in (None, '', 'upload_file_minidump')
+                else dump_name
+                for dump_name in boto_connection._convert_string_to_list(
+                    things.pop("dump_names")
+                )
+            ]
+            other_dump_names = [x for x in dump_names if x not in things]
+            things.update(boto_connection.fetch_many(
+                crash_id,
+                other_dump_names,
+                pathnames=get_pathnames(other_dump_names)
+            ))
+            dumps = {}
+            for dump_name in dump_names:
+                if dump_name not in things:
+                    # 'dump' was fetched as optional
+                    raise KeyNotFound(
+                        '%s (%s) not found, no value returned' % (
+                            crash_id,
+                            dump_name
+                        )
+                    )
+                dumps[dump_name] = things[dump_name]
+        except BaseException:
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            for a_pathname in pathnames.values():
+                try:
+                    os.unlink(a_pathname)
+                except OSError:
+                    # never written
+                    pass
+            raise exc_type, exc_value, exc_tb
+        if 'dump' in pathnames and 'dump' in things and 'dump' not in dumps:
+            # fetched ahead, but it isn't one of this crash's dumps
+            os.unlink(pathnames['dump'])
+        return dumps
+
+    @staticmethod
+    def do_get_raw_dumps(boto_connection, crash_id):
+        try:
             # when we fetch the dumps, they are by default in memory, so we'll
             # put them into a MemoryDumpMapping.
-            dumps = MemoryDumpsMapping()
-            for dump_name in dump_names:
-                if dump_name in (None, '', 'upload_file_minidump'):
-                    dump_name = 'dump'
-                dumps[dump_name] = boto_connection.fetch(
-                    crash_id,
-                    dump_name
-                )
-            return dumps
+            return MemoryDumpsMapping(
+                BotoCrashStorage._fetch_dumps(boto_connection, crash_id)
+            )
         except boto_connection.ResponseError as x:
             raise CrashIDNotFound(
                 '%s not found: %s' % (crash_id, x)
@@ -245,10 +315,48 @@ class BotoCrashStorage(CrashStorageBase):
         """this returns a MemoryDumpsMapping"""
         return self.transaction_for_get(self.do_get_raw_dumps, crash_id)
 
+    @staticmethod
+    def do_get_raw_dumps_as_files(
+        boto_connection,
+        crash_id,
+        temp_path,
+        dump_file_suffix
+    ):
+        def file_dump_name(dump_name):
+            if dump_name == 'dump':
+                return 'upload_file_minidump'
+            return dump_name
+
+        def pathname_for(dump_name):
+            return os.path.join(
+                temp_path,
+                "%s.%s.TEMPORARY%s" % (
+                    crash_id,
+                    file_dump_name(dump_name),
+                    dump_file_suffix
+                )
+            )
+
+        try:
+            dumps = BotoCrashStorage._fetch_dumps(
+                boto_connection,
+                crash_id,
+                pathname_for
+            )
+        except boto_connection.ResponseError as x:
+            raise CrashIDNotFound(
+                '%s not found: %s' % (crash_id, x)
+            )
+        return FileDumpsMapping(
+            (file_dump_name(dump_name), pathname)
+            for dump_name, pathname in dumps.iteritems()
+        )
+
     def get_raw_dumps_as_files(self, crash_id):
-        in_memory_dumps = self.get_raw_dumps(crash_id)
-        # convert our native memory dump mapping into a file dump mapping.
-        return in_memory_dumps.as_file_dumps_mapping(
+        """this returns a FileDumpsMapping.  The dumps are streamed from
+        boto into files, so they are never held in memory."""
+        return self.transaction_for_get(
+            self.do_get_raw_dumps_as_files,
             crash_id,
             self.config.temporary_file_system_storage_path,
             self.config.dump_file_suffix
@@ -377,7 +485,11 @@ class TelemetryBotoS3CrashStorage(BotoS3CrashStorage):
         self.save_processed(crash_report)
 
     @staticmethod
-    def _do_save_processed(boto_connection, processed_crash):
+    def _do_save_processed(
+        boto_connection,
+        processed_crash,
+        content_encoding=None
+    ):
         """Overriding this method so we can control the "name of thing"
         prefix used to upload to S3."""
         crash_id = processed_crash['uuid']
@@ -387,7 +499,8 @@ class TelemetryBotoS3CrashStorage(BotoS3CrashStorage):
         boto_connection.submit(
             crash_id,
             "crash_report",
-            processed_crash_as_string
+            processed_crash_as_string,
+            content_encoding=content_encoding
         )
 
 
@@ -402,8 +515,14 @@ class SupportReasonAPIStorage(BotoS3CrashStorage):
     # name in the future.  Leaving this code in place for the moment
 
     @staticmethod
-    def _do_save_processed(boto_connection, processed_crash):
+    def _do_save_processed(
+        boto_connection,
+        processed_crash,
+        content_encoding=None
+    ):
         """Replaces the function of the same name in the parent class.
+        Support reasons are a few bytes read by another service, so they
+        are never encoded.
         """
         crash_id = processed_crash['uuid']
 
@@ -6,13 +6,21 @@
 saving, fetching and iterating over raw crashes, dumps and processed crashes.
 """
 
-import copy
 import sys
 import os
 import collections
 import datetime
+import json
+import threading
+import time
 
-from socorro.lib.util import DotDict as SocorroDotDict
+from concurrent.futures import ThreadPoolExecutor
+
+from socorro.lib.lru_cache import LRUCache
+from socorro.lib.util import (
+    CopyOnWriteDotDict,
+    DotDict as SocorroDotDict
+)
 
 from configman import Namespace, RequiredConfig
 from configman.converters import classes_in_namespaces_converter, \
@@ -20,25 +28,6 @@ from configman.converters import classes_in_namespaces_converter, \
 from configman.dotdict import DotDict as ConfigmanDotDict
 
 
-def socorrodotdict_to_dict(sdotdict):
-    """Takes a socorro.lib.util.DotDict and returns a dict
-
-    This does a complete object traversal converting all instances of the
-    things named DotDict to dict so it's deep-copyable.
-
-    """
-    def _dictify(thing):
-        if isinstance(thing, collections.Mapping):
-            return dict([(key, _dictify(val)) for key, val in thing.items()])
-        elif isinstance(thing, basestring):
-            return thing
-        elif isinstance(thing, collections.Sequence):
-            return [_dictify(item) for item in thing]
-        return thing
-
-    return _dictify(sdotdict)
-
-
 class MemoryDumpsMapping(dict):
     """there has been a bifurcation in the crash storage data throughout the
     history of the classes.  The crash dumps have two different
@@ -368,6 +357,11 @@ class CrashStorageBase(RequiredConfig):
         an item pulled from the 'new_crashes' generator. """
         return crash_id
 
+    def prefetch(self, crash_id):
+        """a hint that the crash will soon be fetched.  Overridden by
+        subclasses that can start fetching it ahead of time."""
+        pass
+
 
 class NullCrashStorage(CrashStorageBase):
     """a testing crashstorage that silently ignores everything it's told to do
@@ -494,6 +488,13 @@ class PolyCrashStorage(CrashStorageBase):
       ),
       likely_to_be_changed=True,
     )
+    required_config.add_option(
+      'maximum_concurrent_saves',
+      doc='the number of subordinate crash stores that '
+          'save_raw_and_processed may save to at the same time (0 saves to '
+          'them one after another)',
+      default=0,
+    )
 
     def __init__(self, config, quit_check_callback=None):
         """instantiate all the subordinate crashstorage instances
@@ -519,6 +520,30 @@ class PolyCrashStorage(CrashStorageBase):
                                       config[a_namespace],
                                       quit_check_callback
                                  )
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config.maximum_concurrent_saves
+                )
+            return self._executor
+
+    def _capture_stat(self, method_name, key, value=1):
+        try:
+            metrics = self.config.metrics
+        except (AttributeError, KeyError):
+            # not every app that saves crashes has metrics
+            return
+        try:
+            getattr(metrics, method_name)('crashstorage.poly.%s' % key, value)
+        except Exception:
+            # the stats are not worth failing a save over
+            self.logger.exception(
+                'something went wrong when capturing poly crash storage stats'
+            )
 
     def close(self):
         """iterate through the subordinate crash stores and close them.
@@ -531,6 +556,10 @@ class PolyCrashStorage(CrashStorageBase):
           PolyStorageError - an exception container holding a list of the
                              exceptions raised by the subordinate storage
                              systems"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
         storage_exception = PolyStorageError()
         for a_store in self.stores.itervalues():
             try:
@@ -582,56 +611,107 @@ class PolyCrashStorage(CrashStorageBase):
 
     def save_raw_and_processed(self, raw_crash, dump, processed_crash,
                                crash_id):
+        """save the crash to each of the subordinate crash stores.  If
+        'maximum_concurrent_saves' is set, up to that many of the stores are
+        saved to at the same time, so the save takes as long as the slowest
+        store rather than as long as all of them together.  Either way, the
+        exceptions raised by the stores are reraised together in a
+        PolyStorageError once every store has had its turn."""
         storage_exception = PolyStorageError()
 
-        # Later we're going to need to clone this per every crash storage
-        # in the loop. But, to save time, before we do that, convert the
-        # processed crash which is a SocorroDotDict into a pure python
-        # dict which we can more easily copy.deepcopy() operate on.
-        processed_crash_as_dict = socorrodotdict_to_dict(processed_crash)
-        raw_crash_as_dict = socorrodotdict_to_dict(raw_crash)
+        # a mutator gets crashes that it can change without the other stores
+        # seeing the changes.  Rather than deep copies, these copy only the
+        # parts of the crashes that the mutator looks at.  They are all made
+        # before any store has had a chance to change anything.
+        saves = []
+        for a_namespace, a_store in self.stores.iteritems():
+            actual_store = getattr(a_store, 'wrapped_object', a_store)
+            if (
+                hasattr(actual_store, 'is_mutator') and
+                actual_store.is_mutator()
+            ):
+                saves.append((a_namespace, a_store, (
+                    CopyOnWriteDotDict(raw_crash),
+                    dump,
+                    CopyOnWriteDotDict(processed_crash),
+                    crash_id
+                )))
+            else:
+                saves.append((a_namespace, a_store, (
+                    raw_crash,
+                    dump,
+                    processed_crash,
+                    crash_id
+                )))
 
-        for a_store in self.stores.itervalues():
+        if self.config.maximum_concurrent_saves:
             self.quit_check()
-            try:
-                actual_store = getattr(a_store, 'wrapped_object', a_store)
-
-                if hasattr(actual_store, 'is_mutator') and actual_store.is_mutator():
-                    # We do this because `a_store.save_raw_and_processed`
-                    # expects the processed crash to be a DotDict but
-                    # you can't deepcopy those, so we deepcopy the
-                    # pure dict version and then dress it back up as a
-                    # DotDict.
-                    my_processed_crash = SocorroDotDict(
-                        copy.deepcopy(processed_crash_as_dict)
-                    )
-                    my_raw_crash = SocorroDotDict(
-                        copy.deepcopy(raw_crash_as_dict)
+            executor = self._get_executor()
+            futures = [
+                (a_store, executor.submit(
+                    self._save_raw_and_processed_to,
+                    a_namespace,
+                    a_store,
+                    *save_args
+                ))
+                for a_namespace, a_store, save_args in saves
+            ]
+            for a_store, a_future in futures:
+                try:
+                    a_future.result()
+                except Exception:
+                    self._log_save_failure(a_store, crash_id)
+                    storage_exception.gather_current_exception()
+        else:
+            for a_namespace, a_store, save_args in saves:
+                self.quit_check()
+                try:
+                    self._save_raw_and_processed_to(
+                        a_namespace,
+                        a_store,
+                        *save_args
                     )
-                else:
-                    my_processed_crash = processed_crash
-                    my_raw_crash = raw_crash
-
-                a_store.save_raw_and_processed(
-                    my_raw_crash,
-                    dump,
-                    my_processed_crash,
-                    crash_id
-                )
-            except Exception:
-                store_class = getattr(
-                    a_store, 'wrapped_object', a_store.__class__
-                )
-                self.logger.error(
-                    '%r failed (crash id: %s)',
-                    store_class,
-                    crash_id,
-                    exc_info=True
-                )
-                storage_exception.gather_current_exception()
+                except Exception:
+                    self._log_save_failure(a_store, crash_id)
+                    storage_exception.gather_current_exception()
         if storage_exception.has_exceptions():
             raise storage_exception
 
+    def _save_raw_and_processed_to(
+        self,
+        namespace,
+        a_store,
+        raw_crash,
+        dump,
+        processed_crash,
+        crash_id
+    ):
+        start_time = time.time()
+        try:
+            a_store.save_raw_and_processed(
+                raw_crash,
+                dump,
+                processed_crash,
+                crash_id
+            )
+        finally:
+            self._capture_stat(
+                'histogram',
+                '%s.save_raw_and_processed_time' % namespace,
+                int((time.time() - start_time) * 1000)
+            )
+
+    def _log_save_failure(self, a_store, crash_id):
+        store_class = getattr(
+            a_store, 'wrapped_object', a_store.__class__
+        )
+        self.logger.error(
+            '%r failed (crash id: %s)',
+            store_class,
+            crash_id,
+            exc_info=True
+        )
+
 
 class FallbackCrashStorage(CrashStorageBase):
     """This storage system has a primary and fallback subordinate storage
@@ -1215,3 +1295,460 @@ class BenchmarkingCrashStorage(CrashStorageBase):
             self.tag,
             end_time - start_time
         )
+
+
+class _PrefetchedCrash(object):
+    """the raw crash and dumps of one crash fetched ahead of its use"""
+
+    def __init__(self, crash_id):
+        self.crash_id = crash_id
+        self.raw_crash = None
+        self.dumps = None
+        self.raw_crash_exc_info = None
+        self.dumps_exc_info = None
+        # the number of bytes of dumps held in memory
+        self.size = 0
+        self.fetched = threading.Event()
+        self.fetched_at = None
+
+    def discard(self):
+        """delete the dumps that were spilled to temporary files"""
+        if isinstance(self.dumps, FileDumpsMapping):
+            for a_pathname in self.dumps.itervalues():
+                try:
+                    os.unlink(a_pathname)
+                except OSError:
+                    pass
+
+
+class PrefetchingCrashStorage(CrashStorageBase):
+    """a wrapper around a crash store that fetches the raw crashes and dumps
+    of crashes ahead of their use.  The app that reads crash ids from a new
+    crash source tells its source about each crash id as it is queued by
+    calling 'prefetch'.  By the time a worker asks for the crash, it is
+    already in memory.
+
+    At most 'prefetch_size' crashes are held ahead.  Once the dumps held in
+    memory reach 'prefetch_memory_limit' bytes, the dumps of further crashes
+    are streamed to temporary files instead.  The limit can be overshot by
+    at most the dumps of the crashes that were already being fetched into
+    memory when it was reached.
+
+    Only the process that calls 'prefetch' can use what was prefetched, so
+    the app doesn't prefetch for task managers that fork their workers."""
+    required_config = Namespace()
+    required_config.add_option(
+        name="wrapped_crashstore",
+        doc="the crash store to fetch crashes from",
+        default='socorro.external.boto.crashstorage.BotoS3CrashStorage',
+        from_string_converter=class_converter
+    )
+    required_config.add_option(
+        name="prefetch_size",
+        doc="the maximum number of crashes to hold ahead of their use",
+        default=16,
+    )
+    required_config.add_option(
+        name="number_of_prefetch_threads",
+        doc="the number of crashes that can be fetching at the same time",
+        default=4,
+    )
+    required_config.add_option(
+        name="prefetch_memory_limit",
+        doc="the number of bytes of dumps to hold in memory before dumps are "
+            "spilled to temporary files",
+        default=256 * 1024 * 1024,
+    )
+    required_config.add_option(
+        name="prefetch_expiry",
+        doc="the number of seconds after which a prefetched crash that was "
+            "never asked for is discarded",
+        default=300,
+    )
+    required_config.add_option(
+        'temporary_file_system_storage_path',
+        doc='a local filesystem path where dumps temporarily '
+            'during processing',
+        default='/home/socorro/temp',
+        reference_value_from='resource.boto',
+    )
+    required_config.add_option(
+        'dump_file_suffix',
+        doc='the suffix used to identify a dump file (for use in temp files)',
+        default='.dump',
+        reference_value_from='resource.boto',
+    )
+
+    def __init__(self, config, quit_check_callback=None):
+        super(PrefetchingCrashStorage, self).__init__(
+            config,
+            quit_check_callback
+        )
+        self.wrapped_crashstore = config.wrapped_crashstore(
+            config,
+            quit_check_callback
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.number_of_prefetch_threads
+        )
+        # the prefetched crashes by crash_id
+        self._prefetched = {}
+        self._memory_in_use = 0
+        self._condition = threading.Condition()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self._condition:
+            for a_crash in self._prefetched.values():
+                a_crash.discard()
+            self._prefetched.clear()
+            self._memory_in_use = 0
+        self.wrapped_crashstore.close()
+
+    def prefetch(self, crash_id):
+        """start fetching a crash in the background.  This blocks while
+        'prefetch_size' crashes are already being held."""
+        with self._condition:
+            if crash_id in self._prefetched:
+                return
+            while len(self._prefetched) >= self.config.prefetch_size:
+                self._expire()
+                if len(self._prefetched) >= self.config.prefetch_size:
+                    self._condition.wait(1.0)
+                    self.quit_check()
+            a_crash = _PrefetchedCrash(crash_id)
+            self._prefetched[crash_id] = a_crash
+        self.executor.submit(self._fetch, a_crash)
+
+    def _expire(self):
+        """discard the prefetched crashes that nobody asked for in time.
+        Called with the condition held."""
+        now = time.time()
+        for crash_id, a_crash in self._prefetched.items():
+            if (
+                a_crash.fetched_at is not None and
+                now - a_crash.fetched_at >= self.config.prefetch_expiry
+            ):
+                self.logger.warning(
+                    'prefetched crash %s was never used, discarding it',
+                    crash_id
+                )
+                del self._prefetched[crash_id]
+                self._memory_in_use -= a_crash.size
+                a_crash.discard()
+
+    def _fetch(self, a_crash):
+        crash_id = a_crash.crash_id
+        try:
+            try:
+                a_crash.raw_crash = self.wrapped_crashstore.get_raw_crash(
+                    crash_id
+                )
+            except Exception:
+                a_crash.raw_crash_exc_info = sys.exc_info()
+                a_crash.dumps_exc_info = a_crash.raw_crash_exc_info
+                return
+            with self._condition:
+                spill = (
+                    self._memory_in_use >= self.config.prefetch_memory_limit
+                )
+            if spill:
+                a_crash.dumps = \
+                    self.wrapped_crashstore.get_raw_dumps_as_files(crash_id)
+            else:
+                dumps = self.wrapped_crashstore.get_raw_dumps(crash_id)
+                size = sum(len(x) for x in dumps.itervalues())
+                with self._condition:
+                    self._memory_in_use += size
+                    a_crash.size = size
+                a_crash.dumps = dumps
+        except Exception:
+            a_crash.dumps_exc_info = sys.exc_info()
+        finally:
+            a_crash.fetched_at = time.time()
+            a_crash.fetched.set()
+
+    def _wait_for(self, a_crash):
+        while not a_crash.fetched.wait(1.0):
+            self.quit_check()
+
+    def _take(self, crash_id):
+        """remove a prefetched crash from the buffer, waiting for it to be
+        fetched.  Returns None if the crash was not prefetched."""
+        with self._condition:
+            a_crash = self._prefetched.get(crash_id)
+        if a_crash is None:
+            return None
+        self._wait_for(a_crash)
+        with self._condition:
+            if self._prefetched.get(crash_id) is a_crash:
+                del self._prefetched[crash_id]
+                self._memory_in_use -= a_crash.size
+            self._condition.notify_all()
+        return a_crash
+
+    def save_raw_crash(self, raw_crash, dumps, crash_id):
+        self.wrapped_crashstore.save_raw_crash(raw_crash, dumps, crash_id)
+
+    def save_processed(self, processed_crash):
+        self.wrapped_crashstore.save_processed(processed_crash)
+
+    def save_raw_and_processed(self, raw_crash, dumps, processed_crash,
+                               crash_id):
+        self.wrapped_crashstore.save_raw_and_processed(
+            raw_crash,
+            dumps,
+            processed_crash,
+            crash_id
+        )
+
+    def get_raw_crash(self, crash_id):
+        with self._condition:
+            a_crash = self._prefetched.get(crash_id)
+        if a_crash is None:
+            return self.wrapped_crashstore.get_raw_crash(crash_id)
+        self._wait_for(a_crash)
+        if a_crash.raw_crash_exc_info is not None:
+            # nobody will ask for the dumps of a crash that couldn't be read
+            self._take(crash_id)
+            exc_type, exc_value, exc_tb = a_crash.raw_crash_exc_info
+            raise exc_type, exc_value, exc_tb
+        return a_crash.raw_crash
+
+    def get_raw_dump(self, crash_id, name=None):
+        return self.wrapped_crashstore.get_raw_dump(crash_id, name)
+
+    def get_raw_dumps(self, crash_id):
+        a_crash = self._take(crash_id)
+        if a_crash is None:
+            return self.wrapped_crashstore.get_raw_dumps(crash_id)
+        if a_crash.dumps_exc_info is not None:
+            exc_type, exc_value, exc_tb = a_crash.dumps_exc_info
+            raise exc_type, exc_value, exc_tb
+        if isinstance(a_crash.dumps, FileDumpsMapping):
+            try:
+                return a_crash.dumps.as_memory_dumps_mapping()
+            finally:
+                a_crash.discard()
+        return a_crash.dumps
+
+    def get_raw_dumps_as_files(self, crash_id):
+        a_crash = self._take(crash_id)
+        if a_crash is None:
+            return self.wrapped_crashstore.get_raw_dumps_as_files(crash_id)
+        if a_crash.dumps_exc_info is not None:
+            exc_type, exc_value, exc_tb = a_crash.dumps_exc_info
+            raise exc_type, exc_value, exc_tb
+        # the caller owns the temporary files from here on
+        return a_crash.dumps.as_file_dumps_mapping(
+            crash_id,
+            self.config.temporary_file_system_storage_path,
+            self.config.dump_file_suffix
+        )
+
+    def get_unredacted_processed(self, crash_id):
+        return self.wrapped_crashstore.get_unredacted_processed(crash_id)
+
+    def remove(self, crash_id):
+        a_crash = self._take(crash_id)
+        if a_crash is not None:
+            a_crash.discard()
+        self.wrapped_crashstore.remove(crash_id)
+
+    def new_crashes(self):
+        return self.wrapped_crashstore.new_crashes()
+
+    def ack_crash(self, crash_id):
+        return self.wrapped_crashstore.ack_crash(crash_id)
+
+
+def _copy_crash(thing):
+    """copy a crash, keeping the types of the mappings that it is made of.
+    copy.deepcopy can't be used on the DotDicts of socorro.lib.util."""
+    if isinstance(thing, dict):
+        return thing.__class__(
+            (key, _copy_crash(value)) for key, value in thing.iteritems()
+        )
+    if isinstance(thing, list):
+        return [_copy_crash(x) for x in thing]
+    return thing
+
+
+class CachingCrashStorage(CrashStorageBase):
+    """a read through cache in front of a crash store.  The raw and processed
+    crashes that are read from the wrapped crash store are kept in an LRU
+    cache bounded by the size of the crashes as JSON, so that asking for the
+    same crash again doesn't go back to the storage.  Crashes that were not
+    found are remembered too, for a shorter time.  Saving or removing a
+    crash through this crash store drops it from the cache, and keeps reads
+    that were under way from putting what they read back in.
+
+    Saves made by other processes can't be seen here, so a cached crash may
+    be up to 'cache_expiry' seconds out of date.  Dumps are too large to be
+    worth keeping and are always read from the wrapped crash store."""
+    required_config = Namespace()
+    required_config.add_option(
+        name="wrapped_crashstore",
+        doc="the crash store to read crashes from",
+        default='socorro.external.boto.crashstorage.BotoS3CrashStorage',
+        from_string_converter=class_converter
+    )
+    required_config.add_option(
+        name="cache_size_in_bytes",
+        doc="the maximum size, as JSON, of the raw and processed crashes to "
+            "cache",
+        default=64 * 1024 * 1024,
+    )
+    required_config.add_option(
+        name="cache_expiry",
+        doc="the number of seconds for which a cached crash is used",
+        default=600,
+    )
+    required_config.add_option(
+        name="cache_negative_expiry",
+        doc="the number of seconds for which a crash that was not found is "
+            "remembered as not found",
+        default=60,
+    )
+
+    # the cached value of a crash that was not found
+    _not_found = object()
+
+    def __init__(self, config, quit_check_callback=None):
+        super(CachingCrashStorage, self).__init__(
+            config,
+            quit_check_callback
+        )
+        self.wrapped_crashstore = config.wrapped_crashstore(
+            config,
+            quit_check_callback
+        )
+        self.cache = LRUCache(
+            None,
+            max_weight=config.cache_size_in_bytes
+        )
+        # for each key being read from the wrapped crash store, the number
+        # of times it has been invalidated since and the number of reads
+        self._reads_in_progress = {}
+        self._reads_lock = threading.Lock()
+
+    def close(self):
+        self.cache.clear()
+        self.wrapped_crashstore.close()
+
+    def _cached_get(self, kind, crash_id, get):
+        key = (kind, crash_id)
+        entry = self.cache.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if time.time() < expires_at:
+                if value is self._not_found:
+                    raise CrashIDNotFound(crash_id)
+                return _copy_crash(value)
+            self.cache.pop(key)
+        with self._reads_lock:
+            a_read = self._reads_in_progress.setdefault(key, [0, 0])
+            a_read[1] += 1
+            generation = a_read[0]
+        try:
+            value = get(crash_id)
+        except CrashIDNotFound:
+            self._put(
+                key,
+                generation,
+                self._not_found,
+                len(crash_id),
+                self.config.cache_negative_expiry
+            )
+            raise
+        except Exception:
+            self._put(key, generation)
+            raise
+        # the caller gets a copy so that changes it makes, like redacting a
+        # processed crash, don't leak into the cache
+        self._put(
+            key,
+            generation,
+            _copy_crash(value),
+            len(json.dumps(value, default=str)),
+            self.config.cache_expiry
+        )
+        return value
+
+    def _put(self, key, generation, value=None, size=0, expiry=0):
+        """end a read of the wrapped crash store, caching the value read
+        unless the crash was saved or removed while it was being read"""
+        with self._reads_lock:
+            a_read = self._reads_in_progress[key]
+            a_read[1] -= 1
+            if not a_read[1]:
+                del self._reads_in_progress[key]
+            if value is not None and a_read[0] == generation:
+                self.cache.put(key, (value, time.time() + expiry), size)
+
+    def _invalidate(self, crash_id, *kinds):
+        with self._reads_lock:
+            for a_kind in kinds:
+                key = (a_kind, crash_id)
+                self.cache.pop(key)
+                if key in self._reads_in_progress:
+                    self._reads_in_progress[key][0] += 1
+
+    def save_raw_crash(self, raw_crash, dumps, crash_id):
+        try:
+            self.wrapped_crashstore.save_raw_crash(raw_crash, dumps, crash_id)
+        finally:
+            self._invalidate(crash_id, 'raw_crash')
+
+    def save_processed(self, processed_crash):
+        try:
+            self.wrapped_crashstore.save_processed(processed_crash)
+        finally:
+            self._invalidate(processed_crash['uuid'], 'processed_crash')
+
+    def save_raw_and_processed(self, raw_crash, dumps, processed_crash,
+                               crash_id):
+        try:
+            self.wrapped_crashstore.save_raw_and_processed(
+                raw_crash,
+                dumps,
+                processed_crash,
+                crash_id
+            )
+        finally:
+            self._invalidate(crash_id, 'raw_crash', 'processed_crash')
+
+    def get_raw_crash(self, crash_id):
+        return self._cached_get(
+            'raw_crash',
+            crash_id,
+            self.wrapped_crashstore.get_raw_crash
+        )
+
+    def get_raw_dump(self, crash_id, name=None):
+        return self.wrapped_crashstore.get_raw_dump(crash_id, name)
+
+    def get_raw_dumps(self, crash_id):
+        return self.wrapped_crashstore.get_raw_dumps(crash_id)
+
+    def get_raw_dumps_as_files(self, crash_id):
+        return self.wrapped_crashstore.get_raw_dumps_as_files(crash_id)
+
+    def get_unredacted_processed(self, crash_id):
+        return self._cached_get(
+            'processed_crash',
+            crash_id,
+            self.wrapped_crashstore.get_unredacted_processed
+        )
+
+    def remove(self, crash_id):
+        try:
+            self.wrapped_crashstore.remove(crash_id)
+        finally:
+            self._invalidate(crash_id, 'raw_crash', 'processed_crash')
+
+    def new_crashes(self):
+        return self.wrapped_crashstore.new_crashes()
+
+    def ack_crash(self, crash_id):
+        return self.wrapped_crashstore.ack_crash(crash_id)
@@ -16,7 +16,9 @@ class ElasticsearchConfig(App):
     required_config.elasticsearch.add_option(
         'elasticsearch_class',
         doc='a class that implements the ES connection object',
-        default='socorro.external.es.connection_context.ConnectionContext',
+        default=(
+            'socorro.external.es.connection_context.ConnectionContextPooled'
+        ),
         from_string_converter=class_converter
     )
     required_config.elasticsearch.add_option(
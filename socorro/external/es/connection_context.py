@@ -3,6 +3,10 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import contextlib
+import os
+import threading
+import time
+
 import elasticsearch
 
 from configman import Namespace, RequiredConfig
@@ -126,3 +130,212 @@ class ConnectionContext(RequiredConfig):
     def __call__(self, name=None, timeout=None):
         conn = self.connection(name, timeout)
         yield conn
+
+
+class PoolCheckoutTimeout(elasticsearch.exceptions.ConnectionError):
+    """raised when no client could be taken from a full pool in time.  Like
+    other connection errors, it can be retried."""
+
+
+class _ClientPool(object):
+    """the Elasticsearch clients for one set of hosts and one timeout"""
+
+    def __init__(self):
+        # a list of (client, time it was returned)
+        self.idle = []
+        # the number of clients, idle or in use
+        self.number_of_clients = 0
+        self.condition = threading.Condition()
+
+
+# the pools are shared by all the connection contexts of a process, so that
+# the services that make a new connection context for each request can reuse
+# the clients of the requests before them.  They are keyed by the process id,
+# the hosts and the timeout of their clients: a forked process starts with a
+# copy of its parent's pools, whose clients are the parent's to use.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionContextPooled(ConnectionContext):
+    """a connection context that keeps its Elasticsearch clients, and so the
+    keep-alive HTTP sessions to each host held by their transports, for
+    reuse.  Creating a client for every use pays for new TCP and TLS
+    connections each time.
+
+    A client is taken from the pool for the duration of a 'with' block,
+    waiting up to 'elasticsearch_pool_checkout_timeout' seconds for one to
+    be returned if 'elasticsearch_pool_size' of them are in use.  The
+    clients are thread safe, so one that is still used after the end of its
+    block, as those returned by the 'get_connection' methods of the services
+    are, does no harm.  Clients that fail with an
+    operational exception, or that have been idle for too long, are closed
+    rather than reused."""
+
+    required_config = Namespace()
+    required_config.add_option(
+        'elasticsearch_pool_size',
+        default=8,
+        doc='the maximum number of elasticsearch clients for each timeout',
+        reference_value_from='resource.elasticsearch',
+    )
+    required_config.add_option(
+        'elasticsearch_pool_checkout_timeout',
+        default=30,
+        doc='the number of seconds to wait for an elasticsearch client when '
+            'they are all in use',
+        reference_value_from='resource.elasticsearch',
+    )
+    required_config.add_option(
+        'elasticsearch_pool_max_idle',
+        default=300,
+        doc='the number of seconds after which an idle elasticsearch client '
+            'is closed rather than reused',
+        reference_value_from='resource.elasticsearch',
+    )
+
+    def _get_pool(self, timeout):
+        key = (os.getpid(), tuple(self.config.elasticsearch_urls), timeout)
+        with _pools_lock:
+            try:
+                return _pools[key]
+            except KeyError:
+                _pools[key] = _ClientPool()
+                return _pools[key]
+
+    def _capture_stat(self, method_name, key, value=1):
+        try:
+            metrics = self.config.metrics
+        except (AttributeError, KeyError):
+            # not every app that uses elasticsearch has metrics
+            return
+        try:
+            getattr(metrics, method_name)(
+                'elasticsearch.pool.%s' % key,
+                value
+            )
+        except Exception:
+            # the stats are not worth failing a save or a search over
+            self.config.logger.exception(
+                'something went wrong when capturing elasticsearch pool stats'
+            )
+
+    def _checkout(self, pool, timeout):
+        """take an idle client from the pool, creating one if there are none
+        and the pool isn't full.  Otherwise, wait for one to be returned."""
+        waited = False
+        started = time.time()
+        deadline = started + self.config.elasticsearch_pool_checkout_timeout
+        try:
+            with pool.condition:
+                while True:
+                    client = self._take_idle(pool)
+                    if client is not None:
+                        self._capture_stat('increment', 'reuse')
+                        break
+                    if (
+                        pool.number_of_clients <
+                        self.config.elasticsearch_pool_size
+                    ):
+                        # there's room for a new one, reserve its place
+                        pool.number_of_clients += 1
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._capture_stat('increment', 'timeout')
+                        raise PoolCheckoutTimeout(
+                            'N/A',
+                            'no elasticsearch client was returned to the '
+                            'pool within %s seconds' %
+                            self.config.elasticsearch_pool_checkout_timeout,
+                            None
+                        )
+                    waited = True
+                    pool.condition.wait(min(remaining, 1.0))
+        finally:
+            if waited:
+                self._capture_stat(
+                    'timing',
+                    'wait',
+                    (time.time() - started) * 1000.0
+                )
+        if client is None:
+            try:
+                client = super(ConnectionContextPooled, self).connection(
+                    timeout=timeout
+                )
+            except Exception:
+                with pool.condition:
+                    pool.number_of_clients -= 1
+                    pool.condition.notify()
+                raise
+            self._capture_stat('increment', 'new')
+        return client
+
+    def _take_idle(self, pool):
+        """return the most recently used idle client that hasn't been idle
+        for too long, or None.  Called with the condition of the pool
+        held."""
+        while pool.idle:
+            client, returned_at = pool.idle.pop()
+            if (
+                time.time() - returned_at <
+                self.config.elasticsearch_pool_max_idle
+            ):
+                return client
+            self._discard(pool, client, 'expired')
+        return None
+
+    def _checkin(self, pool, client):
+        with pool.condition:
+            pool.idle.append((client, time.time()))
+            pool.condition.notify()
+
+    def _discard(self, pool, client, reason):
+        """close a client that won't be reused.  Called with the condition
+        of the pool held."""
+        pool.number_of_clients -= 1
+        pool.condition.notify()
+        self._capture_stat('increment', reason)
+        try:
+            client.transport.close()
+        except Exception:
+            self.config.logger.debug(
+                'failed closing an elasticsearch client',
+                exc_info=True
+            )
+
+    def connection(self, name=None, timeout=None):
+        """return a client from the pool.  A client returned this way is
+        shared rather than taken: it goes straight back in the pool."""
+        if timeout is None:
+            timeout = self.config.elasticsearch_timeout
+        pool = self._get_pool(timeout)
+        client = self._checkout(pool, timeout)
+        self._checkin(pool, client)
+        return client
+
+    def force_reconnect(self):
+        """called by the transaction executors after any error they retry.
+        The client that failed was already discarded when its 'with' block
+        ended, so nothing is done here.  Flushing the pools would close the
+        clients of every other thread of the process, and a checkout timeout
+        would turn into a storm of new connections."""
+
+    @contextlib.contextmanager
+    def __call__(self, name=None, timeout=None):
+        if timeout is None:
+            timeout = self.config.elasticsearch_timeout
+        pool = self._get_pool(timeout)
+        client = self._checkout(pool, timeout)
+        try:
+            yield client
+        except self.operational_exceptions:
+            with pool.condition:
+                self._discard(pool, client, 'evicted')
+            raise
+        except BaseException:
+            self._checkin(pool, client)
+            raise
+        else:
+            self._checkin(pool, client)
@@ -3,12 +3,18 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import json
+import os
 import re
-from threading import Thread
-from Queue import Queue
+import sys
+import time
+from threading import BoundedSemaphore, Thread
+from Queue import Empty, Queue
 from contextlib import contextmanager
 
 import elasticsearch
+import elasticsearch.helpers
+import elasticsearch.serializer
+from concurrent.futures import ThreadPoolExecutor
 from configman import Namespace
 from configman.converters import class_converter, list_converter
 
@@ -53,6 +59,11 @@ def is_valid_key(key):
     return bool(VALID_KEY.match(key))
 
 
+# the serializer of the Elasticsearch client, whose encoding of dates is the
+# one the mappings expect
+_es_serializer = elasticsearch.serializer.JSONSerializer()
+
+
 class ESCrashStorage(CrashStorageBase):
     """This sends raw and processed crash reports to Elasticsearch."""
 
@@ -74,7 +85,9 @@ class ESCrashStorage(CrashStorageBase):
     required_config.elasticsearch = Namespace()
     required_config.elasticsearch.add_option(
         'elasticsearch_class',
-        default='socorro.external.es.connection_context.ConnectionContext',
+        default=(
+            'socorro.external.es.connection_context.ConnectionContextPooled'
+        ),
         from_string_converter=class_converter,
         reference_value_from='resource.elasticsearch',
     )
@@ -124,6 +137,12 @@ class ESCrashStorage(CrashStorageBase):
 
         return index
 
+    def is_mutator(self):
+        # The datetimes of the processed crash are reconstituted, bad keys
+        # are removed from the raw crash and fields that Elasticsearch
+        # rejects are removed, all in place.
+        return True
+
     def save_raw_and_processed(self, raw_crash, dumps, processed_crash,
                                crash_id):
         """This is the only write mechanism that is actually employed in normal
@@ -136,34 +155,61 @@ class ESCrashStorage(CrashStorageBase):
             'raw_crash': raw_crash
         }
 
-        # NOTE(willkg): this is a hard-coded keyname to match what the statsdbenchmarkingwrapper
-        # produces for processor crashstorage classes. This is only used in that context, so we're
-        # hard-coding this now rather than figuring out a better way to carry that name through.
-        try:
-            self.config.metrics.histogram(
-                'processor.es.raw_crash_size',
-                len(json.dumps(raw_crash, cls=JsonDTEncoder))
-            )
-        except Exception:
-            # NOTE(willkg): An error here shouldn't screw up saving data. Log it so we can fix it
-            # later.
-            self.config.logger.exception('something went wrong when capturing raw_crash_size')
-
-        try:
-            self.config.metrics.histogram(
-                'processor.es.processed_crash_size',
-                len(json.dumps(processed_crash, cls=JsonDTEncoder))
-            )
-        except Exception:
-            # NOTE(willkg): An error here shouldn't screw up saving data. Log it so we can fix it
-            # later.
-            self.config.logger.exception('something went wrong when capturing raw_crash_size')
-
         self.transaction(
             self._submit_crash_to_elasticsearch,
             crash_document=crash_document
         )
 
+    def serialize_crash_document(self, crash_document, capture_sizes=False):
+        """Return a crash document as a string of JSON that the
+        Elasticsearch client sends as is.
+
+        The raw and processed crashes are each encoded once, the way the
+        client would have encoded them, and the sizes of those encodings are
+        captured if `capture_sizes` is True.
+        """
+        raw_crash_json = self._dumps(crash_document['raw_crash'])
+        processed_crash_json = self._dumps(crash_document['processed_crash'])
+
+        if capture_sizes:
+            # NOTE(willkg): this is a hard-coded keyname to match what the
+            # statsdbenchmarkingwrapper produces for processor crashstorage
+            # classes. This is only used in that context, so we're hard-coding
+            # this now rather than figuring out a better way to carry that
+            # name through.
+            try:
+                self.config.metrics.histogram(
+                    'processor.es.raw_crash_size',
+                    len(raw_crash_json)
+                )
+                self.config.metrics.histogram(
+                    'processor.es.processed_crash_size',
+                    len(processed_crash_json)
+                )
+            except Exception:
+                # NOTE(willkg): An error here shouldn't screw up saving data.
+                # Log it so we can fix it later.
+                self.config.logger.exception('something went wrong when capturing crash sizes')
+
+        other_fields = dict(
+            (key, value) for key, value in crash_document.items()
+            if key not in ('raw_crash', 'processed_crash')
+        )
+        # the other fields always include the crash_id, so their encoding
+        # is never an empty object
+        return '{"raw_crash": %s, "processed_crash": %s, %s' % (
+            raw_crash_json,
+            processed_crash_json,
+            self._dumps(other_fields)[1:]
+        )
+
+    @staticmethod
+    def _dumps(data):
+        try:
+            return json.dumps(data, default=_es_serializer.default)
+        except (ValueError, TypeError) as x:
+            raise elasticsearch.exceptions.SerializationError(data, x)
+
     @staticmethod
     def reconstitute_datetimes(processed_crash):
         datetime_fields = [
@@ -209,6 +255,57 @@ class ESCrashStorage(CrashStorageBase):
             if not is_valid_key(key):
                 del data[key]
 
+    @classmethod
+    def get_field_name_from_error(cls, error):
+        """Return the name of the field that caused an indexing error, if it
+        is an error that removing that field will fix, or None.
+        """
+        field_name = None
+
+        if 'MaxBytesLengthExceededException' in error:
+            # This is caused by a string that is way too long for
+            # Elasticsearch.
+            matches = cls.field_name_string_error_re.findall(error)
+            if matches:
+                field_name = matches[0]
+        elif 'NumberFormatException' in error:
+            # This is caused by a number that is either too big for
+            # Elasticsearch or just not a number.
+            matches = cls.field_name_number_error_re.findall(error)
+            if matches:
+                field_name = matches[0]
+
+        if field_name and field_name.endswith('.full'):
+            # Remove the `.full` at the end, that is a special mapping
+            # construct that is not part of the real field name.
+            field_name = field_name[:-len('.full')]
+
+        return field_name
+
+    @staticmethod
+    def remove_field(crash_document, field_name):
+        """Remove a field, given by its dotted path, from a crash document and
+        add a note in the document that it has been removed.
+        """
+        field_path = field_name.split('.')
+        parent = crash_document
+        for i, field in enumerate(field_path):
+            if i == len(field_path) - 1:
+                # This is the last level, so `field` contains the name
+                # of the field that we want to remove from `parent`.
+                del parent[field]
+            else:
+                parent = parent[field]
+
+        # Add a note in the document that a field has been removed.
+        if crash_document.get('removed_fields'):
+            crash_document['removed_fields'] = '{} {}'.format(
+                crash_document['removed_fields'],
+                field_name
+            )
+        else:
+            crash_document['removed_fields'] = field_name
+
     def _submit_crash_to_elasticsearch(self, connection, crash_document):
         """Submit a crash report to elasticsearch.
         """
@@ -239,25 +336,15 @@ class ESCrashStorage(CrashStorageBase):
                 connection.index(
                     index=es_index,
                     doc_type=es_doctype,
-                    body=crash_document,
+                    body=self.serialize_crash_document(
+                        crash_document,
+                        capture_sizes=(attempt == 0)
+                    ),
                     id=crash_id
                 )
                 break
             except elasticsearch.exceptions.TransportError as e:
-                field_name = None
-
-                if 'MaxBytesLengthExceededException' in e.error:
-                    # This is caused by a string that is way too long for
-                    # Elasticsearch.
-                    matches = self.field_name_string_error_re.findall(e.error)
-                    if matches:
-                        field_name = matches[0]
-                elif 'NumberFormatException' in e.error:
-                    # This is caused by a number that is either too big for
-                    # Elasticsearch or just not a number.
-                    matches = self.field_name_number_error_re.findall(e.error)
-                    if matches:
-                        field_name = matches[0]
+                field_name = self.get_field_name_from_error(e.error)
 
                 if not field_name:
                     # We are unable to parse which field to remove, we cannot
@@ -270,30 +357,7 @@ class ESCrashStorage(CrashStorageBase):
                     )
                     raise
 
-                if field_name.endswith('.full'):
-                    # Remove the `.full` at the end, that is a special mapping
-                    # construct that is not part of the real field name.
-                    field_name = field_name.rstrip('.full')
-
-                # Now remove that field from the document before trying again.
-                field_path = field_name.split('.')
-                parent = crash_document
-                for i, field in enumerate(field_path):
-                    if i == len(field_path) - 1:
-                        # This is the last level, so `field` contains the name
-                        # of the field that we want to remove from `parent`.
-                        del parent[field]
-                    else:
-                        parent = parent[field]
-
-                # Add a note in the document that a field has been removed.
-                if crash_document.get('removed_fields'):
-                    crash_document['removed_fields'] = '{} {}'.format(
-                        crash_document['removed_fields'],
-                        field_name
-                    )
-                else:
-                    crash_document['removed_fields'] = field_name
+                self.remove_field(crash_document, field_name)
             except elasticsearch.exceptions.ElasticsearchException as e:
                 self.config.logger.critical(
                     'Submission to Elasticsearch failed for %s (%s)',
@@ -345,10 +409,6 @@ class ESCrashStorageRedactedSave(ESCrashStorage):
             "find the modified processed crash saved to the other crashstores."
         )
 
-    def is_mutator(self):
-        # This crash storage mutates the crash, so we mark it as such.
-        return True
-
     def save_raw_and_processed(self, raw_crash, dumps, processed_crash,
                                crash_id):
         """This is the only write mechanism that is actually employed in normal
@@ -455,6 +515,29 @@ class QueueContextSource(object):
     conditional_exceptions = ()
 
 
+class _BulkItem(object):
+    """a crash document waiting to be sent to Elasticsearch in bulk, along
+    with its serialized form"""
+
+    def __init__(self, es_index, es_doctype, crash_id, crash_document,
+                 serialized):
+        self.es_index = es_index
+        self.es_doctype = es_doctype
+        self.crash_id = crash_id
+        self.crash_document = crash_document
+        # the client sends strings as they are, so the document is
+        # serialized once, and its size in the batch is known
+        self.serialized = serialized
+
+    def as_action(self):
+        return {
+            '_index': self.es_index,
+            '_type': self.es_doctype,
+            '_id': self.crash_id,
+            '_source': self.serialized,
+        }
+
+
 def _create_bulk_load_crashstore(base_class):
 
     class ESBulkClassTemplate(base_class):
@@ -464,12 +547,43 @@ def _create_bulk_load_crashstore(base_class):
             default=500,
             doc="the number of crashes that triggers a flush to ES"
         )
+        required_config.add_option(
+            'bytes_per_bulk_load',
+            default=10 * 1024 * 1024,
+            doc="the size in bytes of serialized crashes that triggers a "
+                "flush to ES"
+        )
+        required_config.add_option(
+            'bulk_load_max_latency',
+            default=5.0,
+            doc="the maximum number of seconds a crash waits for a flush to ES"
+        )
+        required_config.add_option(
+            'number_of_bulk_load_threads',
+            default=2,
+            doc="the number of flushes to ES that can run at the same time"
+        )
+        required_config.add_option(
+            'bulk_load_retries',
+            default=3,
+            doc="the number of times a crash that failed to be indexed is "
+                "tried again"
+        )
+        required_config.add_option(
+            'dead_letter_path',
+            default='',
+            doc="a local filesystem path where crashes that could not be "
+                "indexed are written as JSON (leave empty to only log them)"
+        )
         required_config.add_option(
             'maximum_queue_size',
             default=512,
             doc='the maximum size of the internal queue'
         )
 
+        # the statuses of bulk items that may succeed if they are tried again
+        retryable_statuses = (429, 503)
+
         def __init__(self, config, quit_check_callback=None):
             super(ESBulkClassTemplate, self).__init__(
                 config,
@@ -481,6 +595,14 @@ def _create_bulk_load_crashstore(base_class):
                 name="ConsumingThread",
                 target=self._consuming_thread_func
             )
+            self.bulk_executor = ThreadPoolExecutor(
+                max_workers=config.number_of_bulk_load_threads
+            )
+            # the batches being flushed are bounded, so the consuming thread
+            # stops reading the queue when ES can't keep up
+            self.flush_slots = BoundedSemaphore(
+                config.number_of_bulk_load_threads
+            )
 
             # overwrites original
             self.transaction = config.transaction_executor_class(
@@ -498,6 +620,9 @@ def _create_bulk_load_crashstore(base_class):
             # report.
             self.reconstitute_datetimes(crash_document['processed_crash'])
 
+            # Remove bad keys from the raw crash.
+            self.remove_bad_keys(crash_document['raw_crash'])
+
             # Obtain the index name.
             es_index = self.get_index_for_crash(
                 crash_document['processed_crash']['date_processed']
@@ -512,46 +637,203 @@ def _create_bulk_load_crashstore(base_class):
                 )
                 index_creator.create_socorro_index(es_index)
 
-            action = {
-                '_index': es_index,
-                '_type': es_doctype,
-                '_id': crash_id,
-                '_source': crash_document,
-            }
-            queue.put(action)
+            queue.put(_BulkItem(
+                es_index,
+                es_doctype,
+                crash_id,
+                crash_document,
+                self.serialize_crash_document(
+                    crash_document,
+                    capture_sizes=True
+                )
+            ))
 
-        def _consumer_iter(self):
+        def close(self):
+            self.task_queue.put(None)
+            self.consuming_thread.join()
+
+        def _consuming_thread_func(self):
+            """read the queue into batches, flushing a batch to ES when it
+            has enough crashes, enough bytes or has waited long enough"""
+            batch = []
+            batch_size = 0
+            batch_started = None
             while True:
+                if batch:
+                    timeout = max(
+                        0,
+                        batch_started + self.config.bulk_load_max_latency -
+                        time.time()
+                    )
+                else:
+                    timeout = None
                 try:
-                    crash_document = self.task_queue.get()
+                    item = self.task_queue.get(timeout=timeout)
+                except Empty:
+                    self._flush(batch)
+                    batch, batch_size = [], 0
+                    continue
                 except Exception:
                     self.config.logger.critical(
                         "Failure in ES Bulktask_queue",
                         exc_info=True
                     )
-                    crash_document = None
-                if crash_document is None:
-                    self.done = True
+                    item = None
+                if item is None:
                     break
-                yield crash_document  # execute the task
-
-        def close(self):
-            self.task_queue.put(None)
-            self.consuming_thread.join()
-
-        def _consuming_thread_func(self):  # execute the bulk load
-            with self.es_context() as es:
-                try:
-                    elasticsearch.helpers.bulk(
+                if not batch:
+                    batch_started = time.time()
+                batch.append(item)
+                batch_size += len(item.serialized)
+                if (
+                    len(batch) >= self.config.items_per_bulk_load or
+                    batch_size >= self.config.bytes_per_bulk_load
+                ):
+                    self._flush(batch)
+                    batch, batch_size = [], 0
+            if batch:
+                self._flush(batch)
+            self.bulk_executor.shutdown(wait=True)
+            self.done = True
+
+        def _flush(self, batch):
+            self.flush_slots.acquire()
+            try:
+                self.bulk_executor.submit(self._send_batch, batch)
+            except Exception:
+                self.flush_slots.release()
+                self.config.logger.critical(
+                    "Failure in ES bulk flush",
+                    exc_info=True
+                )
+                for item in batch:
+                    self._dead_letter(item, 'the flush could not be started')
+
+        def _send_batch(self, batch):
+            """send a batch to ES, trying again the crashes that failed for a
+            reason that can be fixed or that may go away.  Crashes that
+            can't be indexed are dead lettered."""
+            # the crashes of the current round that failed, and how many of
+            # them have been dead lettered or kept to be tried again
+            failures, settled = [], 0
+            try:
+                for attempt in range(self.config.bulk_load_retries + 1):
+                    failures, settled = self._bulk(batch), 0
+                    batch = []
+                    must_wait = False
+                    for settled, (item, status, error) in enumerate(failures):
+                        if attempt == self.config.bulk_load_retries:
+                            self._dead_letter(item, error)
+                            continue
+                        field_name = self.get_field_name_from_error(error)
+                        if field_name:
+                            try:
+                                self.remove_field(
+                                    item.crash_document,
+                                    field_name
+                                )
+                            except (KeyError, TypeError):
+                                self._dead_letter(item, error)
+                                continue
+                            item.serialized = self.serialize_crash_document(
+                                item.crash_document
+                            )
+                            batch.append(item)
+                        elif (
+                            status is None or
+                            status in self.retryable_statuses
+                        ):
+                            must_wait = True
+                            batch.append(item)
+                        else:
+                            self._dead_letter(item, error)
+                    failures = []
+                    if not batch:
+                        break
+                    if must_wait:
+                        time.sleep(attempt + 1)
+            except Exception:
+                self.config.logger.critical(
+                    "Failure in ES bulk load",
+                    exc_info=True
+                )
+                unsettled = batch + [
+                    item for item, status, error in failures[settled:]
+                ]
+                for item in unsettled:
+                    self._dead_letter(item, 'failure in ES bulk load')
+            finally:
+                self.flush_slots.release()
+
+        def _bulk(self, batch):
+            """send one bulk request to ES.
+
+            returns:
+                a list of (item, status, error) for the crashes that failed.
+                The status is None if the whole request failed."""
+            items_by_id = dict((item.crash_id, item) for item in batch)
+            try:
+                with self.es_context() as es:
+                    success_count, errors = elasticsearch.helpers.bulk(
                         es,
-                        self._consumer_iter(),
-                        chunk_size=self.config.items_per_bulk_load
+                        [item.as_action() for item in batch],
+                        chunk_size=len(batch),
+                        max_chunk_bytes=sys.maxint,
+                        raise_on_error=False,
                     )
-                except Exception:
-                    self.config.logger.critical(
-                        "Failure in ES elasticsearch.helpers.bulk",
-                        exc_info=True
+            except elasticsearch.exceptions.ElasticsearchException as x:
+                self.config.logger.warning(
+                    "Failure in ES elasticsearch.helpers.bulk",
+                    exc_info=True
+                )
+                return [(item, None, str(x)) for item in batch]
+            failures = []
+            for an_error in errors:
+                # each error is keyed by its operation, 'index' here
+                details = an_error.values()[0]
+                error = details.get('error', '')
+                if not isinstance(error, basestring):
+                    error = json.dumps(error)
+                failures.append((
+                    items_by_id[details['_id']],
+                    details.get('status'),
+                    error
+                ))
+            return failures
+
+        def _dead_letter(self, item, error):
+            """give up on a crash, writing it to the dead letter path, if
+            there is one, so that it can be indexed later"""
+            self.config.logger.critical(
+                'Submission to Elasticsearch failed for %s (%s)',
+                item.crash_id,
+                error
+            )
+            if not self.config.dead_letter_path:
+                return
+            pathname = os.path.join(
+                self.config.dead_letter_path,
+                '%s.json' % item.crash_id
+            )
+            try:
+                with open(pathname, 'w') as f:
+                    json.dump(
+                        {
+                            '_index': item.es_index,
+                            '_type': item.es_doctype,
+                            '_id': item.crash_id,
+                            'error': error,
+                            '_source': item.crash_document,
+                        },
+                        f,
+                        cls=JsonDTEncoder
                     )
+            except (IOError, OSError):
+                self.config.logger.error(
+                    'failed to write %s to the dead letter path',
+                    item.crash_id,
+                    exc_info=True
+                )
 
     return ESBulkClassTemplate
 
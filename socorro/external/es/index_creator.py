@@ -38,7 +38,9 @@ class IndexCreator(RequiredConfig):
     required_config.elasticsearch = Namespace()
     required_config.elasticsearch.add_option(
         'elasticsearch_class',
-        default='socorro.external.es.connection_context.ConnectionContext',
+        default=(
+            'socorro.external.es.connection_context.ConnectionContextPooled'
+        ),
         from_string_converter=class_converter,
         reference_value_from='resource.elasticsearch',
     )
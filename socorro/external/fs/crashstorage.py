@@ -2,12 +2,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import collections
 import datetime
 import json
+import mmap
 import os
 import gzip
 import shutil
 import stat
+import struct
+import threading
+import zlib
 
 from contextlib import contextmanager, closing
 
@@ -16,6 +21,17 @@ try:
 except ImportError:
     from StringIO import StringIO
 
+try:
+    # inotify is only available on Linux
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
 from configman import Namespace, class_converter
 from socorro.external.crashstorage_base import (
     CrashStorageBase,
@@ -372,11 +388,45 @@ class FSDatedRadixTreeStorage(FSRadixTreeStorage):
         default=4,
         reference_value_from='resource.fs',
     )
-
+    required_config.add_option(
+        'watch_for_new_crashes',
+        doc='whether new_crashes should watch the date branches with inotify '
+            'for new crashes rather than scan them on every call',
+        default=False,
+        reference_value_from='resource.fs',
+    )
+    required_config.add_option(
+        'new_crash_wait_time',
+        doc='the number of seconds that a watching new_crashes waits for a '
+            'new crash before it returns',
+        default=1.0,
+        reference_value_from='resource.fs',
+    )
     # This is just a constant for len(self._current_slot()).
     SLOT_DEPTH = 2
     DIR_DEPTH = 2
 
+    def __init__(self, config, quit_check_callback=None):
+        super(FSDatedRadixTreeStorage, self).__init__(
+            config,
+            quit_check_callback
+        )
+        self._notifier = None
+        self._watch_unavailable = False
+        # the paths that inotify reported as created in the date branches
+        self._created_paths = collections.deque()
+        self._rescan_needed = True
+        # the slots in use that the last scan didn't look in
+        self._skipped_slots = []
+        # the slot directories that watching found crashes in
+        self._watched_slots = set()
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        super(FSDatedRadixTreeStorage, self).close()
+
     def _get_current_date(self):
         date = utc_now()
         return "%02d%02d%02d" % (date.year, date.month, date.day)
@@ -474,33 +524,63 @@ class FSDatedRadixTreeStorage(FSRadixTreeStorage):
         # Now we actually remove the crash.
         super(FSDatedRadixTreeStorage, self).remove(crash_id)
 
+    @staticmethod
+    def _list_directory(path):
+        """return a list of (name, is_symlink, is_dir) for the entries of a
+        directory.  scandir gets the types of the entries with the listing
+        rather than with a stat of each of them."""
+        if scandir is not None:
+            return [
+                (x.name, x.is_symlink(), x.is_dir(follow_symlinks=False))
+                for x in scandir(path)
+            ]
+        entries = []
+        for name in os.listdir(path):
+            try:
+                mode = os.lstat(os.sep.join([path, name])).st_mode
+            except OSError:
+                # it went away since the listing
+                continue
+            entries.append((name, stat.S_ISLNK(mode), stat.S_ISDIR(mode)))
+        return entries
+
     def _visit_minute_slot(self, minute_slot_base):
-        for crash_id in os.listdir(minute_slot_base):
+        for name, is_symlink, is_dir in self._list_directory(
+            minute_slot_base
+        ):
+            for x in self._visit_slot_entry(
+                minute_slot_base,
+                name,
+                is_symlink,
+                is_dir
+            ):
+                yield x
+
+    def _visit_slot_entry(self, minute_slot_base, crash_id, is_symlink,
+                          is_dir):
+        if is_symlink:
             namedir = os.sep.join([minute_slot_base, crash_id])
-            st_result = os.lstat(namedir)
-
-            if stat.S_ISLNK(st_result.st_mode):
-                # This is a link, so we can dereference it to find
-                # crashes.
-                if os.path.isfile(
-                    os.sep.join([namedir,
-                                 crash_id +
-                                 self.config.json_file_suffix])):
-                    date_root_path = os.sep.join([
-                        namedir,
-                        self._get_date_root_name(crash_id)
-                    ])
-                    yield crash_id
+            # This is a link, so we can dereference it to find
+            # crashes.
+            if os.path.isfile(
+                os.sep.join([namedir,
+                             crash_id +
+                             self.config.json_file_suffix])):
+                date_root_path = os.sep.join([
+                    namedir,
+                    self._get_date_root_name(crash_id)
+                ])
+                yield crash_id
 
-                    try:
-                        os.unlink(date_root_path)
-                    except OSError:
-                        self.logger.error("could not find a date root in "
-                                          "%s; is crash corrupt?",
-                                          namedir,
-                                          exc_info=True)
+                try:
+                    os.unlink(date_root_path)
+                except OSError:
+                    self.logger.error("could not find a date root in "
+                                      "%s; is crash corrupt?",
+                                      namedir,
+                                      exc_info=True)
 
-                    os.unlink(namedir)
+                os.unlink(namedir)
 
     def new_crashes(self):
         """
@@ -515,9 +595,21 @@ class FSDatedRadixTreeStorage(FSRadixTreeStorage):
         * if the directory does, then we remove the symlink in the slot,
           clean up the parent directories if they're empty and then yield
           the crash_id.
+
+        If ``watch_for_new_crashes`` is set and inotify is available, the
+        date root is traversed only on the first call.  From then on, the
+        generator visits the crashes that inotify reports as they arrive,
+        and returns once none has arrived for ``new_crash_wait_time``
+        seconds.
         """
+        if self.config.watch_for_new_crashes and self._start_watching():
+            return self._watched_new_crashes()
+        return self._scanned_new_crashes()
+
+    def _scanned_new_crashes(self):
         current_slot = self._current_slot()
         current_date = self. _get_current_date()
+        self._skipped_slots = []
 
         dates = os.listdir(self.config.fs_root)
         for date in dates:
@@ -546,6 +638,7 @@ class FSDatedRadixTreeStorage(FSRadixTreeStorage):
                         self.logger.info("not processing slot: %s/%s" %
                                          tuple(slot))
                         skip_dir = True
+                        self._skipped_slots.append(minute_slot_base)
                         continue
 
                     for x in self._visit_minute_slot(minute_slot_base):
@@ -573,6 +666,153 @@ class FSDatedRadixTreeStorage(FSRadixTreeStorage):
                                           hour_slot_base,
                                           exc_info=True)
 
+    def _outside_date_branches(self, path):
+        """the exclude filter of the inotify watches.  Only the date branches
+        are watched, never the much larger name branches."""
+        parts = os.path.relpath(path, self.config.fs_root).split(os.sep)
+        return len(parts) > 1 and parts[1] != self.config.date_branch_base
+
+    def _start_watching(self):
+        """start watching the date branches with inotify, if that hasn't
+        been done yet.  Returns False if they can't be watched."""
+        if self._notifier is not None:
+            return True
+        if self._watch_unavailable:
+            return False
+        if pyinotify is None:
+            self.logger.warning(
+                'pyinotify is not available, new crashes will be found by '
+                'scanning %s',
+                self.config.fs_root
+            )
+            self._watch_unavailable = True
+            return False
+        notifier = None
+        try:
+            watch_manager = pyinotify.WatchManager()
+            notifier = pyinotify.Notifier(
+                watch_manager,
+                default_proc_fun=self._on_inotify_event
+            )
+
+            def add_watch(path, rec=False):
+                watch_manager.add_watch(
+                    path,
+                    pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO,
+                    rec=rec,
+                    auto_add=True,
+                    exclude_filter=self._outside_date_branches,
+                    quiet=False
+                )
+
+            # the date roots are watched one level at a time so that the
+            # name branches are never walked
+            add_watch(self.config.fs_root)
+            for date in os.listdir(self.config.fs_root):
+                date_root = os.sep.join([self.config.fs_root, date])
+                if not os.path.isdir(date_root):
+                    continue
+                add_watch(date_root)
+                dated_base = os.sep.join([
+                    date_root,
+                    self.config.date_branch_base
+                ])
+                if os.path.isdir(dated_base):
+                    add_watch(dated_base, rec=True)
+        except (pyinotify.WatchManagerError, OSError, IOError):
+            self.logger.warning(
+                'could not watch %s for new crashes, they will be found by '
+                'scanning',
+                self.config.fs_root,
+                exc_info=True
+            )
+            if notifier is not None:
+                notifier.stop()
+            self._watch_unavailable = True
+            return False
+        self._notifier = notifier
+        # crashes that arrived before the watches were made are found by
+        # one last scan
+        self._rescan_needed = True
+        return True
+
+    def _on_inotify_event(self, event):
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            # events were lost, only a scan can find their crashes
+            self.logger.warning('inotify queue overflowed, rescanning')
+            self._rescan_needed = True
+        else:
+            self._created_paths.append(event.pathname)
+
+    def _watched_new_crashes(self):
+        if self._rescan_needed:
+            self._rescan_needed = False
+            self._created_paths.clear()
+            for x in self._scanned_new_crashes():
+                yield x
+            # the crashes already in the slots in use have no events of
+            # their own, they are visited like a newly created directory
+            self._created_paths.extend(self._skipped_slots)
+        self._remove_watched_slots()
+        wait_time = int(self.config.new_crash_wait_time * 1000)
+        while True:
+            if self._notifier.check_events(
+                timeout=0 if self._created_paths else wait_time
+            ):
+                self._notifier.read_events()
+                self._notifier.process_events()
+            if self._rescan_needed or not self._created_paths:
+                return
+            while self._created_paths:
+                for x in self._visit_created_path(
+                    self._created_paths.popleft()
+                ):
+                    yield x
+
+    def _visit_created_path(self, path):
+        try:
+            mode = os.lstat(path).st_mode
+        except OSError:
+            # it was visited and removed already
+            return
+        if stat.S_ISDIR(mode):
+            # entries made before a new directory was watched have no events
+            # of their own
+            for name, is_symlink, is_dir in self._list_directory(path):
+                self._created_paths.append(os.sep.join([path, name]))
+            return
+        slot_base, name = os.path.split(path)
+        self._watched_slots.add(slot_base)
+        for x in self._visit_slot_entry(
+            slot_base,
+            name,
+            stat.S_ISLNK(mode),
+            False
+        ):
+            yield x
+
+    def _remove_watched_slots(self):
+        """remove the slot directories that watching found crashes in, once
+        they are no longer in use"""
+        current_slot = self._current_slot()
+        for slot_base in sorted(self._watched_slots, reverse=True):
+            parts = os.path.relpath(
+                slot_base,
+                self.config.fs_root
+            ).split(os.sep)
+            # date/date_branch_base/hour/minute_slot[/webhead_slot]
+            if parts[2:4] >= current_slot:
+                continue
+            self._watched_slots.discard(slot_base)
+            try:
+                os.rmdir(slot_base)
+                if len(parts) > 4:
+                    # a webhead slot, its minute slot may be empty now too
+                    os.rmdir(os.path.dirname(slot_base))
+            except OSError:
+                # it is not empty, the next scan will look in it
+                pass
+
 
 class FSLegacyDatedRadixTreeStorage(FSDatedRadixTreeStorage,
                                     FSLegacyRadixTreeStorage):
@@ -606,58 +846,57 @@ class FSLegacyDatedRadixTreeStorage(FSDatedRadixTreeStorage,
                                                                  slot),
                                 crash_id]))
 
-    def _visit_minute_slot(self, minute_slot_base):
-        for crash_id_or_webhead in os.listdir(minute_slot_base):
-            namedir = os.sep.join([minute_slot_base, crash_id_or_webhead])
-            st_result = os.lstat(namedir)
-
-            if stat.S_ISLNK(st_result.st_mode):
-                crash_id = crash_id_or_webhead
-
-                # This is a link, so we can dereference it to find
-                # crashes.
-                if os.path.isfile(
-                    os.sep.join([namedir,
-                                 crash_id +
-                                 self.config.json_file_suffix])):
-                    date_root_path = os.sep.join([
-                        namedir,
-                        self._get_date_root_name(crash_id)
-                    ])
-
-                    yield crash_id
+    def _visit_slot_entry(self, minute_slot_base, crash_id_or_webhead,
+                          is_symlink, is_dir):
+        namedir = os.sep.join([minute_slot_base, crash_id_or_webhead])
 
-                    try:
-                        os.unlink(date_root_path)
-                    except OSError:
-                        self.logger.error("could not find a date root in "
-                                          "%s; is crash corrupt?",
-                                          date_root_path,
-                                          exc_info=True)
-                # Bug 971496 - by outdenting this line one level we make sure
-                # that we can delete any orphan symlinks created by duplicate
-                # crash_ids in the file system
-                os.unlink(namedir)
+        if is_symlink:
+            crash_id = crash_id_or_webhead
 
-            elif stat.S_ISDIR(st_result.st_mode):
-                webhead_slot = crash_id_or_webhead
-                webhead_slot_base = os.sep.join([minute_slot_base,
-                                                 webhead_slot])
+            # This is a link, so we can dereference it to find
+            # crashes.
+            if os.path.isfile(
+                os.sep.join([namedir,
+                             crash_id +
+                             self.config.json_file_suffix])):
+                date_root_path = os.sep.join([
+                    namedir,
+                    self._get_date_root_name(crash_id)
+                ])
 
-                # This is actually a webhead slot, but we can visit it as if
-                # it was a minute slot.
-                for x in self._visit_minute_slot(webhead_slot_base):
-                    yield x
+                yield crash_id
 
                 try:
-                    os.rmdir(webhead_slot_base)
+                    os.unlink(date_root_path)
                 except OSError:
-                    self.logger.error("could not fully remove directory: "
-                                      "%s; are there more crashes in it?",
-                                      webhead_slot_base,
+                    self.logger.error("could not find a date root in "
+                                      "%s; is crash corrupt?",
+                                      date_root_path,
                                       exc_info=True)
-            else:
-                self.logger.critical("unknown file %s found", namedir)
+            # Bug 971496 - by outdenting this line one level we make sure
+            # that we can delete any orphan symlinks created by duplicate
+            # crash_ids in the file system
+            os.unlink(namedir)
+
+        elif is_dir:
+            webhead_slot = crash_id_or_webhead
+            webhead_slot_base = os.sep.join([minute_slot_base,
+                                             webhead_slot])
+
+            # This is actually a webhead slot, but we can visit it as if
+            # it was a minute slot.
+            for x in self._visit_minute_slot(webhead_slot_base):
+                yield x
+
+            try:
+                os.rmdir(webhead_slot_base)
+            except OSError:
+                self.logger.error("could not fully remove directory: "
+                                  "%s; are there more crashes in it?",
+                                  webhead_slot_base,
+                                  exc_info=True)
+        else:
+            self.logger.critical("unknown file %s found", namedir)
 
 
 class FSTemporaryStorage(FSLegacyDatedRadixTreeStorage):
@@ -801,3 +1040,201 @@ class TarFileSequentialReadingCrashStore(CrashStorageBase):
         reconstituted_processed_crash_as_str = result_gzip_fp.read().strip()
         processed_crash = json.loads(reconstituted_processed_crash_as_str)
         return processed_crash
+
+
+# the first bytes of an indexed crash archive, and its last
+ARCHIVE_MAGIC = 'SOCARCV1'
+# the end of an indexed crash archive: the offset and the length of its index
+# and the magic again
+_ARCHIVE_TRAILER = struct.Struct('<QQ8s')
+
+
+class IndexedArchiveWritingCrashStore(CrashStorageBase):
+    """writes processed crashes to an archive from which an
+    IndexedArchiveReadingCrashStore can later fetch any one of them without
+    reading the others.  The archive is laid out as:
+
+        magic | block | block | ... | index | trailer
+
+    The processed crashes are encoded as JSON and packed into blocks of
+    about 'block_size' bytes.  Each block is compressed with zlib unless
+    'compress_blocks' is off.  Compressing many crashes together lets zlib
+    make use of what they have in common.  The index maps each crash_id to
+    its block and its place within the block.  It is written when the store
+    is closed, and the trailer at the end of the file says where it is.  An
+    archive that was never closed has no trailer and can't be read."""
+    required_config = Namespace()
+    required_config.add_option(
+        name='archive_name',
+        doc='pathname to the target archive',
+        default=datetime.datetime.now().strftime("%Y%m%d") + '.archive'
+    )
+    required_config.add_option(
+        name='block_size',
+        doc='the number of bytes of crashes to pack into each block',
+        default=1024 * 1024
+    )
+    required_config.add_option(
+        name='compress_blocks',
+        doc='whether to compress the blocks of crashes with zlib',
+        default=True
+    )
+
+    def __init__(self, config, quit_check_callback=None):
+        super(IndexedArchiveWritingCrashStore, self).__init__(
+            config,
+            quit_check_callback
+        )
+        self.archive_fp = open(config.archive_name, 'wb')
+        self.archive_fp.write(ARCHIVE_MAGIC)
+        # [block offset, block length, offset in block, length] by crash_id
+        self._index = {}
+        self._block = []
+        # (crash_id, offset in block, length) of the crashes in the block
+        self._block_crashes = []
+        self._block_size = 0
+        self._lock = threading.Lock()
+
+    def save_processed(self, processed_crash):
+        crash_id = processed_crash['crash_id']
+        processed_crash_as_string = json.dumps(
+            processed_crash,
+            default=dates_to_strings_for_json
+        )
+        with self._lock:
+            self._block_crashes.append(
+                (crash_id, self._block_size, len(processed_crash_as_string))
+            )
+            self._block.append(processed_crash_as_string)
+            self._block_size += len(processed_crash_as_string)
+            if self._block_size >= self.config.block_size:
+                self._write_block()
+        self.config.logger.debug(
+            'IndexedArchiveWritingCrashStore saved - %s to %s',
+            crash_id,
+            self.config.archive_name
+        )
+
+    def _write_block(self):
+        if not self._block:
+            return
+        block = ''.join(self._block)
+        if self.config.compress_blocks:
+            block = zlib.compress(block)
+        block_offset = self.archive_fp.tell()
+        self.archive_fp.write(block)
+        for crash_id, offset, length in self._block_crashes:
+            self._index[crash_id] = [block_offset, len(block), offset, length]
+        self._block = []
+        self._block_crashes = []
+        self._block_size = 0
+
+    def close(self):
+        """write the last block, the index and the trailer"""
+        with self._lock:
+            if self.archive_fp is None:
+                return
+            self._write_block()
+            index = zlib.compress(json.dumps({
+                'compressed': self.config.compress_blocks,
+                'crashes': self._index,
+            }))
+            index_offset = self.archive_fp.tell()
+            self.archive_fp.write(index)
+            self.archive_fp.write(
+                _ARCHIVE_TRAILER.pack(index_offset, len(index), ARCHIVE_MAGIC)
+            )
+            self.archive_fp.close()
+            self.archive_fp = None
+
+
+class IndexedArchiveReadingCrashStore(CrashStorageBase):
+    """fetches the processed crashes of an archive written by the
+    IndexedArchiveWritingCrashStore in any order.  The archive is mapped
+    into memory, so fetching a crash reads only its block.  The last block
+    decompressed is kept, as crashes are often fetched in the order that
+    they were archived.  'new_crashes' yields the crash_ids in that order."""
+    required_config = Namespace()
+    required_config.add_option(
+        name='archive_name',
+        doc='pathname to the source archive',
+        default='crashes.archive'
+    )
+
+    def __init__(self, config, quit_check_callback=None):
+        super(IndexedArchiveReadingCrashStore, self).__init__(
+            config,
+            quit_check_callback
+        )
+        self.archive_fp = open(config.archive_name, 'rb')
+        try:
+            self.archive = mmap.mmap(
+                self.archive_fp.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+            self._read_index()
+        except Exception:
+            self.close()
+            raise
+        self._lock = threading.Lock()
+        self._cached_block_offset = None
+        self._cached_block = None
+
+    def _read_index(self):
+        archive = self.archive
+        if (
+            len(archive) < len(ARCHIVE_MAGIC) + _ARCHIVE_TRAILER.size or
+            archive[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC
+        ):
+            raise ValueError(
+                '%s is not a crash archive' % self.config.archive_name
+            )
+        index_offset, index_length, magic = _ARCHIVE_TRAILER.unpack(
+            archive[-_ARCHIVE_TRAILER.size:]
+        )
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(
+                '%s is not a complete crash archive' % self.config.archive_name
+            )
+        index = json.loads(zlib.decompress(
+            archive[index_offset:index_offset + index_length]
+        ))
+        self.compressed = index['compressed']
+        self.index = index['crashes']
+
+    def close(self):
+        if getattr(self, 'archive', None) is not None:
+            self.archive.close()
+            self.archive = None
+        self.archive_fp.close()
+
+    def _get_block(self, block_offset, block_length):
+        with self._lock:
+            if block_offset != self._cached_block_offset:
+                self._cached_block = zlib.decompress(
+                    self.archive[block_offset:block_offset + block_length]
+                )
+                self._cached_block_offset = block_offset
+            return self._cached_block
+
+    def get_unredacted_processed(self, crash_id):
+        """this method returns an unredacted processed crash"""
+        try:
+            block_offset, block_length, offset, length = self.index[crash_id]
+        except KeyError:
+            raise CrashIDNotFound(crash_id)
+        if self.compressed:
+            block = self._get_block(block_offset, block_length)
+        else:
+            # uncompressed crashes are read straight from the mapping
+            block = self.archive
+            offset += block_offset
+        return json.loads(block[offset:offset + length], object_hook=DotDict)
+
+    def new_crashes(self):
+        for crash_id in sorted(
+            self.index,
+            key=lambda x: self.index[x][0::2]
+        ):
+            yield crash_id
@@ -20,9 +20,11 @@ class MetricsBase(RequiredConfig):
 
         def capture_stats(self, data_items):
 
+        def increment(self, key, value=1):
 
-    This method should never throw an exception. This method should return
-    nothing.
+
+    These methods should never throw an exception. These methods should
+    return nothing.
 
     """
 
@@ -42,3 +44,15 @@ class MetricsBase(RequiredConfig):
 
         """
         pass
+
+    def increment(self, key, value=1):
+        """Adds to a counter
+
+        This is for counting events. For example, how often a processor rule
+        trapped an exception.
+
+        :arg key: the name of the counter
+        :arg value: the amount to add to the counter
+
+        """
+        pass
@@ -5,6 +5,8 @@
 import os
 import socket
 import contextlib
+import threading
+import time
 import psycopg2
 import psycopg2.extensions
 from urlparse import urlparse
@@ -175,60 +177,326 @@ class ConnectionContext(RequiredConfig):
         pass
 
 
-class ConnectionContextPooled(ConnectionContext):  # pragma: no cover
-    """a configman compliant class that pools Postgres database connections"""
-    def __init__(self, config, local_config=None):
-        super(ConnectionContextPooled, self).__init__(config, local_config)
-        #self.config.logger.debug("PostgresPooled - "
-        #                         "setting up connection pool")
-        self.pool = {}
+class PoolCheckoutTimeout(psycopg2.OperationalError):
+    """raised when no connection could be taken from a full pool in time.
+    Like other operational errors, it can be retried."""
+
+
+class _ConnectionPool(object):
+    """the connections to one database"""
+
+    def __init__(self):
+        # a list of (connection, time it was made, time it was returned)
+        self.idle = []
+        # the number of connections, idle or in use
+        self.number_of_connections = 0
+        self.condition = threading.Condition()
+
+
+# the pools are shared by all the connection contexts of a process, so that
+# the services that make a new connection context for each request can reuse
+# the connections of the requests before them.  They are keyed by the process
+# id and the dsn of their connections: a forked process starts with a copy of
+# its parent's pools, whose connections are the parent's to use.
+_pools = {}
+_pools_lock = threading.Lock()
+
 
-    def connection(self, name=None):
-        """return a named connection.
+class PooledConnection(object):
+    """a facade in front of a psycopg2 connection taken from a pool.
+    Closing it puts the connection back in the pool rather than closing
+    it, so code written for plain connections returns them by closing
+    them."""
 
-        This function will return a named connection by either finding one
-        in its pool by the name or creating a new one.  If no name is given,
-        it will use the name of the current executing thread as the name of
-        the connection.
+    def __init__(self, context, pool, connection, created_at):
+        self._context = context
+        self._pool = pool
+        self._connection = connection
+        self._created_at = created_at
+
+    def close(self):
+        """return the connection to the pool"""
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._context._checkin(self._pool, connection, self._created_at)
+
+    def discard(self):
+        """really close the connection, it won't be reused"""
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            with self._pool.condition:
+                self._context._discard(self._pool, connection, 'evicted')
+
+    @property
+    def closed(self):
+        if self._connection is None:
+            return 1
+        return self._connection.closed
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise psycopg2.InterfaceError('connection already closed')
+        return getattr(self._connection, name)
+
+
+class ConnectionContextPooled(ConnectionContext):
+    """a configman compliant class that pools Postgres database connections.
+
+    A connection is taken from the pool for the duration of a 'with' block,
+    or from a call to 'connection' until the connection is closed.  No more
+    than 'database_pool_max_size' connections are made to a database; when
+    they are all in use, taking one waits up to
+    'database_pool_checkout_timeout' seconds for one to be returned.
+
+    A connection is rolled back when it is returned, and checked with a
+    trivial query when it is taken after being idle for a while.
+    Connections that are broken, that have been idle too long or that have
+    reached their maximum lifetime are closed rather than reused."""
+
+    required_config = Namespace()
+    required_config.add_option(
+        'database_pool_min_size',
+        default=0,
+        doc='the number of idle connections kept open however long they '
+            'are idle',
+        reference_value_from='resource.postgresql',
+    )
+    required_config.add_option(
+        'database_pool_max_size',
+        default=10,
+        doc='the maximum number of connections to the database',
+        reference_value_from='resource.postgresql',
+    )
+    required_config.add_option(
+        'database_pool_checkout_timeout',
+        default=30,
+        doc='the number of seconds to wait for a connection when they are '
+            'all in use',
+        reference_value_from='resource.postgresql',
+    )
+    required_config.add_option(
+        'database_pool_max_idle',
+        default=300,
+        doc='the number of seconds after which an idle connection is closed',
+        reference_value_from='resource.postgresql',
+    )
+    required_config.add_option(
+        'database_pool_max_lifetime',
+        default=3600,
+        doc='the number of seconds after which a connection is closed once '
+            'it is returned',
+        reference_value_from='resource.postgresql',
+    )
+    required_config.add_option(
+        'database_pool_validation_interval',
+        default=30,
+        doc='the number of seconds a connection can be idle before it is '
+            'checked with a query when it is taken from the pool',
+        reference_value_from='resource.postgresql',
+    )
+
+    @property
+    def pool(self):
+        key = (os.getpid(), self.dsn)
+        with _pools_lock:
+            try:
+                return _pools[key]
+            except KeyError:
+                _pools[key] = _ConnectionPool()
+                return _pools[key]
+
+    def _capture_stat(self, method_name, key, value=1):
+        try:
+            metrics = self.config.metrics
+        except (AttributeError, KeyError):
+            # not every app that uses postgres has metrics
+            return
+        try:
+            getattr(metrics, method_name)('postgresql.pool.%s' % key, value)
+        except Exception:
+            # the stats are not worth failing a transaction over
+            self.config.logger.exception(
+                'something went wrong when capturing postgresql pool stats'
+            )
+
+    def connection(self, name_unused=None):
+        """return a connection taken from the pool.  Closing it returns it
+        to the pool.
 
         parameters:
-            name - a name as a string
+            name_unused - connections used to be named for the thread that
+                          used them, connections are no longer tied to a
+                          thread
         """
-        if not name:
-            name = self.config.executor_identity()
-        if name in self.pool:
-            #self.config.logger.debug('connection: %s', name)
-            return self.pool[name]
-        self.pool[name] = \
-            super(ConnectionContextPooled, self).connection(name)
-        return self.pool[name]
+        pool = self.pool
+        while True:
+            connection, created_at, needs_validation = self._reserve(pool)
+            if connection is None:
+                created_at = time.time()
+                try:
+                    connection = super(
+                        ConnectionContextPooled,
+                        self
+                    ).connection()
+                except Exception:
+                    with pool.condition:
+                        pool.number_of_connections -= 1
+                        pool.condition.notify()
+                    raise
+                self._capture_stat('increment', 'new')
+                break
+            if not needs_validation or self._is_usable(connection):
+                self._capture_stat('increment', 'reuse')
+                break
+            with pool.condition:
+                self._discard(pool, connection, 'invalid')
+        return PooledConnection(self, pool, connection, created_at)
+
+    def _reserve(self, pool):
+        """take an idle connection from the pool or, if there are none and
+        the pool isn't full, reserve the place of a new one.  Otherwise,
+        wait for a connection to be returned.
+
+        returns a tuple of the connection (None for a new one), the time it
+        was made and whether it has to be validated"""
+        started = time.time()
+        deadline = started + self.config.database_pool_checkout_timeout
+        waited = False
+        try:
+            with pool.condition:
+                while True:
+                    self._reap(pool)
+                    if pool.idle:
+                        connection, created_at, returned_at = pool.idle.pop()
+                        return (
+                            connection,
+                            created_at,
+                            time.time() - returned_at >=
+                            self.config.database_pool_validation_interval
+                        )
+                    if (
+                        pool.number_of_connections <
+                        self.config.database_pool_max_size
+                    ):
+                        pool.number_of_connections += 1
+                        return None, None, False
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._capture_stat('increment', 'timeout')
+                        raise PoolCheckoutTimeout(
+                            'no connection to the database was returned to '
+                            'the pool within %s seconds' %
+                            self.config.database_pool_checkout_timeout
+                        )
+                    waited = True
+                    pool.condition.wait(min(remaining, 1.0))
+        finally:
+            if waited:
+                self._capture_stat(
+                    'timing',
+                    'wait',
+                    (time.time() - started) * 1000.0
+                )
+
+    def _is_usable(self, connection):
+        try:
+            with connection.cursor() as a_cursor:
+                a_cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reap(self, pool):
+        """close the idle connections that have been idle too long or have
+        lived too long.  Called with the condition of the pool held."""
+        now = time.time()
+        for an_item in list(pool.idle):
+            connection, created_at, returned_at = an_item
+            if (
+                now - created_at >= self.config.database_pool_max_lifetime or
+                (
+                    now - returned_at >= self.config.database_pool_max_idle and
+                    pool.number_of_connections >
+                    self.config.database_pool_min_size
+                )
+            ):
+                pool.idle.remove(an_item)
+                self._discard(pool, connection, 'expired')
+
+    def _checkin(self, pool, connection, created_at):
+        if not connection.closed:
+            try:
+                if (
+                    connection.get_transaction_status() !=
+                    psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                ):
+                    # the next user of the connection must not inherit an
+                    # open transaction
+                    connection.rollback()
+            except psycopg2.Error:
+                pass
+        with pool.condition:
+            if connection.closed:
+                self._discard(pool, connection, 'evicted')
+                return
+            pool.idle.append((connection, created_at, time.time()))
+            self._reap(pool)
+            pool.condition.notify()
+
+    def _discard(self, pool, connection, reason):
+        """close a connection that won't be reused.  Called with the
+        condition of the pool held."""
+        pool.number_of_connections -= 1
+        pool.condition.notify()
+        self._capture_stat('increment', reason)
+        try:
+            connection.close()
+        except Exception:
+            self.config.logger.debug(
+                'PostgresPooled - failed closing a connection',
+                exc_info=True
+            )
+
+    @contextlib.contextmanager
+    def __call__(self, name=None):
+        """returns a connection from the pool wrapped in a contextmanager.
+        The connection goes back to the pool at the end of the block unless
+        it failed with an operational error."""
+        connection = self.connection(name)
+        try:
+            yield connection
+        except self.operational_exceptions + (psycopg2.OperationalError,):
+            connection.discard()
+            raise
+        finally:
+            connection.close()
 
     def close_connection(self, connection, force=False):
-        """overriding the baseclass function, this routine will decline to
-        close a connection at the end of a transaction context.  This allows
-        for reuse of connections."""
+        """return the connection to the pool or, if 'force' is True, close
+        it for good"""
         if force:
-            try:
-                super(ConnectionContextPooled, self).close_connection(connection, force)
-            except self.operational_exceptions:
-                self.config.logger.error('PostgresPooled - failed closing')
-            for name, conn in self.pool.iteritems():
-                if conn is connection:
-                    break
-            del self.pool[name]
+            connection.discard()
         else:
-            pass
+            connection.close()
 
     def close(self):
-        """close all pooled connections"""
-        self.config.logger.debug("PostgresPooled - "
-                                 "shutting down connection pool")
-        for name, conn in self.pool.iteritems():
-            conn.close()
-            self.config.logger.debug("PostgresPooled - connection %s closed"
-                                     % name)
+        """close the idle connections of the pool"""
+        self.config.logger.debug(
+            "PostgresPooled - shutting down connection pool"
+        )
+        self._close_idle('closed')
 
     def force_reconnect(self):
-        name = self.config.executor_identity()
-        if name in self.pool:
-            del self.pool[name]
+        """called by the transaction executors after any error they retry.
+        The connection that failed was already discarded when its 'with'
+        block ended, and the idle connections are checked before they are
+        reused, so nothing is done here.  Flushing the pool would close the
+        connections of every other thread of the process, and a checkout
+        timeout would turn into a storm of reconnections."""
+
+    def _close_idle(self, reason):
+        with self.pool.condition:
+            while self.pool.idle:
+                connection, created_at, returned_at = self.pool.idle.pop()
+                self._discard(self.pool, connection, reason)
@@ -12,8 +12,12 @@
 # PostgreSQLCrashStorage is a more complete crashstore. It saves processed
 # crashes completely as json in the 'processed_crashes' table.
 
+import collections
 import datetime
 import json
+import sys
+import threading
+import time
 from psycopg2 import ProgrammingError
 
 from socorro.external.crashstorage_base import (
@@ -29,10 +33,30 @@ from socorro.lib.datetimeutil import uuid_to_date, JsonDTEncoder
 from socorro.external.postgresql.dbapi2_util import (
     SQLDidNotReturnSingleValue,
     single_value_sql,
-    execute_no_results
+    execute_no_results,
+    execute_query_fetchall,
 )
 
 
+def _json_row_default(obj):
+    # Postgres reads ISO 8601 timestamps with their time zone
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+class _PendingSave(object):
+    """a processed crash waiting for its batch to be saved, and how that
+    went for it"""
+
+    def __init__(self, processed_crash, report_values):
+        self.processed_crash = processed_crash
+        self.report_values = report_values
+        self.finished = threading.Event()
+        self.succeeded = False
+        self.exc_info = None
+
+
 class PostgreSQLBasicCrashStorage(CrashStorageBase):
     """this implementation of crashstorage saves processed crashes to
     an instance of Postgresql.  It only saves certain key values to the
@@ -56,6 +80,20 @@ class PostgreSQLBasicCrashStorage(CrashStorageBase):
         doc='the class responsible for connecting to Postgres',
         reference_value_from='resource.postgresql',
     )
+    required_config.add_option(
+        'processed_crashes_per_batch',
+        default=0,
+        doc='the number of processed crashes to save together in one '
+            'transaction (0 saves each crash in its own transaction).  Each '
+            'caller waits for its batch to be saved, so it takes that many '
+            'threads saving at once to fill a batch',
+    )
+    required_config.add_option(
+        'batch_max_latency',
+        default=5.0,
+        doc='the maximum number of seconds that a processed crash waits for '
+            'its batch to fill before the batch is saved anyway',
+    )
 
     _reports_table_mappings = (
         # processed name, reports table name
@@ -109,14 +147,251 @@ class PostgreSQLBasicCrashStorage(CrashStorageBase):
             self.database,
             quit_check_callback=quit_check_callback
         )
+        # the _PendingSaves of the processed crashes waiting to be saved in a
+        # batch
+        self._pending = []
+        self._oldest_pending_time = None
+        self._pending_condition = threading.Condition()
+        self._closing = False
+        self._flush_thread = None
+        if config.processed_crashes_per_batch:
+            self._flush_thread = threading.Thread(
+                name='PostgreSQLBatchFlushThread',
+                target=self._flush_thread_func
+            )
+            self._flush_thread.daemon = True
+            self._flush_thread.start()
+
+    def close(self):
+        """save the processed crashes that are waiting in a batch"""
+        if self._flush_thread is not None:
+            with self._pending_condition:
+                self._closing = True
+                self._pending_condition.notify_all()
+            self._flush_thread.join()
+            self._flush_thread = None
+        super(PostgreSQLBasicCrashStorage, self).close()
 
     def save_processed(self, processed_crash):
-        self.transaction(self._save_processed_transaction, processed_crash)
+        """save a processed crash.  If batching is on, the crash joins a
+        batch and the caller waits until that batch has been saved, so that
+        the crash is in the database by the time this returns, like it is
+        without batching.  The caller that fills a batch saves it.  Batches
+        that don't fill are saved by the flush thread after
+        'batch_max_latency' seconds.  If the crash couldn't be saved, its
+        own error is raised here."""
+        if self._flush_thread is None:
+            self.transaction(self._save_processed_transaction, processed_crash)
+            return
+        # the row is made now, so that a crash that is missing fields fails
+        # its own save rather than the batch
+        a_save = _PendingSave(
+            processed_crash,
+            self._report_values(processed_crash)
+        )
+        with self._pending_condition:
+            if not self._pending:
+                self._oldest_pending_time = time.time()
+            self._pending.append(a_save)
+            if len(self._pending) < self.config.processed_crashes_per_batch:
+                batch = None
+            else:
+                batch = self._take_batch()
+        if batch is not None:
+            self._save_batch(batch)
+        while not a_save.finished.wait(1.0):
+            self.quit_check()
+        if a_save.exc_info is not None:
+            exc_type, exc_value, exc_tb = a_save.exc_info
+            raise exc_type, exc_value, exc_tb
+
+    def _take_batch(self):
+        """called with the condition held"""
+        batch = self._pending
+        self._pending = []
+        self._oldest_pending_time = None
+        return batch
+
+    def _flush_thread_func(self):
+        while True:
+            with self._pending_condition:
+                while True:
+                    if self._pending:
+                        waited = time.time() - self._oldest_pending_time
+                        if (
+                            self._closing or
+                            waited >= self.config.batch_max_latency
+                        ):
+                            break
+                        timeout = self.config.batch_max_latency - waited
+                    elif self._closing:
+                        return
+                    else:
+                        timeout = self.config.batch_max_latency
+                    self._pending_condition.wait(timeout)
+                batch = self._take_batch()
+            self._save_batch(batch)
+
+    def _save_batch(self, batch):
+        """save a batch of _PendingSaves and let their callers know how it
+        went"""
+        try:
+            self._save_pending(batch)
+        except BaseException:
+            # like a quit request: the crashes that weren't saved yet never
+            # will be by this batch
+            exc_info = sys.exc_info()
+            for a_save in batch:
+                if not a_save.succeeded and a_save.exc_info is None:
+                    a_save.exc_info = exc_info
+            raise
+        finally:
+            for a_save in batch:
+                a_save.finished.set()
+
+    def _save_pending(self, batch):
+        try:
+            self.transaction(
+                self._save_batch_transaction,
+                [(x.processed_crash, x.report_values) for x in batch]
+            )
+        except Exception:
+            # one bad crash must not take the others down with it
+            self.config.logger.warning(
+                'saving a batch of %d processed crashes failed, saving them '
+                'one at a time',
+                len(batch),
+                exc_info=True
+            )
+        else:
+            for a_save in batch:
+                a_save.succeeded = True
+            return
+        for a_save in batch:
+            try:
+                self.transaction(
+                    self._save_processed_transaction,
+                    a_save.processed_crash
+                )
+                a_save.succeeded = True
+            except Exception:
+                a_save.exc_info = sys.exc_info()
+                self.config.logger.error(
+                    'failed to save processed crash %s',
+                    a_save.processed_crash['uuid'],
+                    exc_info=True
+                )
+
+    def _save_batch_transaction(self, connection, batch):
+        # a crash saved twice in a batch is only written as it was last saved
+        latest = collections.OrderedDict()
+        for processed_crash, report_values in batch:
+            latest[processed_crash['uuid']] = (processed_crash, report_values)
+        by_table_suffix = collections.defaultdict(list)
+        for crash_id, item in latest.iteritems():
+            by_table_suffix[self._table_suffix_for_crash_id(crash_id)].append(
+                item
+            )
+        for table_suffix, items in sorted(by_table_suffix.items()):
+            self._save_batch_to_tables(connection, table_suffix, items)
+
+    def _save_batch_to_tables(self, connection, table_suffix, items):
+        """save the items of a batch that go into the tables of one week"""
+        report_ids = self._save_processed_reports(
+            connection,
+            table_suffix,
+            [report_values for processed_crash, report_values in items]
+        )
+        for processed_crash, report_values in items:
+            self._save_plugins(
+                connection,
+                processed_crash,
+                report_ids[processed_crash['uuid']]
+            )
 
     def _save_processed_transaction(self, connection, processed_crash):
         report_id = self._save_processed_report(connection, processed_crash)
         self._save_plugins(connection, processed_crash, report_id)
 
+    def _report_values(self, processed_crash):
+        """the values of the columns of the reports table, in the order of
+        the '_reports_table_mappings'"""
+        value_list = []
+        for pro_crash_name, report_name, length in (
+            self._reports_table_mappings
+        ):
+            value = processed_crash[pro_crash_name]
+            if isinstance(value, basestring) and length:
+                value_list.append(value[:length])
+            else:
+                value_list.append(value)
+        return value_list
+
+    def _save_processed_reports(self, connection, table_suffix,
+                                report_values_list):
+        """the batch form of '_save_processed_report': UPSERT many rows of
+        one partition of the reports table in a single statement.
+
+        The rows are passed as one JSON array that json_populate_recordset
+        turns into rows of the type of the table, so each value is cast to
+        the type of its column just as a parameter of the single row UPSERT
+        would be.
+
+        returns a mapping of crash ids to the ids of their reports"""
+        column_list = [
+            report_name
+            for pro_crash_name, report_name, length in (
+                self._reports_table_mappings
+            )
+        ]
+        rows = [
+            dict(zip(column_list, report_values))
+            for report_values in report_values_list
+        ]
+        reports_table_name = 'reports_%s' % table_suffix
+        upsert_sql = """
+        WITH
+        new_reports AS (
+            SELECT * FROM json_populate_recordset(NULL::%(table)s, %%s)
+        ),
+        update_reports AS (
+            UPDATE %(table)s SET
+                %(joined_update_clause)s
+            FROM new_reports
+            WHERE %(table)s.uuid = new_reports.uuid
+            RETURNING %(table)s.uuid, %(table)s.id
+        ),
+        insert_reports AS (
+            INSERT INTO %(table)s (%(column_list)s)
+            ( SELECT
+                %(column_list)s
+                FROM new_reports
+                WHERE NOT EXISTS (
+                    SELECT uuid from %(table)s
+                    WHERE
+                        %(table)s.uuid = new_reports.uuid
+                    LIMIT 1
+                )
+            )
+            RETURNING uuid, id
+        )
+        SELECT * from update_reports
+        UNION ALL
+        SELECT * from insert_reports
+        """ % {
+            'joined_update_clause': ", ".join(
+                '%s = new_reports.%s' % (x, x) for x in column_list
+            ),
+            'table': reports_table_name,
+            'column_list': ', '.join(column_list),
+        }
+        report_ids = execute_query_fetchall(
+            connection,
+            upsert_sql,
+            (json.dumps(rows, default=_json_row_default),)
+        )
+        return dict(report_ids)
+
     def _save_processed_report(self, connection, processed_crash):
         """ Here we INSERT or UPDATE a row in the reports table.
         This is the first stop before imported data gets into our normalized
@@ -145,18 +420,13 @@ class PostgreSQLBasicCrashStorage(CrashStorageBase):
         """
         column_list = []
         placeholder_list = []
-        # create a list of values to go into the reports table
-        value_list = []
         for pro_crash_name, report_name, length in (
             self._reports_table_mappings
         ):
             column_list.append(report_name)
             placeholder_list.append('%s')
-            value = processed_crash[pro_crash_name]
-            if isinstance(value, basestring) and length:
-                    value_list.append(value[:length])
-            else:
-                value_list.append(value)
+        # create a list of values to go into the reports table
+        value_list = self._report_values(processed_crash)
 
         def print_eq(a, b):
             # Helper for UPDATE SQL clause
@@ -404,7 +674,30 @@ class PostgreSQLCrashStorage(PostgreSQLBasicCrashStorage):
         self._save_plugins(connection, processed_crash, report_id)
         self._save_processed_crash(connection, processed_crash)
 
+    def _save_batch_to_tables(self, connection, table_suffix, items):
+        super(PostgreSQLCrashStorage, self)._save_batch_to_tables(
+            connection,
+            table_suffix,
+            items
+        )
+        # the UPSERTs of the processed crashes are sent together, in one
+        # round trip to the server
+        with connection.cursor() as a_cursor:
+            upsert_sql = ';\n'.join(
+                a_cursor.mogrify(
+                    *self._processed_crash_upsert(processed_crash)
+                )
+                for processed_crash, report_values in items
+            )
+            a_cursor.execute(upsert_sql)
+
     def _save_processed_crash(self, connection, processed_crash):
+        upsert_sql, values = self._processed_crash_upsert(processed_crash)
+        execute_no_results(connection, upsert_sql, values)
+
+    def _processed_crash_upsert(self, processed_crash):
+        """returns the sql and the parameters of the UPSERT of a processed
+        crash"""
         crash_id = processed_crash['uuid']
         processed_crashes_table_name = (
             'processed_crashes_%s' % self._table_suffix_for_crash_id(crash_id)
@@ -443,4 +736,4 @@ class PostgreSQLCrashStorage(PostgreSQLBasicCrashStorage):
             'date_processed': processed_crash["date_processed"],
             'uuid': crash_id
         }
-        execute_no_results(connection, upsert_sql, values)
+        return upsert_sql, values
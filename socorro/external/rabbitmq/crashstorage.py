@@ -2,6 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import collections
+import functools
 import pika
 from random import randint
 
@@ -74,6 +76,41 @@ class RabbitMQCrashStorage(CrashStorageBase):
         doc='percentage of the time that rabbit will try to queue',
         reference_value_from='resource.rabbitmq',
     )
+    required_config.add_option(
+        'prefetch_count',
+        default=0,
+        doc='the number of crash ids that RabbitMQ may push ahead of their '
+            'use to a consumer (0 polls the queues with basic_get instead)',
+        reference_value_from='resource.rabbitmq',
+    )
+    required_config.add_option(
+        'priority_queue_weight',
+        default=4,
+        doc='the share of the crash ids taken from the priority queue when '
+            'all queues have some (consumer only)',
+        reference_value_from='resource.rabbitmq',
+    )
+    required_config.add_option(
+        'standard_queue_weight',
+        default=2,
+        doc='the share of the crash ids taken from the standard queue when '
+            'all queues have some (consumer only)',
+        reference_value_from='resource.rabbitmq',
+    )
+    required_config.add_option(
+        'reprocessing_queue_weight',
+        default=1,
+        doc='the share of the crash ids taken from the reprocessing queue '
+            'when all queues have some (consumer only)',
+        reference_value_from='resource.rabbitmq',
+    )
+    required_config.add_option(
+        'consumer_idle_timeout',
+        default=2.0,
+        doc='the number of seconds the consumer waits for a crash id before '
+            'deciding that the queues are empty (consumer only)',
+        reference_value_from='resource.rabbitmq',
+    )
 
     def __init__(self, config, quit_check_callback=None):
         super(RabbitMQCrashStorage, self).__init__(
@@ -87,6 +124,13 @@ class RabbitMQCrashStorage(CrashStorageBase):
         # We should find a way to time out UUIDs after a certain time.
         self.acknowledgement_token_cache = {}
         self.acknowledgment_queue = Queue()
+        # the delivery tags of the crash ids pushed to the consumer that have
+        # yet to be acknowledged, whether they were yielded or not
+        self._unacked_delivery_tags = set()
+        # the consumer and the connection whose channel the delivery tags
+        # and acknowledgement tokens of the consumer belong to
+        self._consumer = None
+        self._delivery_connection = None
 
         self.rabbitmq = config.rabbitmq_class(config)
         self.transaction = config.transaction_executor_class(
@@ -154,6 +198,100 @@ class RabbitMQCrashStorage(CrashStorageBase):
         return things
 
     def new_crashes(self):
+        """return a generator of the crash_ids in RabbitMQ.  It ends when
+        the queues are empty."""
+        if self.config.prefetch_count:
+            return self._consumed_new_crashes()
+        return self._polled_new_crashes()
+
+    def _consumed_new_crashes(self):
+        """This generator has RabbitMQ push crash_ids to it with
+        basic_consume, 'prefetch_count' of them ahead of their use.  When
+        more than one queue has crash_ids, they are taken from each queue in
+        proportion to its weight.  Talking to RabbitMQ is done in
+        transactions, so a lost connection is replaced like it is for any
+        other use of RabbitMQ."""
+        self._consume_acknowledgement_queue()
+        try:
+            while True:
+                # acknowledging crashes makes room for more to be pushed
+                self._consume_acknowledgement_queue()
+                delivery = self.transaction(self._transaction_next_delivery)
+                if delivery is None:
+                    # nothing arrived in time - leave the iterator
+                    self._consume_acknowledgement_queue()
+                    return
+                method_frame, body = delivery
+                if self._suppress_duplicate_jobs(body, method_frame):
+                    continue
+                self.acknowledgement_token_cache[body] = method_frame
+                yield body
+        finally:
+            try:
+                self.transaction(self._transaction_cancel_consumer)
+            except Exception:
+                self.config.logger.error(
+                    'RabbitMQCrashStorage failed to cancel its consumer',
+                    exc_info=True
+                )
+
+    def _is_stale(self, connection):
+        """the delivery tags and acknowledgement tokens of the consumer are
+        only good on the channel they were delivered on.  When the
+        transaction executor has replaced that connection, RabbitMQ has
+        already requeued the crashes that were not acknowledged, so they are
+        forgotten here.  Returns True if that was the case."""
+        if connection is self._delivery_connection:
+            return False
+        if self._delivery_connection is not None:
+            self.config.logger.warning(
+                'RabbitMQCrashStorage connection replaced, %s crashes that '
+                'were not acknowledged will be delivered again',
+                len(self._unacked_delivery_tags)
+            )
+            self._unacked_delivery_tags.clear()
+            self.acknowledgement_token_cache.clear()
+            self._consumer = None
+        self._delivery_connection = connection
+        return True
+
+    def _transaction_next_delivery(self, connection):
+        """return the next (method_frame, body) pushed by RabbitMQ or None
+        if nothing arrives within 'consumer_idle_timeout' seconds"""
+        self._is_stale(connection)
+        if self._consumer is None:
+            self._consumer = _QueueConsumer(
+                connection,
+                (
+                    (
+                        self.rabbitmq.config.priority_queue_name,
+                        self.config.priority_queue_weight
+                    ),
+                    (
+                        self.rabbitmq.config.standard_queue_name,
+                        self.config.standard_queue_weight
+                    ),
+                    (
+                        self.rabbitmq.config.reprocessing_queue_name,
+                        self.config.reprocessing_queue_weight
+                    ),
+                ),
+                self.config.prefetch_count,
+                self._unacked_delivery_tags
+            )
+        self._consumer.wait(0)
+        delivery = self._consumer.next_delivery()
+        if delivery is None:
+            self._consumer.wait(self.config.consumer_idle_timeout)
+            delivery = self._consumer.next_delivery()
+        return delivery
+
+    def _transaction_cancel_consumer(self, connection):
+        consumer, self._consumer = self._consumer, None
+        if consumer is not None and not self._is_stale(connection):
+            consumer.cancel()
+
+    def _polled_new_crashes(self):
         """This generator fetches crash_ids from RabbitMQ."""
 
         # We've set up RabbitMQ to require acknowledgement of processing of a
@@ -221,6 +359,9 @@ class RabbitMQCrashStorage(CrashStorageBase):
         from the 'new_crashes' method must take place on the same connection
         that the crash_id came from.  The crash_ids are queued in the
         'acknowledgment_queue'.  That queue is consumed by the QueuingThread"""
+        if self.config.prefetch_count:
+            self._consume_acknowledgement_queue_in_batch()
+            return
         try:
             while True:
                 crash_id_to_be_acknowledged = \
@@ -239,9 +380,10 @@ class RabbitMQCrashStorage(CrashStorageBase):
                         crash_id_to_be_acknowledged,
                         acknowledgement_token
                     )
-                    del self.acknowledgement_token_cache[
-                        crash_id_to_be_acknowledged
-                    ]
+                    self.acknowledgement_token_cache.pop(
+                        crash_id_to_be_acknowledged,
+                        None
+                    )
                 except KeyError:
                     self.config.logger.warning(
                         'RabbitMQCrashStorage tried to acknowledge crash %s'
@@ -259,15 +401,91 @@ class RabbitMQCrashStorage(CrashStorageBase):
         except Empty:
             pass  # nothing to do with an empty queue
 
+    def _consume_acknowledgement_queue_in_batch(self):
+        """acknowledge all the crash_ids in the 'acknowledgment_queue' in a
+        single transaction"""
+        crash_ids_and_tokens = []
+        try:
+            while True:
+                crash_id = self.acknowledgment_queue.get_nowait()
+                try:
+                    crash_ids_and_tokens.append(
+                        (crash_id, self.acknowledgement_token_cache[crash_id])
+                    )
+                except KeyError:
+                    self.config.logger.warning(
+                        'RabbitMQCrashStorage tried to acknowledge crash %s'
+                        ', which was not in the cache',
+                        crash_id,
+                        exc_info=True
+                    )
+        except Empty:
+            pass
+        if not crash_ids_and_tokens:
+            return
+        try:
+            self.transaction(
+                self._transaction_ack_crashes,
+                crash_ids_and_tokens
+            )
+        except Exception:
+            self.config.logger.error(
+                'RabbitMQCrashStorage unexpected failure on %s',
+                ', '.join(x for x, token in crash_ids_and_tokens),
+                exc_info=True
+            )
+            return
+        for crash_id, token in crash_ids_and_tokens:
+            # a replaced connection may have emptied the cache already
+            self.acknowledgement_token_cache.pop(crash_id, None)
+
+    def _transaction_ack_crashes(self, connection, crash_ids_and_tokens):
+        """acknowledge many crashes at once.  A 'basic_ack' with 'multiple'
+        set acknowledges every delivery up to its delivery tag, so it is
+        only used up to the first delivery that is still unacknowledged.
+        The deliveries beyond it are acknowledged one by one."""
+        if self._is_stale(connection):
+            # the crashes were requeued with the old channel, there is
+            # nothing left to acknowledge
+            return
+        delivery_tags = set(
+            token.delivery_tag for crash_id, token in crash_ids_and_tokens
+        )
+        still_unacked = self._unacked_delivery_tags - delivery_tags
+        if still_unacked:
+            first_unacked = min(still_unacked)
+        else:
+            first_unacked = None
+        up_to_first_unacked = [
+            x for x in delivery_tags
+            if first_unacked is None or x < first_unacked
+        ]
+        if up_to_first_unacked:
+            connection.channel.basic_ack(
+                delivery_tag=max(up_to_first_unacked),
+                multiple=True
+            )
+        for a_delivery_tag in sorted(delivery_tags):
+            if first_unacked is not None and a_delivery_tag > first_unacked:
+                connection.channel.basic_ack(delivery_tag=a_delivery_tag)
+        self._unacked_delivery_tags -= delivery_tags
+        self.config.logger.debug(
+            'RabbitMQCrashStorage acking %s',
+            ', '.join(x for x, token in crash_ids_and_tokens)
+        )
+
     def _transaction_ack_crash(
         self,
         connection,
         crash_id,
         acknowledgement_token
     ):
+        if self.config.prefetch_count and self._is_stale(connection):
+            return
         connection.channel.basic_ack(
             delivery_tag=acknowledgement_token.delivery_tag
         )
+        self._unacked_delivery_tags.discard(acknowledgement_token.delivery_tag)
         self.config.logger.debug(
             'RabbitMQCrashStorage acking %s with delivery_tag %s',
             crash_id,
@@ -275,6 +493,70 @@ class RabbitMQCrashStorage(CrashStorageBase):
         )
 
 
+class _QueueConsumer(object):
+    """the crash_ids that RabbitMQ pushes to one channel from several
+    queues, held until 'new_crashes' takes them.
+
+    The next crash_id is taken by smooth weighted round robin among the
+    queues that have some: each queue earns its weight on every pick and
+    the queue with the most credit is picked and pays for it.  Over time,
+    each queue gets its share of the picks, and they are spread out rather
+    than taken in runs."""
+
+    def __init__(self, connection, queues_and_weights, prefetch_count,
+                 unacked_delivery_tags):
+        self.connection = connection
+        self.channel = connection.channel
+        self.unacked_delivery_tags = unacked_delivery_tags
+        self.weights = collections.OrderedDict(queues_and_weights)
+        self.credits = dict.fromkeys(self.weights, 0)
+        self.deliveries = dict((x, collections.deque()) for x in self.weights)
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+        self.consumer_tags = [
+            self.channel.basic_consume(
+                functools.partial(self._on_delivery, queue),
+                queue=queue
+            )
+            for queue in self.weights
+        ]
+
+    def _on_delivery(self, queue, channel, method_frame, header_frame, body):
+        self.unacked_delivery_tags.add(method_frame.delivery_tag)
+        self.deliveries[queue].append((method_frame, body))
+
+    def wait(self, timeout):
+        """let the deliveries that have arrived, or that arrive within
+        'timeout' seconds, in"""
+        self.connection.connection.process_data_events(time_limit=timeout)
+
+    def next_delivery(self):
+        """return the next (method_frame, body) or None if there is none"""
+        queues = [x for x in self.weights if self.deliveries[x]]
+        if not queues:
+            return None
+        total_weight = 0
+        for a_queue in queues:
+            self.credits[a_queue] += self.weights[a_queue]
+            total_weight += self.weights[a_queue]
+        queue = max(queues, key=lambda x: self.credits[x])
+        self.credits[queue] -= total_weight
+        return self.deliveries[queue].popleft()
+
+    def cancel(self):
+        """stop the consumers and give back the crash_ids that were pushed
+        but never taken"""
+        for a_consumer_tag in self.consumer_tags:
+            self.channel.basic_cancel(a_consumer_tag)
+        for a_queue in self.weights:
+            while self.deliveries[a_queue]:
+                method_frame, body = self.deliveries[a_queue].popleft()
+                self.channel.basic_reject(
+                    delivery_tag=method_frame.delivery_tag,
+                    requeue=True
+                )
+                self.unacked_delivery_tags.discard(method_frame.delivery_tag)
+
+
 class ReprocessingRabbitMQCrashStore(RabbitMQCrashStorage):
     required_config = Namespace()
     required_config.routing_key = change_default(
@@ -69,3 +69,10 @@ class StatsdMetrics(MetricsBase):
                 # .timing() takes a value which is a duration in milliseconds,
                 # but we're going to use it for non duration type values, too.
                 self.statsd.timing(key, int(val))
+
+    def increment(self, key, value=1):
+        if self._has_histogram:
+            # the dogstatsd client passes .increment() through to datadog
+            self.statsd.increment(key, value)
+        else:
+            self.statsd.incr(key, value)
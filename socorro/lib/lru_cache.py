@@ -0,0 +1,92 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """a thread safe mapping that holds at most 'max_size' entries.  When it
+    is full, adding an entry forgets the least recently used one.  It keeps
+    count of its hits, misses and evictions so that its effectiveness can be
+    reported.
+
+    Entries can also be given a weight, like their size in bytes.  With a
+    'max_weight', entries are forgotten until their weights add up to no
+    more than it.  An entry heavier than 'max_weight' is not kept at all.
+    Either limit can be None for no limit."""
+
+    def __init__(self, max_size, max_weight=None):
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self._entries = OrderedDict()
+        self._weights = {}
+        self.weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # reinserting moves the entry to the most recently used end
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value, weight=0):
+        with self._lock:
+            self._remove(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                # making room for it would forget every other entry
+                return
+            self._entries[key] = value
+            self._weights[key] = weight
+            self.weight += weight
+            while self._entries and (
+                (
+                    self.max_size is not None and
+                    len(self._entries) > self.max_size
+                ) or (
+                    self.max_weight is not None and
+                    self.weight > self.max_weight
+                )
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key, default=None):
+        """called with the lock held"""
+        value = self._entries.pop(key, default)
+        self.weight -= self._weights.pop(key, 0)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._remove(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits) / lookups
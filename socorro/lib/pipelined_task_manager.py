@@ -0,0 +1,239 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""This module defines a task manager that splits each job into the stages
+of fetch/transform/save and gives each stage its own pool of threads.
+
+With the ThreadedTaskManager, a thread that is waiting on storage to fetch
+or save a crash can't be transforming another one, so the latency of the
+storage caps how many crashes a node can process.  Here, the fetches and
+saves of many crashes are in flight at the same time, each stage bounded by
+the size of its pool, while the transforms get a pool of their own.  The
+total number of crashes in the pipeline is bounded too, which gives the
+queuing thread the same backpressure as the bounded queue of the
+ThreadedTaskManager."""
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from configman import Namespace
+
+from socorro.lib.task_manager import (
+    default_task_func,
+    default_iterator,
+)
+from socorro.lib.threaded_task_manager import ThreadedTaskManager
+
+
+class PipelinedTaskManager(ThreadedTaskManager):
+    """Given an iterator over a sequence of job parameters and the functions
+    of the stages of a job, this class pushes each job through the stages,
+    each in its own pool of threads.
+
+    The stages are set as attributes after construction:
+        fetch_func - called with the job's args and kwargs, it returns the
+                     state of the job.  If it returns None, the job is over.
+        process_func - called with the job's state, in the transform pool
+        save_func - called with the job's state, in the save pool
+        finish_func - called with the job's state once the job is over,
+                      whether or not the stages succeeded
+
+    If no fetch_func is set, the 'task_func' is run in the transform pool
+    and this class behaves like a ThreadedTaskManager.
+
+    A keyword argument called 'finished_func' is not passed to the stages.
+    It is called once the job is over, just as FetchTransformSaveApp's
+    'transform' method would have called it."""
+    required_config = Namespace()
+    required_config.add_option(
+        'number_of_fetch_threads',
+        default=8,
+        doc='the number of jobs that can be fetching at the same time'
+    )
+    required_config.add_option(
+        'number_of_save_threads',
+        default=8,
+        doc='the number of jobs that can be saving at the same time'
+    )
+    required_config.add_option(
+        'maximum_jobs_in_flight',
+        default=16,
+        doc='the maximum number of jobs in all stages of the pipeline'
+    )
+
+    def __init__(self, config,
+                 job_source_iterator=default_iterator,
+                 task_func=default_task_func):
+        super(PipelinedTaskManager, self).__init__(
+            config,
+            job_source_iterator,
+            task_func
+        )
+        self.fetch_func = None
+        self.process_func = None
+        self.save_func = None
+        self.finish_func = None
+        self.maximum_jobs_in_flight = config.maximum_jobs_in_flight
+        self.jobs_in_flight = 0
+        self._in_flight_condition = threading.Condition()
+        self.task_queue = _PipelineQueue(self)
+        self.fetch_executor = None
+        self.transform_executor = None
+        self.save_executor = None
+
+    def start(self):
+        """start the pools of the stages and the queuing thread that feeds
+        them.  This is a non blocking call."""
+        self.logger.debug('start')
+        self.fetch_executor = ThreadPoolExecutor(
+            max_workers=self.config.number_of_fetch_threads
+        )
+        self.transform_executor = ThreadPoolExecutor(
+            max_workers=self.number_of_threads
+        )
+        self.save_executor = ThreadPoolExecutor(
+            max_workers=self.config.number_of_save_threads
+        )
+        self.queuing_thread = threading.Thread(
+            name="QueuingThread",
+            target=self._queuing_thread_func
+        )
+        self.queuing_thread.start()
+
+    def _submit_job(self, job_params):
+        """called by the queuing thread, this blocks until there is room in
+        the pipeline and then starts the job on its first stage"""
+        with self._in_flight_condition:
+            while self.jobs_in_flight >= self.maximum_jobs_in_flight:
+                self._in_flight_condition.wait(1.0)
+                self.quit_check()
+            self.jobs_in_flight += 1
+        job = _Job(job_params)
+        if self.fetch_func is None:
+            self._run_stage(
+                job,
+                self.transform_executor,
+                self.task_func,
+                job.args,
+                job.kwargs,
+                None
+            )
+        else:
+            self._run_stage(
+                job,
+                self.fetch_executor,
+                self.fetch_func,
+                job.args,
+                job.kwargs,
+                self._fetched
+            )
+
+    def _run_stage(self, job, executor, function, args, kwargs, next_step):
+        future = executor.submit(function, *args, **kwargs)
+        future.add_done_callback(
+            lambda a_future: self._stage_done(job, a_future, next_step)
+        )
+
+    def _stage_done(self, job, future, next_step):
+        try:
+            result = future.result()
+        except BaseException:
+            # KeyboardInterrupt is how a stage's quit_check call tells the
+            # job to stop
+            self.logger.error("Error in processing a job", exc_info=True)
+            self._end_job(job)
+            return
+        if next_step is None:
+            self._end_job(job)
+            return
+        try:
+            next_step(job, result)
+        except Exception:
+            # the pools have been shut down
+            self.logger.error("Error in processing a job", exc_info=True)
+            self._end_job(job)
+
+    def _fetched(self, job, state):
+        if state is None:
+            self._end_job(job)
+            return
+        job.state = state
+        self._run_stage(
+            job,
+            self.transform_executor,
+            self.process_func,
+            (state,),
+            {},
+            self._processed
+        )
+
+    def _processed(self, job, result_unused):
+        self._run_stage(
+            job,
+            self.save_executor,
+            self.save_func,
+            (job.state,),
+            {},
+            None
+        )
+
+    def _end_job(self, job):
+        try:
+            if job.state is not None and self.finish_func:
+                self.finish_func(job.state)
+        except Exception:
+            self.logger.error("Error finishing a job", exc_info=True)
+        finally:
+            try:
+                job.finished_func()
+            except Exception:
+                self.logger.error('Error completing job', exc_info=True)
+            with self._in_flight_condition:
+                self.jobs_in_flight -= 1
+                self._in_flight_condition.notify_all()
+
+    def _kill_worker_threads(self):
+        """wait for the jobs in the pipeline to finish and then shut down the
+        pools.  This is a blocking call."""
+        self.logger.debug("waiting for the pipeline to drain")
+        with self._in_flight_condition:
+            while self.jobs_in_flight:
+                self._in_flight_condition.wait(1.0)
+        for an_executor in (
+            self.fetch_executor,
+            self.transform_executor,
+            self.save_executor
+        ):
+            if an_executor is not None:
+                an_executor.shutdown()
+
+
+class _Job(object):
+    def __init__(self, job_params):
+        try:
+            self.args, kwargs = job_params
+        except ValueError:
+            self.args = job_params
+            kwargs = {}
+        self.kwargs = dict(kwargs)
+        self.finished_func = self.kwargs.pop('finished_func', lambda: None)
+        self.state = None
+
+
+class _PipelineQueue(object):
+    """the face of the pipeline that the queuing thread and
+    'wait_for_empty_queue' of the ThreadedTaskManager expect to see"""
+
+    def __init__(self, task_manager):
+        self.task_manager = task_manager
+
+    def put(self, item):
+        function, job_params = item
+        if function is None:
+            # a death token, there are no worker threads to kill
+            return
+        self.task_manager._submit_job(job_params)
+
+    def empty(self):
+        return not self.task_manager.jobs_in_flight
@@ -0,0 +1,407 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""This module defines a producer/consumer system like the one in
+threaded_task_manager, except that the consumers are forked processes rather
+than threads.  Work that is CPU bound in Python, like signature generation or
+JSON parsing, is serialized by the GIL when run on threads.  Run in processes,
+it can use every core of the machine.
+
+A single queuing thread in the parent process reads the iterator and pushes
+jobs into a bounded queue shared with the worker processes.  Only the
+positional arguments and the picklable keyword arguments of a job cross into
+a worker.  Keyword arguments that are callables, like the 'finished_func'
+that acknowledges a crash to RabbitMQ, stay behind in the parent.  They are
+called there, with no arguments, once a worker reports that it has finished
+the job."""
+
+import itertools
+import multiprocessing
+import os
+import Queue
+import signal
+import threading
+import time
+
+from configman import Namespace
+
+from socorro.lib.task_manager import (
+    TaskManager,
+    default_task_func,
+    default_iterator,
+)
+from socorro.lib.threaded_task_manager import ThreadedTaskManager
+
+
+class ProcessPoolTaskManager(ThreadedTaskManager):
+    """Given an iterator over a sequence of job parameters and a function,
+    this class will execute the function in a set of forked processes.
+
+    Each worker process starts with a copy of everything in the parent,
+    including its open connections.  Those can't be shared safely, so before
+    taking any jobs, each worker calls 'worker_setup_func' (if it has been
+    set) to make its own.  When it is done, it calls 'worker_close_func'."""
+    required_config = Namespace()
+    required_config.add_option(
+        'number_of_processes',
+        default=4,
+        doc='the number of worker processes'
+    )
+    # like the queue of the ThreadedTaskManager, the queue is kept short so
+    # that the queuing thread blocks rather than reading jobs far ahead of
+    # the workers.  Jobs in the queue are lost if the app dies.
+    required_config.add_option(
+        'maximum_queue_size',
+        default=8,
+        doc='the maximum size of the queue shared with the workers'
+    )
+    required_config.add_option(
+        'maximum_worker_setup_failures',
+        default=5,
+        doc='the number of worker processes in a row that may fail to set '
+            'up before the app gives up and quits'
+    )
+
+    # how often, in seconds, the parent checks that its workers are alive
+    worker_check_interval = 1.0
+
+    def __init__(self, config,
+                 job_source_iterator=default_iterator,
+                 task_func=default_task_func):
+        # the quit flag is shared with the workers, so that they stop taking
+        # jobs as soon as the parent quits.  It has to exist before the base
+        # class constructor sets the flag.
+        self._quit_event = multiprocessing.Event()
+        # the ThreadedTaskManager constructor sets up threads and a queue
+        # that are of no use here, so it is skipped
+        TaskManager.__init__(
+            self,
+            config,
+            job_source_iterator,
+            task_func
+        )
+        self.number_of_processes = config.number_of_processes
+        self.process_list = []
+        self.thread_list = []
+        self.worker_setup_func = None
+        self.worker_close_func = None
+        self._job_ids = itertools.count()
+        # the callbacks of the jobs that are queued or running, by job id
+        self._pending_callbacks = {}
+        # the job id each worker process is running, by pid
+        self._running_jobs = {}
+        self._pending_lock = threading.Lock()
+        # held while workers are being replaced or stopped, so that a worker
+        # started during shutdown can't miss its death token
+        self._workers_lock = threading.Lock()
+        self._stopping_workers = False
+        # the workers that have reported that they are set up, by pid
+        self._ready_workers = set()
+        self._consecutive_setup_failures = 0
+        self.task_queue = _JobQueue(
+            multiprocessing.Queue(config.maximum_queue_size),
+            self
+        )
+        # the reports of the workers go through a pipe rather than a
+        # multiprocessing.Queue.  A Queue hands its items to a feeder thread
+        # that dies with the process, so the last reports of a worker that
+        # dies would be lost.  Writes to the pipe are done by the time 'send'
+        # returns.
+        self._result_reader, self._result_writer = multiprocessing.Pipe(
+            duplex=False
+        )
+        self._result_lock = multiprocessing.Lock()
+
+    @property
+    def quit(self):
+        return self._quit_event.is_set()
+
+    @quit.setter
+    def quit(self, value):
+        if value:
+            self._quit_event.set()
+        else:
+            self._quit_event.clear()
+
+    def start(self):
+        """start the worker processes, the thread that acknowledges their
+        finished jobs and the queuing thread that feeds them jobs.  This is a
+        non blocking call."""
+        self.logger.debug('start')
+        for x in range(self.number_of_processes):
+            self._start_worker_process()
+        self.results_thread = threading.Thread(
+            name="ResultsThread",
+            target=self._results_thread_func
+        )
+        self.results_thread.start()
+        self.queuing_thread = threading.Thread(
+            name="QueuingThread",
+            target=self._queuing_thread_func
+        )
+        self.queuing_thread.start()
+
+    def _start_worker_process(self):
+        new_process = multiprocessing.Process(
+            name='TaskProcess',
+            target=self._worker_process_func,
+        )
+        new_process.daemon = True
+        new_process.start()
+        self.process_list.append(new_process)
+        return new_process
+
+    def _register_job(self, job_params):
+        """called by the queuing thread, this splits the callbacks from the
+        arguments that will be sent to a worker"""
+        try:
+            args, kwargs = job_params
+        except ValueError:
+            args = job_params
+            kwargs = {}
+        worker_kwargs = {}
+        callbacks = []
+        for key, value in kwargs.items():
+            if callable(value):
+                callbacks.append(value)
+            else:
+                worker_kwargs[key] = value
+        job_id = next(self._job_ids)
+        with self._pending_lock:
+            self._pending_callbacks[job_id] = callbacks
+        return (job_id, args, worker_kwargs)
+
+    def _results_thread_func(self):
+        """runs in the parent, reading the reports of the workers.  When a
+        job is finished its callbacks are called.  Workers that die are
+        replaced."""
+        last_check = time.time()
+        while True:
+            if time.time() - last_check >= self.worker_check_interval:
+                self._replace_dead_workers()
+                last_check = time.time()
+            if not self._result_reader.poll(self.worker_check_interval):
+                continue
+            report = self._result_reader.recv()
+            if report is None:
+                break
+            self._handle_report(report)
+
+    def _handle_report(self, report):
+        pid, job_id, event = report
+        if event == 'ready':
+            with self._workers_lock:
+                self._ready_workers.add(pid)
+                self._consecutive_setup_failures = 0
+            return
+        if event == 'started':
+            with self._pending_lock:
+                self._running_jobs[pid] = job_id
+            return
+        with self._pending_lock:
+            self._running_jobs.pop(pid, None)
+            callbacks = self._pending_callbacks.pop(job_id, [])
+        for a_callback in callbacks:
+            try:
+                a_callback()
+            except Exception:
+                self.logger.error(
+                    'Error completing job %s',
+                    job_id,
+                    exc_info=True
+                )
+
+    def _report(self, report):
+        with self._result_lock:
+            self._result_writer.send(report)
+
+    def _replace_dead_workers(self):
+        # a worker that died is replaced even while the workers are being
+        # stopped: the jobs and the death token it didn't get to are still in
+        # the queue.  Only workers that quit on a death token are not.
+        with self._workers_lock:
+            dead_processes = [
+                x for x in self.process_list
+                if not x.is_alive() and not (
+                    self._stopping_workers and x.exitcode == 0
+                )
+            ]
+            if not dead_processes:
+                return
+            # everything a dead worker reported is already in the pipe.
+            # Reading it first tells which job the worker died on.  The
+            # lock is already held, so 'ready' reports are handled here.
+            while self._result_reader.poll():
+                report = self._result_reader.recv()
+                if report[2] == 'ready':
+                    self._ready_workers.add(report[0])
+                    self._consecutive_setup_failures = 0
+                else:
+                    self._handle_report(report)
+            for a_process in dead_processes:
+                self.process_list.remove(a_process)
+                if a_process.pid in self._ready_workers:
+                    self._ready_workers.discard(a_process.pid)
+                else:
+                    self._consecutive_setup_failures += 1
+                with self._pending_lock:
+                    lost_job_id = self._running_jobs.pop(a_process.pid, None)
+                    # the callbacks of a lost job are never called, so a crash
+                    # from a queue is not acknowledged and will be retried
+                    self._pending_callbacks.pop(lost_job_id, None)
+                self.logger.error(
+                    'worker process %s died with exit code %s%s, replacing it',
+                    a_process.pid,
+                    a_process.exitcode,
+                    (' while running job %s' % lost_job_id)
+                    if lost_job_id is not None else ''
+                )
+                if (
+                    self._consecutive_setup_failures >=
+                    self.config.maximum_worker_setup_failures
+                ):
+                    # a worker that can't set up is likely to be followed by
+                    # others that can't either, forked over and over again
+                    if not self.quit:
+                        self.logger.critical(
+                            '%s worker processes in a row failed to set up, '
+                            'giving up',
+                            self._consecutive_setup_failures
+                        )
+                        self.quit = True
+                    continue
+                self._start_worker_process()
+
+    def _kill_worker_threads(self):
+        """put one death token on the queue for each worker process, wait for
+        them to finish and then stop the results thread.  This is a blocking
+        call."""
+        with self._workers_lock:
+            self._stopping_workers = True
+            number_of_workers = len(self.process_list)
+        for x in range(number_of_workers):
+            self.task_queue.put((None, None))
+        self.logger.debug("waiting for worker processes to stop")
+        while True:
+            # the processes are polled under the lock because only one thread
+            # can reap a process.  To the others it would look alive forever.
+            with self._workers_lock:
+                if all(x.exitcode == 0 for x in self.process_list):
+                    break
+            time.sleep(self.worker_check_interval)
+        self._report(None)
+        try:
+            self.results_thread.join()
+        except AttributeError:
+            # never started
+            pass
+
+    def _worker_process_func(self):
+        """The main routine of a worker process.
+
+        The process pulls jobs from the task queue and executes them until it
+        encounters a death token.  Every job it starts and finishes is
+        reported to the parent."""
+        # ^C is sent to the whole process group.  The parent deals with it
+        # by sending death tokens, so the workers ignore it.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        pid = os.getpid()
+        try:
+            if self.worker_setup_func:
+                self.worker_setup_func()
+        except Exception:
+            self.logger.critical(
+                'worker process %s failed to set up',
+                pid,
+                exc_info=True
+            )
+            raise
+        self._report((pid, None, 'ready'))
+        try:
+            queue = self.task_queue.queue
+            while True:
+                job = queue.get()
+                if job is None:
+                    self.logger.info('quits')
+                    break
+                if self.quit:
+                    # like a TaskThread that has seen a quit request, drain
+                    # the queue without doing the jobs or reporting them done.
+                    # The flag is the parent's, shared through an Event.
+                    continue
+                job_id, args, kwargs = job
+                self._report((pid, job_id, 'started'))
+                try:
+                    self.task_func(*args, **kwargs)
+                except Exception:
+                    self.logger.error(
+                        "Error in processing a job",
+                        exc_info=True
+                    )
+                except KeyboardInterrupt:
+                    self.logger.info('quit request detected')
+                    self.quit = True
+                self._report((pid, job_id, 'finished'))
+        finally:
+            if self.worker_close_func:
+                try:
+                    self.worker_close_func()
+                except Exception:
+                    self.logger.error(
+                        'worker process %s failed to close',
+                        pid,
+                        exc_info=True
+                    )
+
+
+class _JobQueue(object):
+    """the face of the multiprocessing queue that the queuing thread and
+    'wait_for_empty_queue' of the ThreadedTaskManager expect to see"""
+
+    def __init__(self, queue, task_manager):
+        self.queue = queue
+        self.task_manager = task_manager
+
+    def put(self, item):
+        function, job_params = item
+        if function is None:
+            self._put_death_token()
+            return
+        job = self.task_manager._register_job(job_params)
+        # with no workers left to take jobs, the queue never drains.  Waiting
+        # in steps lets the queuing thread notice that the app is quitting.
+        while True:
+            try:
+                self.queue.put(
+                    job,
+                    timeout=self.task_manager.worker_check_interval
+                )
+                return
+            except Queue.Full:
+                try:
+                    self.task_manager.quit_check()
+                except KeyboardInterrupt:
+                    with self.task_manager._pending_lock:
+                        self.task_manager._pending_callbacks.pop(job[0], None)
+                    raise
+
+    def _put_death_token(self):
+        # the workers drain the queue until they get their death tokens, but
+        # if they all died and are not replaced the queue stays full.  Then
+        # there is no worker left to take a token anyway.
+        while True:
+            try:
+                self.queue.put(
+                    None,
+                    timeout=self.task_manager.worker_check_interval
+                )
+                return
+            except Queue.Full:
+                if self.task_manager.quit:
+                    with self.task_manager._workers_lock:
+                        if not self.task_manager.process_list:
+                            return
+
+    def empty(self):
+        return self.queue.empty()
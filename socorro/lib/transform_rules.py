@@ -4,13 +4,20 @@
 
 import re
 import collections
+import copy
 import inspect
+import resource
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
 import configman
 from configman import RequiredConfig, Namespace
 from configman.dotdict import DotDict
-from configman.converters import to_str
+from configman.converters import to_str, class_converter
 
+from socorro.external.metrics_base import MetricsBase
 from socorro.lib import raven_client
 from socorro.lib.converters import (
     str_to_classes_in_namespaces_converter,
@@ -35,6 +42,31 @@ def kw_str_parse(a_string):
         return {}
 
 
+# counts the exceptions that Rule.predicate and Rule.action trap on each
+# thread, so that TransformRuleSystem can attribute them to the rule it was
+# running at the time
+_trapped_exceptions = threading.local()
+
+
+def _count_trapped_exception():
+    _trapped_exceptions.count = getattr(_trapped_exceptions, 'count', 0) + 1
+
+
+# RUSAGE_THREAD is Linux specific and is only named by the resource module
+# from Python 3.2 on.  Its value there is 1.
+_RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', 1)
+
+
+def _thread_cpu_time():
+    """the seconds of CPU time used so far by the calling thread"""
+    try:
+        usage = resource.getrusage(_RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    except (ValueError, resource.error):
+        # not Linux, settle for the time of the whole process
+        return time.clock()
+
+
 class Rule(RequiredConfig):
     """the base class for Support Rules.  It provides the framework for the
     rules 'predicate', 'action', and 'version' as well as utilites to help
@@ -46,6 +78,20 @@ class Rule(RequiredConfig):
         default=False,
     )
 
+    # the fields that the rule reads and writes, named like
+    # 'raw_crash.ProductName' or 'processed_crash.json_dump'.  A bare
+    # 'processed_crash' stands for all of its fields.  These declarations
+    # tell TransformRuleSystem.apply_all_rules_concurrently which rules can
+    # safely run at the same time.  None means that the rule hasn't declared
+    # them, so it could touch anything and is always run by itself.
+    reads = None
+    writes = None
+    # fields that must be present for the rule to have anything to do.  If
+    # one is missing, apply_all_rules_concurrently skips the rule without
+    # calling its predicate, so the predicate must still reject such crashes
+    # on its own.
+    requires = ()
+
     def __init__(self, config=None, quit_check_callback=None):
         self.config = config
         self.quit_check_callback = quit_check_callback
@@ -111,6 +157,7 @@ class Rule(RequiredConfig):
         try:
             return self._predicate(*args, **kwargs)
         except Exception as exception:
+            _count_trapped_exception()
             if not self._send_to_sentry(
                 'predicate',
                 self.predicate,
@@ -146,6 +193,7 @@ class Rule(RequiredConfig):
         try:
             return self._action(*args, **kwargs)
         except Exception as exception:
+            _count_trapped_exception()
             if not self._send_to_sentry(
                 'action',
                 self.action,
@@ -335,6 +383,91 @@ class TransformRule(Rule):
         pass
 
 
+class RuleStatistics(object):
+    """accumulates, for each rule, how often it was applied, how its
+    predicate came out, how many exceptions it trapped and how much wall
+    clock and CPU time it took."""
+
+    summary_columns = (
+        ('rule', '%-40s', '%-40s'),
+        ('applied', '%9s', '%9d'),
+        ('pred true', '%9s', '%9d'),
+        ('pred false', '%10s', '%10d'),
+        ('exceptions', '%10s', '%10d'),
+        ('wall (s)', '%10s', '%10.3f'),
+        ('mean (ms)', '%10s', '%10.3f'),
+        ('cpu (s)', '%10s', '%10.3f'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rules = {}
+
+    def record(
+        self,
+        rule_name,
+        predicate_result,
+        exception_count,
+        wall_time,
+        cpu_time
+    ):
+        with self._lock:
+            try:
+                rule_stats = self.rules[rule_name]
+            except KeyError:
+                rule_stats = self.rules[rule_name] = {
+                    'applied': 0,
+                    'predicate_true': 0,
+                    'predicate_false': 0,
+                    'exceptions': 0,
+                    'wall_time': 0.0,
+                    'cpu_time': 0.0,
+                }
+            rule_stats['applied'] += 1
+            if predicate_result:
+                rule_stats['predicate_true'] += 1
+            else:
+                rule_stats['predicate_false'] += 1
+            rule_stats['exceptions'] += exception_count
+            rule_stats['wall_time'] += wall_time
+            rule_stats['cpu_time'] += cpu_time
+
+    def summary_table(self):
+        """returns the statistics as a text table, the rules that took the
+        most wall clock time first"""
+        with self._lock:
+            rows = sorted(
+                ((name, dict(stats)) for name, stats in self.rules.items()),
+                key=lambda row: row[1]['wall_time'],
+                reverse=True
+            )
+        lines = [
+            ' '.join(
+                header_format % header
+                for header, header_format, _ in self.summary_columns
+            )
+        ]
+        for rule_name, stats in rows:
+            values = (
+                rule_name,
+                stats['applied'],
+                stats['predicate_true'],
+                stats['predicate_false'],
+                stats['exceptions'],
+                stats['wall_time'],
+                stats['wall_time'] * 1000.0 / stats['applied'],
+                stats['cpu_time'],
+            )
+            lines.append(' '.join(
+                value_format % value
+                for (_, _, value_format), value in zip(
+                    self.summary_columns,
+                    values
+                )
+            ))
+        return '\n'.join(lines)
+
+
 class TransformRuleSystem(RequiredConfig):
     """A collection of TransformRules that can be applied together"""
     required_config = Namespace()
@@ -348,6 +481,24 @@ class TransformRuleSystem(RequiredConfig):
         doc='should the rules announce what they are doing?',
         default=False,
     )
+    required_config.add_option(
+        'maximum_concurrent_rules',
+        doc='the most rules that apply_all_rules_concurrently will run at '
+            'the same time',
+        default=4,
+    )
+    required_config.add_option(
+        'rule_metrics_class',
+        doc='the class that receives the timings and counts of each rule',
+        default='socorro.external.metrics_base.MetricsBase',
+        from_string_converter=class_converter,
+    )
+    required_config.add_option(
+        'rule_statistics_summary_interval',
+        doc='seconds between logging a table of the accumulated timings and '
+            'counts of each rule (0 disables it)',
+        default=0,
+    )
 
     def __init__(self, config=None, quit_check=None):
         if quit_check:
@@ -355,11 +506,24 @@ class TransformRuleSystem(RequiredConfig):
         else:
             self._quit_check = self._null_quit_check
         self.rules = []
+        self._rule_levels = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
         if not config:
             config = DotDict()
         if 'chatty_rules' not in config:
             config.chatty_rules = False
         self.config = config
+        self.rule_metrics = config.get('rule_metrics_class', MetricsBase)(
+            config
+        )
+        self.rule_statistics = RuleStatistics()
+        self._summary_interval = config.get(
+            'rule_statistics_summary_interval',
+            0
+        )
+        self._last_summary_time = time.time()
+        self._summary_lock = threading.Lock()
         if "rules_list" in config:
             self.tag = config.tag
             self.act = getattr(self, config.action)
@@ -385,12 +549,14 @@ class TransformRuleSystem(RequiredConfig):
         self.rules = [
             TransformRule(*x, config=self.config) for x in an_iterable
         ]
+        self._rule_levels = None
 
     def append_rules(self, an_iterable):
         """add rules to the TransformRuleSystem"""
         self.rules.extend(
             TransformRule(*x, config=self.config) for x in an_iterable
         )
+        self._rule_levels = None
 
     def apply_all_rules(self, *args, **kwargs):
         """cycle through all rules and apply them all without regard to
@@ -405,7 +571,7 @@ class TransformRuleSystem(RequiredConfig):
                     'apply_all_rules: %s',
                     to_str(x.__class__)
                 )
-            predicate_result, action_result = x.act(*args, **kwargs)
+            predicate_result, action_result = self._act(x, *args, **kwargs)
             if self.config.chatty_rules:
                 self.config.logger.debug(
                     '               : pred - %s; act - %s',
@@ -427,7 +593,7 @@ class TransformRuleSystem(RequiredConfig):
                     'apply_until_action_succeeds: %s',
                     to_str(x.__class__)
                 )
-            predicate_result, action_result = x.act(*args, **kwargs)
+            predicate_result, action_result = self._act(x, *args, **kwargs)
             if self.config.chatty_rules:
                 self.config.logger.debug(
                     '                           : pred - %s; act - %s',
@@ -451,7 +617,7 @@ class TransformRuleSystem(RequiredConfig):
                     'apply_until_action_fails: %s',
                     to_str(x.__class__)
                 )
-            predicate_result, action_result = x.act(*args, **kwargs)
+            predicate_result, action_result = self._act(x, *args, **kwargs)
             if self.config.chatty_rules:
                 self.config.logger.debug(
                     '                        : pred - %s; act - %s',
@@ -476,7 +642,7 @@ class TransformRuleSystem(RequiredConfig):
                     'apply_until_predicate_succeeds: %s',
                     to_str(x.__class__)
                 )
-            predicate_result, action_result = x.act(*args, **kwargs)
+            predicate_result, action_result = self._act(x, *args, **kwargs)
             if self.config.chatty_rules:
                 self.config.logger.debug(
                     '                              : pred - %s; act - %s',
@@ -500,7 +666,7 @@ class TransformRuleSystem(RequiredConfig):
                     'apply_until_predicate_fails: %s',
                     to_str(x.__class__)
                 )
-            predicate_result, action_result = x.act(*args, **kwargs)
+            predicate_result, action_result = self._act(x, *args, **kwargs)
             if self.config.chatty_rules:
                 self.config.logger.debug(
                     '                           : pred - %s; act - %s',
@@ -511,7 +677,208 @@ class TransformRuleSystem(RequiredConfig):
                 return False
         return None
 
+    def _act(self, a_rule, *args, **kwargs):
+        """apply one rule, measuring it along the way"""
+        # the count of an outer rule that runs a nested rule system
+        outer_exception_count = getattr(_trapped_exceptions, 'count', 0)
+        _trapped_exceptions.count = 0
+        try:
+            wall_start = time.time()
+            cpu_start = _thread_cpu_time()
+            predicate_result, action_result = a_rule.act(*args, **kwargs)
+            cpu_time = _thread_cpu_time() - cpu_start
+            wall_time = time.time() - wall_start
+            exception_count = _trapped_exceptions.count
+        finally:
+            _trapped_exceptions.count = outer_exception_count
+        self._record_rule_statistics(
+            a_rule,
+            predicate_result,
+            exception_count,
+            wall_time,
+            cpu_time
+        )
+        return predicate_result, action_result
+
+    def _record_rule_statistics(
+        self,
+        a_rule,
+        predicate_result,
+        exception_count,
+        wall_time,
+        cpu_time
+    ):
+        rule_name = _rule_name(a_rule)
+        self.rule_statistics.record(
+            rule_name,
+            predicate_result,
+            exception_count,
+            wall_time,
+            cpu_time
+        )
+        self.rule_metrics.capture_stats({
+            'rules.%s.wall_time' % rule_name: int(wall_time * 1000),
+            'rules.%s.cpu_time' % rule_name: int(cpu_time * 1000),
+        })
+        self.rule_metrics.increment(
+            'rules.%s.predicate_%s' % (
+                rule_name,
+                'true' if predicate_result else 'false'
+            )
+        )
+        if exception_count:
+            self.rule_metrics.increment(
+                'rules.%s.exceptions' % rule_name,
+                exception_count
+            )
+
+        if not self._summary_interval:
+            return
+        now = time.time()
+        with self._summary_lock:
+            if now - self._last_summary_time < self._summary_interval:
+                return
+            self._last_summary_time = now
+        self.config.logger.info(
+            'rule statistics for %s:\n%s',
+            getattr(self, 'tag', 'rules'),
+            self.rule_statistics.summary_table()
+        )
+
+    def _get_rule_levels(self):
+        """arrange the rules into a dependency graph and flatten it into
+        levels.  A rule is placed in the level after the last of the earlier
+        rules that it conflicts with, so that the rules within a level are
+        independent of each other and can run at the same time.  Within a
+        level, rules keep their original order."""
+        if self._rule_levels is None:
+            rule_level_numbers = []
+            levels = []
+            for index, a_rule in enumerate(self.rules):
+                level_number = 0
+                for earlier_index in range(index):
+                    if _rules_conflict(self.rules[earlier_index], a_rule):
+                        level_number = max(
+                            level_number,
+                            rule_level_numbers[earlier_index] + 1
+                        )
+                rule_level_numbers.append(level_number)
+                if level_number == len(levels):
+                    levels.append([])
+                levels[level_number].append(a_rule)
+            self._rule_levels = levels
+        return self._rule_levels
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config.get('maximum_concurrent_rules', 4)
+                )
+            return self._executor
+
+    def _apply_rule(self, a_rule, *args):
+        if self.config.chatty_rules:
+            self.config.logger.debug(
+                'apply_all_rules_concurrently: %s',
+                to_str(a_rule.__class__)
+            )
+        predicate_result, action_result = self._act(a_rule, *args)
+        if self.config.chatty_rules:
+            self.config.logger.debug(
+                '                            : pred - %s; act - %s',
+                predicate_result,
+                action_result
+            )
+        return predicate_result, action_result
+
+    def apply_all_rules_concurrently(
+        self,
+        raw_crash,
+        raw_dumps,
+        processed_crash,
+        processor_meta
+    ):
+        """apply all the rules without regard to success or failure, like
+        'apply_all_rules', but run rules that have declared themselves
+        independent of each other at the same time.  Rules whose required
+        fields are missing are skipped.
+
+        Each rule that runs alongside others gets its own copy of
+        processor_meta.  Afterwards, the notes of the rules of a level and
+        the values they changed are merged in rule order, so the processor
+        notes come out the same as they would when the rules are applied one
+        at a time.
+
+        returns:
+             True - since success or failure is ignored"""
+        crash_parts = {
+            'raw_crash': raw_crash,
+            'raw_dumps': raw_dumps,
+            'processed_crash': processed_crash,
+            'processor_meta': processor_meta,
+        }
+        for a_level in self._get_rule_levels():
+            self._quit_check()
+            runnable_rules = [
+                a_rule for a_rule in a_level
+                if all(
+                    _field_is_present(crash_parts, a_field)
+                    for a_field in a_rule.requires
+                )
+            ]
+            if len(runnable_rules) == 1:
+                self._apply_rule(
+                    runnable_rules[0],
+                    raw_crash,
+                    raw_dumps,
+                    processed_crash,
+                    processor_meta
+                )
+                continue
+
+            executor = self._get_executor()
+            # what processor_meta held before the level ran, so that only
+            # what each rule changed is merged back
+            original_meta = dict(processor_meta.items())
+            rule_metas = []
+            futures = []
+            for a_rule in runnable_rules:
+                rule_meta = copy.copy(processor_meta)
+                rule_meta.processor_notes = []
+                rule_metas.append(rule_meta)
+                futures.append(executor.submit(
+                    self._apply_rule,
+                    a_rule,
+                    raw_crash,
+                    raw_dumps,
+                    processed_crash,
+                    rule_meta
+                ))
+            for a_future in futures:
+                a_future.result()
+            for rule_meta in rule_metas:
+                processor_meta.processor_notes.extend(
+                    rule_meta.processor_notes
+                )
+                for key, value in rule_meta.items():
+                    if key == 'processor_notes':
+                        continue
+                    if (
+                        key not in original_meta or
+                        original_meta[key] is not value
+                    ):
+                        processor_meta[key] = value
+                for key in original_meta:
+                    if key not in rule_meta and key in processor_meta:
+                        del processor_meta[key]
+        return True
+
     def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
         for a_rule in self.rules:
             try:
                 self.config.logger.debug('trying to close %s', to_str(a_rule.__class__))
@@ -523,6 +890,60 @@ class TransformRuleSystem(RequiredConfig):
             close_method()
 
 
+def _rule_name(a_rule):
+    """the name the statistics of a rule are kept under.  The rules loaded
+    from a rule list are all TransformRules, they are named after the class
+    or function of their action or, failing that, of their predicate."""
+    if isinstance(a_rule, TransformRule):
+        for a_callable in (a_rule.action, a_rule.predicate):
+            implementation = getattr(a_callable, '__self__', None)
+            if implementation is not None:
+                return implementation.__class__.__name__
+            name = getattr(a_callable, '__name__', '<lambda>')
+            if name != '<lambda>':
+                return name
+    return a_rule.__class__.__name__
+
+
+def _fields_overlap(some_fields, other_fields):
+    """do any of the dotted field names refer to the same data?  A field
+    overlaps with itself, its parents and its children."""
+    for a_field in some_fields:
+        for another_field in other_fields:
+            if (
+                a_field == another_field or
+                a_field.startswith(another_field + '.') or
+                another_field.startswith(a_field + '.')
+            ):
+                return True
+    return False
+
+
+def _rules_conflict(earlier_rule, later_rule):
+    """must 'later_rule' wait for 'earlier_rule' to finish?"""
+    for a_rule in (earlier_rule, later_rule):
+        if a_rule.reads is None or a_rule.writes is None:
+            return True
+    earlier_reads = tuple(earlier_rule.reads) + tuple(earlier_rule.requires)
+    later_reads = tuple(later_rule.reads) + tuple(later_rule.requires)
+    return (
+        _fields_overlap(earlier_rule.writes, later_reads) or
+        _fields_overlap(earlier_rule.writes, later_rule.writes) or
+        _fields_overlap(earlier_reads, later_rule.writes)
+    )
+
+
+def _field_is_present(crash_parts, dotted_field_name):
+    """look up a field like 'processed_crash.json_dump.modules' in the
+    mapping of crash part names to the crash parts"""
+    current = crash_parts
+    for a_key in dotted_field_name.split('.'):
+        if not isinstance(current, collections.Mapping) or a_key not in current:
+            return False
+        current = current[a_key]
+    return True
+
+
 # Useful rule predicates and actions
 
 # (True, '', '', copy_key_value, '', 'source_key=sally, destination_key=fred')
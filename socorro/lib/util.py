@@ -2,6 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import collections
+import copy
 import logging
 import sys
 import threading
@@ -146,3 +148,109 @@ class DotDict(dict):
     __getattr__ = dict.__getitem__
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
+
+
+def _copy_on_write(value):
+    if isinstance(value, collections.Mapping):
+        return CopyOnWriteDotDict(value)
+    if isinstance(value, list):
+        return [_copy_on_write(x) for x in value]
+    return value
+
+
+class CopyOnWriteDotDict(DotDict):
+    """a DotDict that can be changed without changing the mapping it was
+    made from.  Only the top level of the mapping is copied up front.  A
+    nested mapping or list is copied, one level at a time, the first time
+    it is looked up.  Parts of the mapping that are never looked up, like
+    the 'json_dump' of a processed crash that a crash store just deletes,
+    are never copied.
+
+    Since it is a real dict holding the current values, it serializes like
+    one.  The values that have not been looked up are still those of the
+    original mapping and must not be changed behind its back."""
+
+    def __init__(self, a_mapping=()):
+        super(CopyOnWriteDotDict, self).__init__(a_mapping)
+        # the keys whose values are still those of the original mapping
+        object.__setattr__(self, '_shared_keys', set(dict.keys(self)))
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if key in self._shared_keys:
+            self._shared_keys.discard(key)
+            value = _copy_on_write(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._shared_keys.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._shared_keys.discard(key)
+        dict.__delitem__(self, key)
+
+    __getattr__ = __getitem__
+    __setattr__ = __setitem__
+    __delattr__ = __delitem__
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        if key in self._shared_keys:
+            self._shared_keys.discard(key)
+            value = _copy_on_write(value)
+        return key, value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def clear(self):
+        self._shared_keys.clear()
+        dict.clear(self)
+
+    def copy(self):
+        return CopyOnWriteDotDict(self)
+
+    # without these, the copy module would look them up as attributes
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return DotDict(copy.deepcopy(dict(self.iteritems()), memo))
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self[key]
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __reduce__(self):
+        return (CopyOnWriteDotDict, (dict(self.iteritems()),))
@@ -15,6 +15,7 @@ from socorro.lib.converters import change_default
 
 from socorro.lib.util import DotDict
 from socorro.lib.transform_rules import Rule
+from socorro.processor.stackwalker_pool import StackwalkerPool
 
 
 def _create_symbol_path_str(input_str):
@@ -513,6 +514,55 @@ class BreakpadStackwalkerRule2015(ExternalProcessRule):
         doc='a path where temporary files may be written',
         default=tempfile.gettempdir(),
     )
+    required_config.add_option(
+        'stackwalker_pool_size',
+        doc='the number of long lived stackwalker processes to keep running '
+        'and feed dumps to. 0 means start a new stackwalker for every dump',
+        default=0,
+    )
+    required_config.add_option(
+        'stackwalker_pool_command_line',
+        doc='the template for the command to start a pooled stackwalker',
+        default=(
+            '{command_pathname} --pipe-server '
+            '--symbols-url {public_symbols_url} '
+            '--symbols-url {private_symbols_url} '
+            '--symbols-cache {symbol_cache_path} '
+            '--symbol-cache-max-bytes {stackwalker_pool_symbol_cache_size}'
+        ),
+    )
+    required_config.add_option(
+        'stackwalker_pool_symbol_cache_size',
+        doc='the size in bytes of the symbol files each pooled stackwalker '
+        'keeps parsed in memory between dumps, least recently used symbols '
+        'are dropped beyond that. 0 means no limit',
+        default=2 * 1024 ** 3,
+    )
+    required_config.add_option(
+        'stackwalker_pool_timeout',
+        doc='the number of seconds a pooled stackwalker has to walk a dump '
+        'before it is killed and replaced',
+        default=30,
+    )
+    required_config.add_option(
+        'stackwalker_pool_max_requests',
+        doc='the number of dumps a pooled stackwalker walks before it is '
+        'replaced by a fresh one',
+        default=1000,
+    )
+
+    def __init__(self, config):
+        super(BreakpadStackwalkerRule2015, self).__init__(config)
+        if config.get('stackwalker_pool_size', 0):
+            self.stackwalker_pool = StackwalkerPool(
+                config.stackwalker_pool_command_line.format(**dict(config)),
+                size=config.stackwalker_pool_size,
+                timeout=config.stackwalker_pool_timeout,
+                max_requests=config.stackwalker_pool_max_requests,
+                logger=config.logger,
+            )
+        else:
+            self.stackwalker_pool = None
 
     def version(self):
         return '1.0'
@@ -538,7 +588,78 @@ class BreakpadStackwalkerRule2015(ExternalProcessRule):
             BreakpadStackwalkerRule2015,
             self
         )._execute_external_process(command_line, processor_meta)
+        return self._interpret_stackwalker_output(
+            stackwalker_output,
+            return_code,
+            command_line,
+            processor_meta
+        )
 
+    def _execute_pooled_stackwalker(
+        self,
+        dump_pathname,
+        raw_crash_pathname,
+        processor_meta
+    ):
+        output, return_code = self.stackwalker_pool.walk(
+            raw_crash_pathname,
+            dump_pathname
+        )
+        if output is None:
+            stackwalker_output = {}
+        else:
+            try:
+                stackwalker_output = ujson.loads(output)
+            except Exception as x:
+                processor_meta.processor_notes.append(
+                    "%s output failed in json: %s" % (
+                        self.config.command_pathname,
+                        x
+                    )
+                )
+                stackwalker_output = {}
+        if isinstance(stackwalker_output, Mapping):
+            # the symbol cache statistics are about the stackwalker, not the
+            # crash, so they don't belong in the json_dump
+            self._capture_symbol_cache_stats(
+                stackwalker_output.pop('symbol_cache_stats', None)
+            )
+        return self._interpret_stackwalker_output(
+            stackwalker_output,
+            return_code,
+            dump_pathname,
+            processor_meta
+        )
+
+    def _capture_symbol_cache_stats(self, symbol_cache_stats):
+        if not symbol_cache_stats:
+            return
+        try:
+            metrics = self.config.metrics
+            for key in ('hits', 'misses', 'evictions'):
+                metrics.increment(
+                    'processor.stackwalker.symbol_cache.%s' % key,
+                    value=symbol_cache_stats.get(key, 0)
+                )
+            for key in ('loaded_modules', 'loaded_bytes'):
+                metrics.gauge(
+                    'processor.stackwalker.symbol_cache.%s' % key,
+                    symbol_cache_stats.get(key, 0)
+                )
+        except Exception:
+            # NOTE(willkg): An error here shouldn't screw up processing. Log
+            # it so we can fix it later.
+            self.config.logger.exception(
+                'something went wrong when capturing symbol cache stats'
+            )
+
+    def _interpret_stackwalker_output(
+        self,
+        stackwalker_output,
+        return_code,
+        description,
+        processor_meta
+    ):
         if not isinstance(stackwalker_output, Mapping):
             processor_meta.processor_notes.append(
                 "MDSW produced unexpected output: %s..." %
@@ -563,7 +684,7 @@ class BreakpadStackwalkerRule2015(ExternalProcessRule):
         elif return_code != 0 or not stackwalker_data.success:
             processor_meta.processor_notes.append(
                 "MDSW failed on '%s': %s" % (
-                    command_line,
+                    description,
                     stackwalker_data.mdsw_status_string
                 )
             )
@@ -601,18 +722,27 @@ class BreakpadStackwalkerRule2015(ExternalProcessRule):
                         dump_pathname
                     )
 
-                command_line = self.config.command_line.format(
-                    **dict(
-                        self.config,
-                        dump_file_pathname=dump_pathname,
-                        raw_crash_pathname=raw_crash_pathname
+                if self.stackwalker_pool:
+                    stackwalker_data, return_code = \
+                        self._execute_pooled_stackwalker(
+                            dump_pathname,
+                            raw_crash_pathname,
+                            processor_meta
+                        )
+                else:
+                    command_line = self.config.command_line.format(
+                        **dict(
+                            self.config,
+                            dump_file_pathname=dump_pathname,
+                            raw_crash_pathname=raw_crash_pathname
+                        )
                     )
-                )
 
-                stackwalker_data, return_code = self._execute_external_process(
-                    command_line,
-                    processor_meta
-                )
+                    stackwalker_data, return_code = \
+                        self._execute_external_process(
+                            command_line,
+                            processor_meta
+                        )
 
                 if dump_name == self.config.dump_field:
                     processed_crash.update(stackwalker_data)
@@ -622,6 +752,10 @@ class BreakpadStackwalkerRule2015(ExternalProcessRule):
 
         return True
 
+    def close(self):
+        if self.stackwalker_pool:
+            self.stackwalker_pool.close()
+
 
 class JitCrashCategorizeRule(ExternalProcessRule):
 
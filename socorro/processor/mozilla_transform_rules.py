@@ -532,6 +532,8 @@ class PluginUserComment(Rule):
 
 
 class ExploitablityRule(Rule):
+    reads = ('processed_crash.json_dump.sensitive',)
+    writes = ('processed_crash.exploitability',)
 
     def version(self):
         return '1.0'
@@ -551,6 +553,9 @@ class ExploitablityRule(Rule):
 
 
 class FlashVersionRule(Rule):
+    reads = ('processed_crash.json_dump.modules',)
+    writes = ('processed_crash.flash_version',)
+
     required_config = Namespace()
     required_config.add_option(
         'known_flash_identifiers',
@@ -654,6 +659,8 @@ class FlashVersionRule(Rule):
 
 
 class Winsock_LSPRule(Rule):
+    reads = ('raw_crash.Winsock_LSP',)
+    writes = ('processed_crash.Winsock_LSP',)
 
     def version(self):
         return '1.0'
@@ -675,6 +682,8 @@ class TopMostFilesRule(Rule):
     entirely, just giving one single value.  The fact that the destination
     varible in the processed_crash is plural rather than singular is
     unfortunate."""
+    reads = ('processed_crash.json_dump',)
+    writes = ('processed_crash.topmost_filenames',)
 
     def version(self):
         return '1.0'
@@ -783,6 +792,14 @@ class MissingSymbolsRule(Rule):
 
 
 class BetaVersionRule(Rule):
+    reads = (
+        'processed_crash.build',
+        'processed_crash.product',
+        'processed_crash.version',
+    )
+    writes = ('processed_crash.version',)
+    requires = ('processed_crash.release_channel',)
+
     required_config = Namespace()
     required_config.add_option(
         'database_class',
@@ -904,6 +921,9 @@ class BetaVersionRule(Rule):
 
 
 class OSPrettyVersionRule(Rule):
+    reads = ('processed_crash.os_name', 'processed_crash.os_version')
+    writes = ('processed_crash.os_pretty_version',)
+
     required_config = Namespace()
     required_config.add_option(
         'database_class',
@@ -1011,6 +1031,9 @@ class ThemePrettyNameRule(Rule):
     other built-in extensions.
 
     Must be run after the Addons Rule."""
+    reads = ()
+    writes = ('processed_crash.addons',)
+    requires = ('processed_crash.addons',)
 
     def __init__(self, config):
         super(ThemePrettyNameRule, self).__init__(config)
@@ -34,6 +34,13 @@ from socorro.lib.util import DotDict
 #    rule set class: the fully qualified name of the class that implements
 #                    the rule application process.  On the introduction of
 #                    Processor2015, the only option is the one in the example.
+#    action: the name of the rule set class method that applies the rules.
+#            'apply_all_rules_concurrently' runs the rules that declare
+#            which fields they read and write in parallel when they are
+#            independent of each other.  It is opt in: the rule set's pool
+#            of 'maximum_concurrent_rules' threads is shared by all of the
+#            processor's threads, so it only pays off when rules wait on
+#            I/O and the processor has fewer threads than cores.
 #    rule list: a comma delimited list of fully qualified class names that
 #               implement the individual transformation rules.  The API that
 #               these classes must conform to is defined by the rule base class
@@ -79,12 +79,15 @@ class ProcessorApp(FetchTransformSaveWithSeparateNewCrashSourceApp):
             "destination.crashstorage_class": FSDatedPermanentStorage,
         }
 
-    def _transform(self, crash_id):
-        """this implementation is the framework on how a raw crash is
-        converted into a processed crash.  The 'crash_id' passed in is used as
-        a key to fetch the raw crash from the 'source', the conversion funtion
-        implemented by the 'processor_class' is applied, the
-        processed crash is saved to the 'destination'"""
+    # a raw crash is converted into a processed crash in the stages of the
+    # base class: the 'crash_id' is used as a key to fetch the raw crash from
+    # the 'source', the conversion function implemented by the
+    # 'processor_class' is applied, and the processed crash is saved to the
+    # 'destination'
+
+    def _fetch(self, crash_id):
+        """load the raw crash, its dumps as files and any earlier processed
+        crash.  Crashes that can't be loaded are rejected."""
         try:
             raw_crash = self.source.get_raw_crash(crash_id)
             dumps = self.source.get_raw_dumps_as_files(crash_id)
@@ -93,7 +96,7 @@ class ProcessorApp(FetchTransformSaveWithSeparateNewCrashSourceApp):
                 crash_id,
                 'this crash cannot be found in raw crash storage'
             )
-            return
+            return None
         except Exception as x:
             self.config.logger.warning(
                 'error loading crash %s',
@@ -104,25 +107,40 @@ class ProcessorApp(FetchTransformSaveWithSeparateNewCrashSourceApp):
                 crash_id,
                 'error in loading: %s' % x
             )
-            return
+            return None
 
+        crash = DotDict(
+            crash_id=crash_id,
+            raw_crash=raw_crash,
+            dumps=dumps,
+        )
         try:
-            processed_crash = self.source.get_unredacted_processed(
+            crash.processed_crash = self.source.get_unredacted_processed(
                 crash_id
             )
         except CrashIDNotFound:
-            processed_crash = DotDict()
+            crash.processed_crash = DotDict()
+        except Exception:
+            self._finish(crash)
+            raise
+        return crash
 
+    def _process(self, crash):
         try:
-            if 'uuid' not in raw_crash:
-                raw_crash.uuid = crash_id
-            processed_crash = (
+            if 'uuid' not in crash.raw_crash:
+                crash.raw_crash.uuid = crash.crash_id
+            crash.processed_crash = (
                 self.processor.process_crash(
-                    raw_crash,
-                    dumps,
-                    processed_crash,
+                    crash.raw_crash,
+                    crash.dumps,
+                    crash.processed_crash,
                 )
             )
+        except Exception as exception:
+            self._capture_error_and_reraise(crash.crash_id, exception)
+
+    def _save(self, crash):
+        try:
             """ bug 866973 - save_raw_and_processed() instead of just
                 save_processed().  The raw crash may have been modified
                 by the processor rules.  The individual crash storage
@@ -130,72 +148,77 @@ class ProcessorApp(FetchTransformSaveWithSeparateNewCrashSourceApp):
                 or not.
             """
             self.destination.save_raw_and_processed(
-                raw_crash,
+                crash.raw_crash,
                 None,
-                processed_crash,
-                crash_id
+                crash.processed_crash,
+                crash.crash_id
             )
-            self.config.logger.info('saved - %s', crash_id)
+            self.config.logger.info('saved - %s', crash.crash_id)
         except Exception as exception:
-            # Immediately capture this as local variables.
-            # During this error handling we're going to be using other
-            # try:except: constructs (e.g. swallowing raven send errors)
-            # so we can't reference `sys.exc_info()` later.
-            exc_type, exc_value, exc_tb = sys.exc_info()
+            self._capture_error_and_reraise(crash.crash_id, exception)
+
+    def _capture_error_and_reraise(self, crash_id, exception):
+        """send the exception being handled to Sentry and raise it again"""
+        # Immediately capture this as local variables.
+        # During this error handling we're going to be using other
+        # try:except: constructs (e.g. swallowing raven send errors)
+        # so we can't reference `sys.exc_info()` later.
+        exc_type, exc_value, exc_tb = sys.exc_info()
 
-            if self.config.sentry and self.config.sentry.dsn:
+        if self.config.sentry and self.config.sentry.dsn:
+            try:
+                if isinstance(exception, collections.Sequence):
+                    # Then it's already an iterable!
+                    exceptions = exception
+                else:
+                    exceptions = [exception]
+                client = raven_client.get_client(self.config.sentry.dsn)
+                client.context.activate()
+                client.context.merge({'extra': {
+                    'crash_id': crash_id,
+                }})
                 try:
-                    if isinstance(exception, collections.Sequence):
-                        # Then it's already an iterable!
-                        exceptions = exception
-                    else:
-                        exceptions = [exception]
-                    client = raven_client.get_client(self.config.sentry.dsn)
-                    client.context.activate()
-                    client.context.merge({'extra': {
-                        'crash_id': crash_id,
-                    }})
-                    try:
-                        for exception in exceptions:
-                            identifier = client.captureException(
-                                exception
+                    for exception in exceptions:
+                        identifier = client.captureException(
+                            exception
+                        )
+                        self.config.logger.info(
+                            'Error captured in Sentry! '
+                            'Reference: {}'.format(
+                                identifier
                             )
-                            self.config.logger.info(
-                                'Error captured in Sentry! '
-                                'Reference: {}'.format(
-                                    identifier
-                                )
-                            )
-                    finally:
-                        client.context.clear()
-                except Exception:
-                    self.config.logger.error(
-                        'Unable to report error with Raven',
-                        exc_info=True,
-                    )
-            else:
-                self.config.logger.warning(
-                    'Raven DSN is not configured and an exception happened'
+                        )
+                finally:
+                    client.context.clear()
+            except Exception:
+                self.config.logger.error(
+                    'Unable to report error with Raven',
+                    exc_info=True,
                 )
+        else:
+            self.config.logger.warning(
+                'Raven DSN is not configured and an exception happened'
+            )
 
-            # Why not just do `raise exception`?
-            # Because if we don't do it this way, the eventual traceback
-            # is going to point to *this* line (right after this comment)
-            # rather than the actual error where it originally happened.
-            raise exc_type, exc_value, exc_tb
-        finally:
-            # earlier, we created the dumps as files on the file system,
-            # we need to clean up after ourselves.
-            for a_dump_pathname in dumps.itervalues():
-                try:
-                    if "TEMPORARY" in a_dump_pathname:
-                        os.unlink(a_dump_pathname)
-                except OSError as x:
-                    # the file does not actually exist
-                    self.config.logger.info(
-                        'deletion of dump failed: %s',
-                        x,
-                    )
+        # Why not just do `raise exception`?
+        # Because if we don't do it this way, the eventual traceback
+        # is going to point to *this* line (right after this comment)
+        # rather than the actual error where it originally happened.
+        raise exc_type, exc_value, exc_tb
+
+    def _finish(self, crash):
+        # earlier, we created the dumps as files on the file system,
+        # we need to clean up after ourselves.
+        for a_dump_pathname in crash.dumps.itervalues():
+            try:
+                if "TEMPORARY" in a_dump_pathname:
+                    os.unlink(a_dump_pathname)
+            except OSError as x:
+                # the file does not actually exist
+                self.config.logger.info(
+                    'deletion of dump failed: %s',
+                    x,
+                )
 
     def _setup_source_and_destination(self):
         """this method simply instatiates the source, destination,
@@ -3,6 +3,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
+import threading
+import time
 
 import ujson
 from itertools import islice
@@ -10,11 +12,134 @@ from itertools import islice
 from configman import Namespace, RequiredConfig
 from configman.converters import class_converter
 
+from socorro.lib.lru_cache import LRUCache
 from socorro.lib.transform_rules import Rule
 
 from socorro import siglists
 
 
+# characters with a special meaning in a regular expression
+_REGEX_METACHARACTERS = frozenset('.^$*+?{}[]|()')
+# characters that make what precedes them optional or repeated
+_REGEX_QUANTIFIERS = frozenset('*+?{')
+
+
+def _split_literal_prefix(pattern):
+    """split a regular expression into the plain string it starts with and
+    the regular expression that must follow.  A pattern is only split if
+    matching it is the same as matching that plain string followed by the
+    remainder:
+
+        'nsCOMPtr_base::.*'  -> ('nsCOMPtr_base::', '')
+        'js::HashSet<.*>::.*' -> ('js::HashSet<', '.*>::.*')
+        'PR_Wai?t'           -> ('PR_Wa', 'i?t')
+        '(Nt|Zw)?WaitFor'    -> ('', '(Nt|Zw)?WaitFor')
+
+    A remainder of '.*' matches anything, including nothing, so at the start
+    of a string it is the same as no remainder at all."""
+    # the start of each character of the literal in the pattern
+    starts = []
+    literal = []
+    index = 0
+    while index < len(pattern):
+        a_character = pattern[index]
+        if a_character == '\\':
+            # '\.' is a literal '.', but '\d', '\s', '\1' and the like
+            # are character classes or references
+            if index + 1 == len(pattern) or pattern[index + 1].isalnum():
+                break
+            starts.append(index)
+            literal.append(pattern[index + 1])
+            index += 2
+            continue
+        if a_character in _REGEX_METACHARACTERS:
+            break
+        starts.append(index)
+        literal.append(a_character)
+        index += 1
+    if (
+        index < len(pattern) and
+        pattern[index] in _REGEX_QUANTIFIERS and
+        literal
+    ):
+        # the quantifier applies to the last character, which is therefore
+        # not certain to be there
+        index = starts.pop()
+        literal.pop()
+    remainder = pattern[index:]
+    if '|' in remainder or '(?' in remainder:
+        # an alternation or a flag could reach back over the literal
+        return '', pattern
+    if remainder == '.*':
+        remainder = ''
+    return ''.join(literal), remainder
+
+
+# the key under which the remainders of the patterns that end at a node of a
+# trie are stored
+_TERMINAL = None
+
+
+def _add_to_trie(trie, pattern):
+    literal, remainder = _split_literal_prefix(pattern)
+    node = trie
+    for a_character in literal:
+        node = node.setdefault(a_character, {})
+    node.setdefault(_TERMINAL, []).append(remainder)
+
+
+def _trie_to_regex(trie):
+    """turn a trie of patterns into a regular expression in which no two
+    alternatives at the same level start with the same literal character, so
+    the regular expression engine rejects a string after looking at about as
+    many characters as it shares with the closest pattern"""
+    remainders = trie.get(_TERMINAL, [])
+    if '' in remainders:
+        # a plain string ends here: any string that gets this far matches
+        return ''
+    alternatives = [
+        re.escape(a_character) + _trie_to_regex(trie[a_character])
+        for a_character in sorted(x for x in trie if x is not _TERMINAL)
+    ]
+    alternatives.extend('(?:%s)' % x for x in remainders)
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return '(?:%s)' % '|'.join(alternatives)
+
+
+class SiglistMatcher(object):
+    """a stand in for the regular expression made by joining the entries of
+    a siglist with '|'.  Its 'match' matches the same strings as that regular
+    expression's 'match', but at a cost that does not grow with the length of
+    the siglist.
+
+    Joined with '|', every entry is tried in turn against every frame.  Here
+    the entries are put into a trie keyed by the plain string each one starts
+    with; entries starting with '.*' go in a second trie keyed by what
+    follows the '.*'.  Each trie is compiled into a single regular expression
+    in which the entries share their common prefixes, so the regular
+    expression engine discards most entries after looking at the first few
+    characters of a frame."""
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        prefix_trie = {}
+        contains_trie = {}
+        for a_pattern in self.patterns:
+            if a_pattern.startswith('.*'):
+                _add_to_trie(contains_trie, a_pattern[2:])
+            else:
+                _add_to_trie(prefix_trie, a_pattern)
+
+        alternatives = []
+        if prefix_trie:
+            alternatives.append(_trie_to_regex(prefix_trie))
+        if contains_trie:
+            alternatives.append('.*' + _trie_to_regex(contains_trie))
+        self.pattern = '|'.join(alternatives)
+        self.match = re.compile(self.pattern).match
+
+
 class SignatureTool(RequiredConfig):
     """this is the base class for signature generation objects.  It defines the
     basic interface and provides truncation and quoting service.  Any derived
@@ -60,6 +185,19 @@ class CSignatureToolBase(SignatureTool):
         doc="remove function arguments during normalization",
         reference_value_from='resource.signature'
     )
+    required_config.add_option(
+        'normalize_cache_size',
+        default=10000,
+        doc="the number of normalized function names to remember",
+        reference_value_from='resource.signature'
+    )
+    required_config.add_option(
+        'normalize_cache_stats_interval',
+        default=60,
+        doc="seconds between reports of the normalization cache statistics "
+            "to the metrics system (0 disables them)",
+        reference_value_from='resource.signature'
+    )
 
     hang_prefixes = {
         -1: "hang",
@@ -76,13 +214,31 @@ class CSignatureToolBase(SignatureTool):
 
         self.fixup_space = re.compile(r' (?=[\*&,])')
         self.fixup_comma = re.compile(r',(?! )')
+        self._delimiter_re_cache = {}
+
+        # the same few thousand functions show up in crash after crash, so
+        # the result of normalizing a function name is remembered.  The cache
+        # belongs to this instance because the result depends on its config
+        # and siglists.
+        self.normalize_cache = LRUCache(
+            config.setdefault('normalize_cache_size', 10000)
+        )
+        self.normalize_cache_stats_interval = config.setdefault(
+            'normalize_cache_stats_interval',
+            60
+        )
+        self._last_stats_time = time.time()
+        self._stats_lock = threading.Lock()
 
     @staticmethod
-    def _is_exception(exception_list, remaining_original_line, line_up_to_current_position):
+    def _is_exception(exception_list, function_signature_str, index):
+        """is the delimiter at 'index' immediately followed or preceded by
+        one of the exceptions?  The comparisons are made in place so that no
+        copies of the, sometimes very long, function signature are made."""
         for an_exception in exception_list:
-            if remaining_original_line.startswith(an_exception):
+            if function_signature_str.startswith(an_exception, index + 1):
                 return True
-            if line_up_to_current_position.endswith(an_exception):
+            if function_signature_str.endswith(an_exception, 0, index):
                 return True
         return False
 
@@ -101,39 +257,115 @@ class CSignatureToolBase(SignatureTool):
         :arg list exception_substring_list: list of exceptions that shouldn't collapse
 
         """
+        delimiters_re = self._delimiter_re_cache.get((open_string, close_string))
+        if delimiters_re is None:
+            delimiters_re = re.compile(
+                '[%s%s]' % (re.escape(open_string), re.escape(close_string))
+            )
+            self._delimiter_re_cache[(open_string, close_string)] = delimiters_re
+
         target_counter = 0
         collapsed_list = []
         exception_mode = False
+        # the text between delimiters is copied in whole runs rather than a
+        # character at a time, so the work done is proportional to the
+        # length of the signature
+        position = 0
 
-        def append_if_not_in_collapse_mode(a_character):
+        for a_match in delimiters_re.finditer(function_signature_str):
+            index = a_match.start()
             if not target_counter:
-                collapsed_list.append(a_character)
-
-        for index, a_character in enumerate(function_signature_str):
+                collapsed_list.append(function_signature_str[position:index])
+            position = index + 1
+            a_character = function_signature_str[index]
             if a_character == open_string:
                 if self._is_exception(
                     exception_substring_list,
-                    function_signature_str[index + 1:],
-                    function_signature_str[:index]
+                    function_signature_str,
+                    index
                 ):
                     exception_mode = True
-                    append_if_not_in_collapse_mode(a_character)
+                    if not target_counter:
+                        collapsed_list.append(a_character)
                     continue
-                append_if_not_in_collapse_mode(replacement_open_string)
+                if not target_counter:
+                    collapsed_list.append(replacement_open_string)
                 target_counter += 1
-            elif a_character == close_string:
-                if exception_mode:
-                    append_if_not_in_collapse_mode(a_character)
-                    exception_mode = False
-                else:
-                    target_counter -= 1
-                    append_if_not_in_collapse_mode(replacement_close_string)
+            elif exception_mode:
+                if not target_counter:
+                    collapsed_list.append(a_character)
+                exception_mode = False
             else:
-                append_if_not_in_collapse_mode(a_character)
+                target_counter -= 1
+                if not target_counter:
+                    collapsed_list.append(replacement_close_string)
 
+        if not target_counter:
+            collapsed_list.append(function_signature_str[position:])
         edited_function = ''.join(collapsed_list)
         return edited_function
 
+    def _normalize_function(self, function):
+        """returns a tuple of the normalized form of a function name and a
+        boolean that is True if the frame's line number must be appended to
+        it.  The result depends only on the function name, so it is safe to
+        cache."""
+        function = self._collapse(
+            function,
+            '<',
+            '<',
+            '>',
+            'T>',
+            ('name omitted', 'IPC::ParamTraits')
+        )
+        if self.config.collapse_arguments:
+            function = self._collapse(
+                function,
+                '(',
+                '',
+                ')',
+                '',
+                ('anonymous namespace', 'operator')
+            )
+
+        needs_line_number = bool(
+            self.signatures_with_line_numbers_re.match(function)
+        )
+        # Remove spaces before all stars, ampersands, and commas
+        function = self.fixup_space.sub('', function)
+        # Ensure a space after commas
+        function = self.fixup_comma.sub(', ', function)
+        return function, needs_line_number
+
+    def _capture_normalize_cache_stats(self):
+        if not self.normalize_cache_stats_interval:
+            return
+        now = time.time()
+        with self._stats_lock:
+            if now - self._last_stats_time < self.normalize_cache_stats_interval:
+                return
+            self._last_stats_time = now
+        try:
+            metrics = self.config.metrics
+            cache = self.normalize_cache
+            for key, value in (
+                ('size', len(cache)),
+                ('hits', cache.hits),
+                ('misses', cache.misses),
+                ('evictions', cache.evictions),
+                ('hit_rate', cache.hit_rate),
+            ):
+                metrics.gauge(
+                    'processor.signature.normalize_cache.%s' % key,
+                    value
+                )
+        except Exception:
+            # NOTE(willkg): An error here shouldn't screw up processing. Log
+            # it so we can fix it later.
+            self.config.logger.exception(
+                'something went wrong when capturing normalize cache stats'
+            )
+
     def normalize_signature(
         self,
         module=None,
@@ -156,30 +388,13 @@ class CSignatureToolBase(SignatureTool):
         if normalized is not None:
             return normalized
         if function:
-            function = self._collapse(
-                function,
-                '<',
-                '<',
-                '>',
-                'T>',
-                ('name omitted', 'IPC::ParamTraits')
-            )
-            if self.config.collapse_arguments:
-                function = self._collapse(
-                    function,
-                    '(',
-                    '',
-                    ')',
-                    '',
-                    ('anonymous namespace', 'operator')
-                )
-
-            if self.signatures_with_line_numbers_re.match(function):
+            normalized_function = self.normalize_cache.get(function)
+            if normalized_function is None:
+                normalized_function = self._normalize_function(function)
+                self.normalize_cache.put(function, normalized_function)
+            function, needs_line_number = normalized_function
+            if needs_line_number:
                 function = "%s:%s" % (function, line)
-            # Remove spaces before all stars, ampersands, and commas
-            function = self.fixup_space.sub('', function)
-            # Ensure a space after commas
-            function = self.fixup_comma.sub(', ', function)
             return function
         # if source is not None and source_line is not None:
         if file and line:
@@ -203,6 +418,7 @@ class CSignatureToolBase(SignatureTool):
           - irrelevant: Append this element only after seeing a prefix frame
         The signature is a ' | ' separated string of frame names.
         """
+        self._capture_normalize_cache_stats()
         signature_notes = []
 
         # shorten source_list to the first signatureSentinel
@@ -276,17 +492,17 @@ class CSignatureTool(CSignatureToolBase):
 
     def __init__(self, config, quit_check_callback=None):
         super(CSignatureTool, self).__init__(config, quit_check_callback)
-        self.irrelevant_signature_re = re.compile(
-            '|'.join(siglists.IRRELEVANT_SIGNATURE_RE)
+        self.irrelevant_signature_re = SiglistMatcher(
+            siglists.IRRELEVANT_SIGNATURE_RE
         )
-        self.prefix_signature_re = re.compile(
-            '|'.join(siglists.PREFIX_SIGNATURE_RE)
+        self.prefix_signature_re = SiglistMatcher(
+            siglists.PREFIX_SIGNATURE_RE
         )
-        self.signatures_with_line_numbers_re = re.compile(
-            '|'.join(siglists.SIGNATURES_WITH_LINE_NUMBERS_RE)
+        self.signatures_with_line_numbers_re = SiglistMatcher(
+            siglists.SIGNATURES_WITH_LINE_NUMBERS_RE
         )
-        self.trim_dll_signature_re = re.compile(
-            '|'.join(siglists.TRIM_DLL_SIGNATURE_RE)
+        self.trim_dll_signature_re = SiglistMatcher(
+            siglists.TRIM_DLL_SIGNATURE_RE
         )
         self.signature_sentinels = siglists.SIGNATURE_SENTINELS
 
@@ -0,0 +1,244 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""a pool of long lived stackwalker processes.
+
+Rather than starting a new stackwalker for every minidump, the pool keeps a
+number of them running in '--pipe-server' mode.  Each request is written to
+the stdin of an idle worker as a single line:
+
+    <raw crash json pathname>\t<dump pathname>\n
+
+and the worker answers with the JSON for that dump on a single line of its
+stdout.  Symbol files parsed by a worker stay loaded for the crashes that
+follow, so the cost of reading them is paid once per worker rather than once
+per crash."""
+
+import os
+import select
+import shlex
+import subprocess
+import threading
+import time
+import Queue
+
+
+# the return code reported when a worker had to be killed because it did not
+# answer in time.  It is the same code that the 'timeout' command uses, so
+# the stackwalker rules treat both the same way.
+TIMEOUT_RETURN_CODE = 124
+
+
+class StackwalkerTimeout(Exception):
+    pass
+
+
+class StackwalkerDied(Exception):
+    def __init__(self, return_code):
+        super(StackwalkerDied, self).__init__(
+            'stackwalker exited with return code %s' % return_code
+        )
+        self.return_code = return_code
+
+
+class StackwalkerWorker(object):
+    """one stackwalker process running in '--pipe-server' mode"""
+
+    read_size = 65536
+
+    def __init__(self, command_line):
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen(
+                shlex.split(command_line),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=devnull,
+                close_fds=True,
+            )
+        self.requests_served = 0
+        self._leftover = ''
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def walk(self, raw_crash_pathname, dump_pathname, timeout):
+        """send one request to the stackwalker and return its answer as a
+        string of JSON.
+
+        raises:
+            StackwalkerTimeout - no complete answer arrived within 'timeout'
+                                 seconds
+            StackwalkerDied - the process went away while we were talking
+                              to it"""
+        try:
+            self.process.stdin.write(
+                '%s\t%s\n' % (raw_crash_pathname, dump_pathname)
+            )
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            raise StackwalkerDied(self.process.wait())
+        self.requests_served += 1
+        return self._read_line(time.time() + timeout)
+
+    def _read_line(self, deadline):
+        # file objects' readline can't be given a timeout, so the raw file
+        # descriptor is read in chunks until a complete, non-blank line has
+        # arrived.
+        fd = self.process.stdout.fileno()
+        chunks = []
+        pending = self._leftover
+        self._leftover = ''
+        while True:
+            if pending:
+                newline = pending.find('\n')
+                if newline == -1:
+                    chunks.append(pending)
+                else:
+                    chunks.append(pending[:newline])
+                    self._leftover = pending[newline + 1:]
+                    line = ''.join(chunks)
+                    if line.strip():
+                        return line
+                    # a blank line is not an answer, keep reading
+                    chunks = []
+                    pending = self._leftover
+                    self._leftover = ''
+                    continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise StackwalkerTimeout()
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            pending = os.read(fd, self.read_size)
+            if not pending:
+                raise StackwalkerDied(self.process.wait())
+
+    def close(self):
+        """ask the process to finish by closing its stdin, killing it if it
+        won't go quietly"""
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        for _ in range(10):
+            if not self.is_alive():
+                break
+            time.sleep(0.1)
+        else:
+            self.kill()
+            return
+        self.process.stdout.close()
+
+    def kill(self):
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                # it's already gone
+                pass
+            self.process.wait()
+        for a_pipe in (self.process.stdin, self.process.stdout):
+            try:
+                a_pipe.close()
+            except (IOError, OSError):
+                pass
+
+
+class StackwalkerPool(object):
+    """a fixed number of StackwalkerWorkers shared by all the threads of the
+    processor.  Workers are started lazily on first use, replaced when they
+    die or time out, and recycled after serving 'max_requests' crashes so
+    that the memory held by their symbol caches can't grow without bound."""
+
+    def __init__(self, command_line, size, timeout, max_requests, logger):
+        self.command_line = command_line
+        self.timeout = timeout
+        self.max_requests = max_requests
+        self.logger = logger
+        self._idle_workers = Queue.Queue()
+        # None is a placeholder for a worker that has yet to be started
+        for _ in range(size):
+            self._idle_workers.put(None)
+        self._all_workers = set()
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        worker = StackwalkerWorker(self.command_line)
+        with self._lock:
+            self._all_workers.add(worker)
+        return worker
+
+    def _retire(self, worker, kill=False):
+        with self._lock:
+            self._all_workers.discard(worker)
+        if kill:
+            worker.kill()
+        else:
+            worker.close()
+
+    def _checkout(self):
+        worker = self._idle_workers.get()
+        try:
+            if worker is not None and (
+                not worker.is_alive() or
+                worker.requests_served >= self.max_requests
+            ):
+                self._retire(worker)
+                worker = None
+            if worker is None:
+                worker = self._spawn()
+        except BaseException:
+            # the slot must go back even when a worker can't be started,
+            # otherwise every failure permanently shrinks the pool until all
+            # callers block forever
+            self._idle_workers.put(None)
+            raise
+        return worker
+
+    def walk(self, raw_crash_pathname, dump_pathname):
+        """have an idle worker walk one dump.
+
+        returns:
+            a tuple of the JSON answer as a string (None if there was no
+            answer) and a return code in the style of the stackwalker run as
+            an external command"""
+        worker = self._checkout()
+        try:
+            output = worker.walk(
+                raw_crash_pathname,
+                dump_pathname,
+                self.timeout
+            )
+            return output, 0
+        except StackwalkerTimeout:
+            self.logger.warning(
+                'stackwalker worker %s timed out on %s, killing it',
+                worker.process.pid,
+                dump_pathname
+            )
+            self._retire(worker, kill=True)
+            worker = None
+            return None, TIMEOUT_RETURN_CODE
+        except StackwalkerDied as x:
+            self.logger.warning(
+                'stackwalker worker %s died on %s: %s',
+                worker.process.pid,
+                dump_pathname,
+                x
+            )
+            self._retire(worker, kill=True)
+            worker = None
+            return None, x.return_code
+        finally:
+            # a None put back in the queue is replaced by a fresh worker the
+            # next time it is checked out
+            self._idle_workers.put(worker)
+
+    def close(self):
+        with self._lock:
+            workers = list(self._all_workers)
+            self._all_workers.clear()
+        for a_worker in workers:
+            a_worker.close()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import argparse
+import glob
+import json
+import os
+import os.path
+import timeit
+
+from socorro.lib.util import DotDict
+from socorro.processor.signature_utilities import CSignatureTool
+from socorro.scripts import WrappedTextHelpFormatter
+
+
+EPILOG = """
+Compares CSignatureToolBase._collapse with the character at a time
+implementation it replaced.
+
+The function names of every frame in the processed crashes found in the
+corpus directory are collapsed by both implementations and the results must
+be identical.  Then both are timed on template names of growing length to
+show how their running time scales.
+
+Example::
+
+    scripts/benchmark_collapse.py testcrash/processed
+
+"""
+
+# the arguments given to _collapse by normalize_signature
+COLLAPSE_CALLS = (
+    ('<', '<', '>', 'T>', ('name omitted', 'IPC::ParamTraits')),
+    ('(', '', ')', '', ('anonymous namespace', 'operator')),
+)
+
+
+def reference_collapse(
+    function_signature_str,
+    open_string,
+    replacement_open_string,
+    close_string,
+    replacement_close_string,
+    exception_substring_list=[],
+):
+    """the original implementation of _collapse.  It slices the signature at
+    every opening delimiter, which makes it quadratic in the length of the
+    signature."""
+    def is_exception(
+        exception_list,
+        remaining_original_line,
+        line_up_to_current_position
+    ):
+        for an_exception in exception_list:
+            if remaining_original_line.startswith(an_exception):
+                return True
+            if line_up_to_current_position.endswith(an_exception):
+                return True
+        return False
+
+    target_counter = [0]
+    collapsed_list = []
+    exception_mode = False
+
+    def append_if_not_in_collapse_mode(a_character):
+        if not target_counter[0]:
+            collapsed_list.append(a_character)
+
+    for index, a_character in enumerate(function_signature_str):
+        if a_character == open_string:
+            if is_exception(
+                exception_substring_list,
+                function_signature_str[index + 1:],
+                function_signature_str[:index]
+            ):
+                exception_mode = True
+                append_if_not_in_collapse_mode(a_character)
+                continue
+            append_if_not_in_collapse_mode(replacement_open_string)
+            target_counter[0] += 1
+        elif a_character == close_string:
+            if exception_mode:
+                append_if_not_in_collapse_mode(a_character)
+                exception_mode = False
+            else:
+                target_counter[0] -= 1
+                append_if_not_in_collapse_mode(replacement_close_string)
+        else:
+            append_if_not_in_collapse_mode(a_character)
+
+    return ''.join(collapsed_list)
+
+
+def load_functions(corpus_directory):
+    functions = set()
+    for pathname in glob.glob(os.path.join(corpus_directory, '*.json')):
+        with open(pathname) as fp:
+            processed_crash = json.load(fp)
+        json_dump = processed_crash.get('json_dump') or {}
+        for a_thread in json_dump.get('threads', []):
+            for a_frame in a_thread.get('frames', []):
+                if a_frame.get('function'):
+                    functions.add(a_frame['function'])
+    return sorted(functions)
+
+
+def make_long_function(length):
+    """a template heavy name in the style of the multi-kilobyte Rust and C++
+    names seen in the wild"""
+    unit = 'mozilla::Maybe<std::pair<nsTArray<int>, (anonymous namespace)::F>>'
+    repeats = length // len(unit) + 1
+    name = 'Outer<%s>::operator()(int, %s)' % (
+        ', '.join([unit] * repeats),
+        ', '.join(['char const*'] * repeats),
+    )
+    return name[:length]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=WrappedTextHelpFormatter,
+        prog=os.path.basename(__file__),
+        description='Benchmarks signature collapsing',
+        epilog=EPILOG.strip(),
+    )
+    parser.add_argument(
+        'corpus', help='directory of processed crash json files'
+    )
+    parser.add_argument(
+        '--lengths', default='1000,2000,4000,8000,16000',
+        help='comma separated lengths of the synthetic function names'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='number of times each function name is collapsed when timing'
+    )
+
+    args = parser.parse_args(argv)
+
+    config = DotDict()
+    config.collapse_arguments = True
+    tool = CSignatureTool(config)
+
+    functions = load_functions(args.corpus)
+    lengths = [int(x) for x in args.lengths.split(',')]
+    mismatches = 0
+    for a_function in functions + [make_long_function(x) for x in lengths]:
+        for collapse_args in COLLAPSE_CALLS:
+            expected = reference_collapse(a_function, *collapse_args)
+            actual = tool._collapse(a_function, *collapse_args)
+            if expected != actual:
+                mismatches += 1
+                print('MISMATCH %r: %r != %r' % (a_function, actual, expected))
+    print('%d function names compared, %d mismatches' % (
+        len(functions) + len(lengths), mismatches
+    ))
+
+    print('%10s %15s %15s' % ('length', 'original (ms)', 'single pass (ms)'))
+    for length in lengths:
+        a_function = make_long_function(length)
+        timings = []
+        for implementation in (reference_collapse, tool._collapse):
+            timings.append(min(timeit.repeat(
+                lambda: [
+                    implementation(a_function, *collapse_args)
+                    for collapse_args in COLLAPSE_CALLS
+                ],
+                number=1,
+                repeat=args.repeat,
+            )) * 1000)
+        print('%10d %15.3f %15.3f' % (length, timings[0], timings[1]))
+
+    return 1 if mismatches else 0
@@ -6,7 +6,11 @@ from mock import Mock
 
 import pytest
 
-from socorro.app.fetch_transform_save_app import FetchTransformSaveApp
+from socorro.app.fetch_transform_save_app import (
+    FetchTransformSaveApp,
+    FetchTransformSaveWithSeparateNewCrashSourceApp,
+)
+from socorro.lib.process_pool_task_manager import ProcessPoolTaskManager
 from socorro.lib.threaded_task_manager import ThreadedTaskManager
 from socorro.lib.task_manager import TaskManager
 from socorro.lib.util import DotDict, SilentFakeLogger
@@ -303,3 +307,113 @@ class TestFetchTransformSaveApp(TestCase):
 
         with pytest.raises(TypeError):
             fts_app.main()
+
+    def test_worker_process_setup(self):
+        def fake_storage_class(config, quit_check_callback):
+            return Mock()
+
+        logger = SilentFakeLogger()
+        config = DotDict({
+            'logger': logger,
+            'number_of_submissions': 'all',
+            'source': DotDict({'crashstorage_class': fake_storage_class}),
+            'destination': DotDict({'crashstorage_class': fake_storage_class}),
+            'producer_consumer': DotDict({
+                'producer_consumer_class': ProcessPoolTaskManager,
+                'logger': logger,
+                'number_of_processes': 2,
+                'maximum_queue_size': 2,
+            })
+        })
+
+        fts_app = FetchTransformSaveApp(config)
+        fts_app._setup_task_manager()
+        fts_app._setup_source_and_destination()
+        task_manager = fts_app.task_manager
+        assert task_manager.worker_setup_func == fts_app._setup_worker_process
+        assert task_manager.worker_close_func == fts_app.close
+
+        parent_source = fts_app.source
+        parent_destination = fts_app.destination
+        # what a worker process does after it has been forked
+        fts_app._setup_worker_process()
+        assert fts_app.source is not parent_source
+        assert fts_app.destination is not parent_destination
+        # the parent's connections are kept, but never closed
+        assert fts_app._inherited_from_parent['source'] is parent_source
+        fts_app.close()
+        assert not parent_source.close.called
+        assert fts_app.source.close.called
+
+    def test_worker_process_setup_with_new_crash_source(self):
+        def fake_storage_class(config, quit_check_callback):
+            return Mock()
+
+        def fake_new_crash_source_class(config, name, quit_check_callback):
+            return Mock()
+
+        logger = SilentFakeLogger()
+        config = DotDict({
+            'logger': logger,
+            'number_of_submissions': 'all',
+            'source': DotDict({'crashstorage_class': fake_storage_class}),
+            'destination': DotDict({'crashstorage_class': fake_storage_class}),
+            'new_crash_source': DotDict({
+                'new_crash_source_class': fake_new_crash_source_class
+            }),
+        })
+
+        fts_app = FetchTransformSaveWithSeparateNewCrashSourceApp(config)
+        fts_app._setup_source_and_destination()
+        parent_source = fts_app.source
+        parent_new_crash_source = fts_app.new_crash_source
+
+        # a worker process makes a source and a destination of its own, but
+        # has no use for a new crash source
+        fts_app._setup_worker_process()
+        assert fts_app.source is not parent_source
+        assert fts_app.new_crash_source is parent_new_crash_source
+        fts_app.close()
+        assert fts_app.source.close.called
+        assert not parent_new_crash_source.close.called
+
+    def test_new_crashes_are_prefetched(self):
+        logger = SilentFakeLogger()
+        config = DotDict({
+            'logger': logger,
+            'number_of_submissions': 'all',
+        })
+
+        fts_app = FetchTransformSaveWithSeparateNewCrashSourceApp(config)
+        fts_app.source = Mock()
+        fts_app.new_crash_source = Mock()
+        fts_app.new_crash_source.new_crashes.return_value = [
+            'abc',
+            (('def',), {'finished_func': Mock()}),
+            None,
+        ]
+        assert (
+            list(fts_app._create_iter()) ==
+            fts_app.new_crash_source.new_crashes.return_value
+        )
+        assert (
+            fts_app.source.prefetch.call_args_list ==
+            [(('abc',),), (('def',),)]
+        )
+
+    def test_no_prefetch_for_forked_workers(self):
+        logger = SilentFakeLogger()
+        config = DotDict({
+            'logger': logger,
+            'number_of_submissions': 'all',
+        })
+
+        fts_app = FetchTransformSaveWithSeparateNewCrashSourceApp(config)
+        fts_app.source = Mock()
+        fts_app.new_crash_source = Mock()
+        fts_app.new_crash_source.new_crashes.return_value = ['abc', 'def']
+        # a task manager that forks its workers
+        fts_app.task_manager = Mock()
+        fts_app.task_manager.worker_setup_func = None
+        assert list(fts_app._create_iter()) == ['abc', 'def']
+        assert not fts_app.source.prefetch.called
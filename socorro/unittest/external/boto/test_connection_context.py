@@ -4,15 +4,20 @@
 
 import datetime
 import json
+import os
+import shutil
+import tempfile
 
+import boto.exception
 import mock
-from nose.tools import eq_
+from nose.tools import eq_, ok_
 
 from socorro.lib.util import DotDict
 from socorro.external.boto.connection_context import (
     DatePrefixKeyBuilder,
     SimpleDatePrefixKeyBuilder,
     KeyBuilderBase,
+    KeyLocationIndex,
     KeyNotFound,
     S3ConnectionContext,
     RegionalS3ConnectionContext,
@@ -74,7 +79,10 @@ class ConnectionContextTestCase(socorro.unittest.testbase.TestCase):
             'bucket_name': 'silliness',
             'keybuilder_class': KeyBuilderBase,
             'prefix': 'dev',
-            'calling_format': mock.Mock()
+            'calling_format': mock.Mock(),
+            'number_of_fetch_threads': 4,
+            'key_location_index_size': 100,
+            'key_location_index_pathname': '',
         })
         config.update(extra)
         s3_conn = resource_class(config)
@@ -201,6 +209,124 @@ class ConnectionContextTestCase(socorro.unittest.testbase.TestCase):
 
         eq_(result, thing_as_str)
 
+    def test_fetch_other_errors_are_raised(self):
+        connection_source = self.setup_mocked_s3_storage()
+        mocked_get_contents_as_string = (
+            connection_source._connect_to_endpoint.return_value
+            .get_bucket.return_value.get_key.return_value
+            .get_contents_as_string
+        )
+        mocked_get_contents_as_string.side_effect = (
+            boto.exception.S3ResponseError(403, 'Forbidden')
+        )
+
+        with self.assertRaises(boto.exception.S3ResponseError):
+            connection_source.fetch('this_is_an_id', 'name_of_thing')
+
+    def test_submit_and_fetch_with_content_encoding(self):
+        connection_source = self.setup_mocked_s3_storage()
+        # repetitive, like the frames of a processed crash
+        a_long_thing = json.dumps([a_thing] * 20)
+
+        connection_source.submit(
+            'this_is_an_id',
+            'name_of_thing',
+            a_long_thing,
+            content_encoding='gzip'
+        )
+
+        bucket_mock = connection_source._mocked_connection.get_bucket \
+            .return_value
+        set_contents_from_string = (
+            bucket_mock.new_key.return_value.set_contents_from_string
+        )
+        eq_(set_contents_from_string.call_count, 1)
+        args, kwargs = set_contents_from_string.call_args
+        eq_(kwargs, {'headers': {'Content-Encoding': 'gzip'}})
+        stored = args[0]
+        # it is smaller, and it is gzip
+        ok_(len(stored) < len(a_long_thing) / 5)
+        eq_(stored[:2], '\x1f\x8b')
+
+        # fetching it gives back the thing as it was submitted
+        key_mock = bucket_mock.get_key.return_value
+        key_mock.get_contents_as_string.return_value = stored
+        key_mock.content_encoding = 'gzip'
+        eq_(
+            connection_source.fetch('this_is_an_id', 'name_of_thing'),
+            a_long_thing
+        )
+
+    def test_submit_with_unknown_content_encoding(self):
+        connection_source = self.setup_mocked_s3_storage()
+
+        with self.assertRaises(ValueError):
+            connection_source.submit(
+                'this_is_an_id',
+                'name_of_thing',
+                thing_as_str,
+                content_encoding='no such thing'
+            )
+
+    def _mock_objects(self, connection_source, objects):
+        """make the mocked bucket hold 'objects', a mapping of the names of
+        things to their contents"""
+        def get_key(key, validate=True):
+            key_mock = mock.Mock()
+            name_of_thing = key.split('/')[2]
+            if name_of_thing in objects:
+                key_mock.get_contents_as_string.return_value = (
+                    objects[name_of_thing]
+                )
+            else:
+                key_mock.get_contents_as_string.side_effect = (
+                    boto.exception.S3ResponseError(404, 'Not Found')
+                )
+            return key_mock
+
+        bucket_mock = (
+            connection_source._connect_to_endpoint.return_value
+            .get_bucket.return_value
+        )
+        bucket_mock.get_key.side_effect = get_key
+        return bucket_mock
+
+    def test_fetch_many(self):
+        connection_source = self.setup_mocked_s3_storage()
+        bucket_mock = self._mock_objects(
+            connection_source,
+            {'raw_crash': thing_as_str, 'dump': 'a dump'}
+        )
+
+        result = connection_source.fetch_many(
+            'this_is_an_id',
+            ['raw_crash', 'dump', 'flash_dump'],
+            optional=('flash_dump',)
+        )
+
+        eq_(result, {'raw_crash': thing_as_str, 'dump': 'a dump'})
+        # one connection and one bucket are shared by the fetches
+        eq_(connection_source._connect_to_endpoint.call_count, 1)
+        eq_(
+            connection_source._mocked_connection.get_bucket.call_count,
+            1
+        )
+        # and none of them made a HEAD request to check for the key first
+        eq_(
+            set(x[1]['validate'] for x in bucket_mock.get_key.call_args_list),
+            set([False])
+        )
+
+    def test_fetch_many_not_found(self):
+        connection_source = self.setup_mocked_s3_storage()
+        self._mock_objects(connection_source, {'raw_crash': thing_as_str})
+
+        with self.assertRaises(KeyNotFound):
+            connection_source.fetch_many(
+                'this_is_an_id',
+                ['raw_crash', 'dump'],
+            )
+
     def assert_regional_s3_connection_parameters(
         self,
         region,
@@ -332,7 +458,10 @@ class MultiplePathsBase(socorro.unittest.testbase.TestCase):
             'bucket_name': 'silliness',
             'keybuilder_class': keybuilder_class,
             'prefix': 'dev',
-            'calling_format': mock.Mock()
+            'calling_format': mock.Mock(),
+            'number_of_fetch_threads': 4,
+            'key_location_index_size': 100,
+            'key_location_index_pathname': '',
         })
         config.update(extra)
         s3_conn = resource_class(config)
@@ -550,7 +679,8 @@ class MultiplePathsTestCase(MultiplePathsBase):
             .get_key
             .assert_called_with(
                 'dev/v2/raw_crash/fff/20141114/fff13cf0-5671-4496-'
-                'ab89-47a922141114'
+                'ab89-47a922141114',
+                validate=False
             )
         )
 
@@ -569,34 +699,30 @@ class MultiplePathsTestCase(MultiplePathsBase):
             .return_value
             .get_key
         )
-        # First time get_key() is called, it returns None which causes fetch to
-        # call it again with the next key. We have to swap side-effect handling
-        # functions so that the second time get_key() is called, it returns an
-        # object which simulates the situation we're looking for.
+        # The object at the first key is not found, which causes fetch to try
+        # the next key, where the object is.
         capture_args = []
 
-        def get_key_first_call(*args, **kwargs):
+        def get_key(*args, **kwargs):
             capture_args.append((args, kwargs))
-
-            # First time
-            def get_key_second_call(*args, **kwargs):
-                capture_args.append((args, kwargs))
-                # Second time
-                get_key_return = mock.Mock()
-                get_key_return.return_value.get_contents_as_string = [
+            get_key_return = mock.Mock()
+            if len(capture_args) == 1:
+                get_key_return.get_contents_as_string.side_effect = (
+                    boto.exception.S3ResponseError(404, 'Not Found')
+                )
+            else:
+                get_key_return.get_contents_as_string.return_value = (
                     thing_as_str
-                ]
-                return get_key_return
-
-            mocked_get_key.side_effect = get_key_second_call
-            return None
+                )
+            return get_key_return
 
-        mocked_get_key.side_effect = get_key_first_call
+        mocked_get_key.side_effect = get_key
 
-        connection_source.fetch(
+        result = connection_source.fetch(
             'fff13cf0-5671-4496-ab89-47a922141114',
             'raw_crash'
         )
+        eq_(result, thing_as_str)
 
         eq_(
             connection_source._mocked_connection.get_bucket.call_count,
@@ -641,7 +767,9 @@ class MultiplePathsTestCase(MultiplePathsBase):
             .return_value
             .get_key
         )
-        mocked_get_key.return_value = None
+        mocked_get_key.return_value.get_contents_as_string.side_effect = (
+            boto.exception.S3ResponseError(404, 'Not Found')
+        )
 
         with self.assertRaises(KeyNotFound):
             connection_source.fetch(
@@ -663,3 +791,144 @@ class MultiplePathsTestCase(MultiplePathsBase):
             ),
             2
         )
+
+    def _mock_old_style_objects(self, connection_source):
+        """only the old-style keys hold objects.  Returns the list of the
+        keys asked for."""
+        keys_asked_for = []
+
+        def get_key(key, validate=True):
+            keys_asked_for.append(key)
+            key_object = mock.Mock()
+            if '/v1/' in key:
+                key_object.get_contents_as_string.return_value = thing_as_str
+            else:
+                key_object.get_contents_as_string.side_effect = (
+                    boto.exception.S3ResponseError(404, 'Not Found')
+                )
+            return key_object
+
+        (
+            connection_source
+            ._mocked_connection
+            .get_bucket
+            .return_value
+            .get_key
+            .side_effect
+        ) = get_key
+        return keys_asked_for
+
+    def test_fetch_tries_the_learned_key_first(self):
+        connection_source = self.setup_mocked_s3_storage(metrics=mock.Mock())
+        keys_asked_for = self._mock_old_style_objects(connection_source)
+
+        connection_source.fetch(
+            'fff13cf0-5671-4496-ab89-47a922141114',
+            'raw_crash'
+        )
+        eq_(len(keys_asked_for), 2)
+        # another crash from the same day is expected at the old-style key
+        connection_source.fetch(
+            'aaa13cf0-5671-4496-ab89-47a922141114',
+            'raw_crash'
+        )
+        eq_(
+            keys_asked_for[2:],
+            ['dev/v1/raw_crash/aaa13cf0-5671-4496-ab89-47a922141114']
+        )
+        # and so is the same crash fetched again
+        connection_source.fetch(
+            'fff13cf0-5671-4496-ab89-47a922141114',
+            'raw_crash'
+        )
+        eq_(len(keys_asked_for), 4)
+        eq_(
+            connection_source.config.metrics.histogram.call_args_list,
+            [
+                mock.call('boto.fetch.probes', 2),
+                mock.call('boto.fetch.probes', 1),
+                mock.call('boto.fetch.probes', 1),
+            ]
+        )
+
+        # a crash from another day is still tried at the new-style key first
+        connection_source.fetch(
+            'fff13cf0-5671-4496-ab89-47a922141115',
+            'raw_crash'
+        )
+        eq_(
+            keys_asked_for[4],
+            'dev/v2/raw_crash/fff/20141115/fff13cf0-5671-4496-'
+            'ab89-47a922141115'
+        )
+
+    def test_submit_teaches_the_index(self):
+        connection_source = self.setup_mocked_s3_storage()
+        keys_asked_for = self._mock_old_style_objects(connection_source)
+        connection_source.fetch(
+            'fff13cf0-5671-4496-ab89-47a922141114',
+            'raw_crash'
+        )
+        connection_source.submit(
+            'aaa13cf0-5671-4496-ab89-47a922141114',
+            'raw_crash',
+            thing_as_str
+        )
+        eq_(
+            connection_source.key_location_index.predict(
+                'raw_crash',
+                'aaa13cf0-5671-4496-ab89-47a922141114'
+            ),
+            0
+        )
+        # what was learned about the day was replaced by the submission
+        eq_(
+            connection_source.key_location_index.predict(
+                'raw_crash',
+                'bbb13cf0-5671-4496-ab89-47a922141114'
+            ),
+            0
+        )
+        eq_(len(keys_asked_for), 2)
+
+
+class KeyLocationIndexTestCase(socorro.unittest.testbase.TestCase):
+
+    def setUp(self):
+        super(KeyLocationIndexTestCase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(KeyLocationIndexTestCase, self).tearDown()
+        shutil.rmtree(self.tempdir)
+
+    crash_id = 'fff13cf0-5671-4496-ab89-47a922141114'
+    # another crash from the same day
+    other_crash_id = 'aaa13cf0-5671-4496-ab89-47a922141114'
+
+    def test_predict(self):
+        crash_id, other_crash_id = self.crash_id, self.other_crash_id
+        index = KeyLocationIndex(1)
+        eq_(index.predict('raw_crash', crash_id), None)
+        index.learn('raw_crash', crash_id, 1)
+        index.learn('raw_crash', other_crash_id, 0)
+        # the crash id that was forgotten is predicted by its date
+        eq_(index.predict('raw_crash', crash_id), 0)
+        eq_(index.predict('raw_crash', other_crash_id), 0)
+        eq_(index.predict('dump', other_crash_id), None)
+        # ids without a date are only remembered by id
+        index.learn('raw_crash', 'not a crash id', 1)
+        eq_(index.predict('raw_crash', 'not a crash id'), 1)
+
+    def test_persistence(self):
+        crash_id, other_crash_id = self.crash_id, self.other_crash_id
+        pathname = os.path.join(self.tempdir, 'index.json')
+        index = KeyLocationIndex(10, pathname)
+        index.learn('raw_crash', crash_id, 1)
+        index = KeyLocationIndex(10, pathname)
+        eq_(index.predict('raw_crash', other_crash_id), 1)
+
+        with open(pathname, 'w') as f:
+            f.write('garbage')
+        index = KeyLocationIndex(10, pathname)
+        eq_(index.predict('raw_crash', other_crash_id), None)
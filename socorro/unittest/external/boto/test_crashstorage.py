@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import json
+import os
 import shutil
 import tempfile
 
@@ -105,6 +106,10 @@ class BaseTestCase(TestCase):
             'prefix': 'dev',
             'calling_format': mock.Mock(),
             'json_object_hook': DotDict,
+            'number_of_fetch_threads': 4,
+            'key_location_index_size': 100,
+            'key_location_index_pathname': '',
+            'processed_crash_content_encoding': '',
         })
 
         if isinstance(storage_class, basestring):
@@ -124,6 +129,42 @@ class BaseTestCase(TestCase):
 
         return s3
 
+    def mock_s3_objects(self, boto_s3_store, objects):
+        """make the mocked bucket hold 'objects', a mapping of the names of
+        things to their contents"""
+        def get_key(key, validate=True):
+            key_mock = mock.Mock()
+            get_key.key_mocks[key] = key_mock
+            name_of_thing = key.split('/')[2]
+            if name_of_thing in objects:
+                key_mock.get_contents_as_string.return_value = (
+                    objects[name_of_thing]
+                )
+
+                def get_contents_to_filename(filename):
+                    with open(filename, 'wb') as f:
+                        f.write(objects[name_of_thing])
+
+                key_mock.get_contents_to_filename.side_effect = (
+                    get_contents_to_filename
+                )
+            else:
+                key_mock.get_contents_as_string.side_effect = (
+                    boto.exception.S3ResponseError(404, 'Not Found')
+                )
+                key_mock.get_contents_to_filename.side_effect = (
+                    boto.exception.S3ResponseError(404, 'Not Found')
+                )
+            return key_mock
+
+        get_key.key_mocks = {}
+        bucket_mock = (
+            boto_s3_store.connection_source._mocked_connection
+            .get_bucket.return_value
+        )
+        bucket_mock.get_key.side_effect = get_key
+        return bucket_mock
+
     def assert_s3_connection_parameters(self, boto_s3_store):
         kwargs = {
             "aws_access_key_id": boto_s3_store.config.access_key,
@@ -432,6 +473,38 @@ class TestCase(BaseTestCase):
             any_order=True,
         )
 
+    def test_save_processed_with_content_encoding(self):
+        boto_s3_store = self.setup_mocked_s3_storage()
+        boto_s3_store.config.processed_crash_content_encoding = 'gzip'
+        processed_crash = {
+            "uuid": "0bba929f-8721-460c-dead-a43c20071027",
+            "completeddatetime": "2012-04-08 10:56:50.902884",
+            "signature": 'now_this_is_a_signature'
+        }
+
+        # the tested call
+        boto_s3_store.save_processed(processed_crash)
+
+        bucket_mock = (
+            boto_s3_store.connection_source._mocked_connection
+            .get_bucket.return_value
+        )
+        set_contents_from_string = (
+            bucket_mock.new_key.return_value.set_contents_from_string
+        )
+        eq_(set_contents_from_string.call_count, 1)
+        args, kwargs = set_contents_from_string.call_args
+        eq_(kwargs, {'headers': {'Content-Encoding': 'gzip'}})
+
+        # and it is read back as JSON
+        key_mock = bucket_mock.get_key.return_value
+        key_mock.get_contents_as_string.return_value = args[0]
+        key_mock.content_encoding = 'gzip'
+        result = boto_s3_store.get_unredacted_processed(
+            '0bba929f-8721-460c-dead-a43c20071027'
+        )
+        eq_(result, processed_crash)
+
     def test_save_processed_support_reason(self):
         boto_s3_store = self.setup_mocked_s3_storage(
             storage_class='SupportReasonAPIStorage'
@@ -721,7 +794,8 @@ class TestCase(BaseTestCase):
         get_bucket.assert_called_with('crash_storage')
 
         get_bucket.return_value.get_key.assert_called_with(
-            'dev/v1/dump/936ce666-ff3b-4c7a-9674-367fe2120408'
+            'dev/v1/dump/936ce666-ff3b-4c7a-9674-367fe2120408',
+            validate=False
         )
         key_mock = get_bucket.return_value.get_key.return_value
         eq_(key_mock.get_contents_as_string.call_count, 1)
@@ -766,7 +840,8 @@ class TestCase(BaseTestCase):
         get_bucket.assert_called_with('crash_storage')
 
         get_bucket.return_value.get_key.assert_called_with(
-            'dev/v1/dump/936ce666-ff3b-4c7a-9674-367fe2120408'
+            'dev/v1/dump/936ce666-ff3b-4c7a-9674-367fe2120408',
+            validate=False
         )
         key_mock = get_bucket \
             .return_value.get_key.return_value
@@ -818,7 +893,8 @@ class TestCase(BaseTestCase):
         get_bucket.assert_called_with('crash_storage')
 
         get_bucket.return_value.get_key.assert_called_with(
-            'dev/v1/dump/936ce666-ff3b-4c7a-9674-367fe2120408'
+            'dev/v1/dump/936ce666-ff3b-4c7a-9674-367fe2120408',
+            validate=False
         )
         key_mock = get_bucket.return_value.get_key.return_value
         eq_(key_mock.get_contents_as_string.call_count, 1)
@@ -833,17 +909,12 @@ class TestCase(BaseTestCase):
     def test_get_raw_dumps(self):
         # setup some internal behaviors and fake outs
         boto_s3_store = self.setup_mocked_s3_storage()
-        mocked_get_contents_as_string = (
-            boto_s3_store.connection_source._connect_to_endpoint.return_value
-            .get_bucket.return_value.get_key.return_value
-            .get_contents_as_string
-        )
-        mocked_get_contents_as_string.side_effect = [
-            '["dump", "flash_dump", "city_dump"]',
-            'this is "dump", the first one',
-            'this is "flash_dump", the second one',
-            'this is "city_dump", the last one',
-        ]
+        bucket_mock = self.mock_s3_objects(boto_s3_store, {
+            'dump_names': '["dump", "flash_dump", "city_dump"]',
+            'dump': 'this is "dump", the first one',
+            'flash_dump': 'this is "flash_dump", the second one',
+            'city_dump': 'this is "city_dump", the last one',
+        })
 
         # the tested call
         result = boto_s3_store.get_raw_dumps(
@@ -873,8 +944,19 @@ class TestCase(BaseTestCase):
         )
         get_bucket.assert_called_with('crash_storage')
 
-        mocked_get_contents_as_string.assert_has_calls(
-            [mock.call(), mock.call(), mock.call(), mock.call(), ]
+        # every object was fetched once, without a HEAD request first
+        eq_(
+            sorted(x[0][0] for x in bucket_mock.get_key.call_args_list),
+            [
+                'dev/v1/city_dump/936ce666-ff3b-4c7a-9674-367fe2120408',
+                'dev/v1/dump/936ce666-ff3b-4c7a-9674-367fe2120408',
+                'dev/v1/dump_names/936ce666-ff3b-4c7a-9674-367fe2120408',
+                'dev/v1/flash_dump/936ce666-ff3b-4c7a-9674-367fe2120408',
+            ]
+        )
+        eq_(
+            set(x[1]['validate'] for x in bucket_mock.get_key.call_args_list),
+            set([False])
         )
 
         eq_(
@@ -889,25 +971,12 @@ class TestCase(BaseTestCase):
     def test_get_raw_dumps_as_files(self):
         # setup some internal behaviors and fake outs
         boto_s3_store = self.setup_mocked_s3_storage()
-        files = [
-            mock.MagicMock(),
-            mock.MagicMock(),
-            mock.MagicMock(),
-        ]
-        boto_s3_store.connection_source._open.return_value = mock.MagicMock(
-            side_effect=files
-        )
-        mocked_get_contents_as_string = (
-            boto_s3_store.connection_source._connect_to_endpoint.return_value
-            .get_bucket.return_value.get_key.return_value
-            .get_contents_as_string
-        )
-        mocked_get_contents_as_string.side_effect = [
-            '["dump", "flash_dump", "city_dump"]',
-            'this is "dump", the first one',
-            'this is "flash_dump", the second one',
-            'this is "city_dump", the last one',
-        ]
+        bucket_mock = self.mock_s3_objects(boto_s3_store, {
+            'dump_names': '["dump", "flash_dump", "city_dump"]',
+            'dump': 'this is "dump", the first one',
+            'flash_dump': 'this is "flash_dump", the second one',
+            'city_dump': 'this is "city_dump", the last one',
+        })
 
         # the tested call
         result = boto_s3_store.get_raw_dumps_as_files(
@@ -937,6 +1006,56 @@ class TestCase(BaseTestCase):
                 )
             }
         )
+        with open(result['flash_dump']) as f:
+            eq_(f.read(), 'this is "flash_dump", the second one')
+
+        # the dumps were streamed into their files, never held in memory
+        for a_call in bucket_mock.get_key.call_args_list:
+            key_mock = bucket_mock.get_key.side_effect.key_mocks[a_call[0][0]]
+            if '/dump_names/' in a_call[0][0]:
+                ok_(key_mock.get_contents_as_string.called)
+            else:
+                ok_(not key_mock.get_contents_as_string.called)
+                ok_(key_mock.get_contents_to_filename.called)
+
+        for a_pathname in result.values():
+            os.unlink(a_pathname)
+
+    def test_get_raw_dumps_as_files_without_default_dump(self):
+        boto_s3_store = self.setup_mocked_s3_storage()
+        self.mock_s3_objects(boto_s3_store, {
+            'dump_names': '["flash_dump"]',
+            'dump': 'this is "dump", which is not listed',
+            'flash_dump': 'this is "flash_dump"',
+        })
+
+        result = boto_s3_store.get_raw_dumps_as_files(
+            '936ce666-ff3b-4c7a-9674-367fe2120408'
+        )
+
+        flash_dump_pathname = join(
+            self.TEMPDIR,
+            '936ce666-ff3b-4c7a-9674-367fe2120408.flash_dump.TEMPORARY.dump'
+        )
+        eq_(result, {'flash_dump': flash_dump_pathname})
+        # the dump fetched ahead was not left behind
+        eq_(os.listdir(self.TEMPDIR), [os.path.basename(flash_dump_pathname)])
+        os.unlink(flash_dump_pathname)
+
+    def test_get_raw_dumps_as_files_missing_dump(self):
+        boto_s3_store = self.setup_mocked_s3_storage()
+        self.mock_s3_objects(boto_s3_store, {
+            'dump_names': '["dump", "flash_dump"]',
+            'dump': 'this is "dump"',
+        })
+
+        self.assertRaises(
+            CrashIDNotFound,
+            boto_s3_store.get_raw_dumps_as_files,
+            '936ce666-ff3b-4c7a-9674-367fe2120408'
+        )
+        # the dumps that were fetched were removed
+        eq_(os.listdir(self.TEMPDIR), [])
 
     def test_get_unredacted_processed(self):
         # setup some internal behaviors and fake outs
@@ -1075,16 +1194,40 @@ class TestCase(BaseTestCase):
             '0bba929f-dead-dead-dead-a43c20071027'
         )
 
-    def test_not_found_get_key_returns_none(self):
+    def test_not_found_get_raw_crash(self):
         boto_s3_store = self.setup_mocked_s3_storage()
-        boto_s3_store.connection_source._mocked_connection.get_bucket \
-            .return_value.get_key.return_value = None
+        self.mock_s3_objects(boto_s3_store, {})
         self.assertRaises(
             CrashIDNotFound,
             boto_s3_store.get_raw_crash,
             '0bba929f-dead-dead-dead-a43c20071027'
         )
 
+    def test_get_raw_dumps_without_default_dump(self):
+        boto_s3_store = self.setup_mocked_s3_storage()
+        self.mock_s3_objects(boto_s3_store, {
+            'dump_names': '["flash_dump"]',
+            'flash_dump': 'this is "flash_dump"',
+        })
+
+        result = boto_s3_store.get_raw_dumps(
+            '936ce666-ff3b-4c7a-9674-367fe2120408'
+        )
+
+        eq_(result, {'flash_dump': 'this is "flash_dump"'})
+
+    def test_get_raw_dumps_missing_dump(self):
+        boto_s3_store = self.setup_mocked_s3_storage()
+        self.mock_s3_objects(boto_s3_store, {
+            'dump_names': '["upload_file_minidump"]',
+        })
+
+        self.assertRaises(
+            CrashIDNotFound,
+            boto_s3_store.get_raw_dumps,
+            '936ce666-ff3b-4c7a-9674-367fe2120408'
+        )
+
 
 class TelemetryTestCase(ElasticsearchTestCase, BaseTestCase):
 
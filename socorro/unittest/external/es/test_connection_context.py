@@ -2,14 +2,22 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import threading
+
 import elasticsearch
+import mock
 
-from nose.tools import ok_
+from nose.tools import eq_, ok_, assert_raises
 
+from socorro.external.es import connection_context
 from socorro.external.es.connection_context import (
-    ConnectionContext
+    ConnectionContext,
+    ConnectionContextPooled,
+    PoolCheckoutTimeout,
 )
+from socorro.lib.util import DotDict
 from socorro.unittest.external.es.base import ElasticsearchTestCase
+from socorro.unittest.testbase import TestCase
 
 
 class IntegrationTestConnectionContext(ElasticsearchTestCase):
@@ -50,3 +58,173 @@ class IntegrationTestConnectionContext(ElasticsearchTestCase):
         # exhaustive and well outside of the scope of this test suite; in the
         # interest of safety however, we'll check one here.
         ok_(client._connection.index)
+
+
+@mock.patch('socorro.external.es.connection_context.elasticsearch.Elasticsearch')
+class TestConnectionContextPooled(TestCase):
+
+    def setUp(self):
+        super(TestConnectionContextPooled, self).setUp()
+        connection_context._pools.clear()
+
+    def tearDown(self):
+        super(TestConnectionContextPooled, self).tearDown()
+        connection_context._pools.clear()
+
+    def _get_config(self):
+        config = DotDict()
+        config.logger = mock.Mock()
+        config.metrics = mock.Mock()
+        config.elasticsearch_urls = ['somewhere:9200']
+        config.elasticsearch_timeout = 30
+        config.elasticsearch_pool_size = 2
+        config.elasticsearch_pool_checkout_timeout = 30
+        config.elasticsearch_pool_max_idle = 300
+        return config
+
+    def test_clients_are_reused(self, mocked_es):
+        mocked_es.side_effect = lambda **kwargs: mock.Mock()
+        config = self._get_config()
+        es_context = ConnectionContextPooled(config)
+
+        with es_context() as conn:
+            first_client = conn._connection
+        with es_context() as conn:
+            eq_(conn._connection, first_client)
+        # even by another context for the same hosts
+        with ConnectionContextPooled(config)() as conn:
+            eq_(conn._connection, first_client)
+        eq_(mocked_es.call_count, 1)
+
+        # a client for another timeout is a different client
+        with es_context(timeout=120) as conn:
+            ok_(conn._connection is not first_client)
+        eq_(mocked_es.call_count, 2)
+
+        config.metrics.increment.assert_any_call(
+            'elasticsearch.pool.new', 1
+        )
+        config.metrics.increment.assert_any_call(
+            'elasticsearch.pool.reuse', 1
+        )
+
+    def test_forked_process_gets_its_own_clients(self, mocked_es):
+        mocked_es.side_effect = lambda **kwargs: mock.Mock()
+        es_context = ConnectionContextPooled(self._get_config())
+
+        with es_context() as conn:
+            parent_client = conn._connection
+        # a forked process, even with a context made by its parent, doesn't
+        # use the clients it inherited
+        with mock.patch(
+            'socorro.external.es.connection_context.os.getpid',
+            return_value=-1
+        ):
+            with es_context() as conn:
+                ok_(conn._connection is not parent_client)
+            es_context.force_reconnect()
+        ok_(not parent_client.transport.close.called)
+        with es_context() as conn:
+            eq_(conn._connection, parent_client)
+        eq_(mocked_es.call_count, 2)
+
+    def test_clients_in_use_are_not_shared(self, mocked_es):
+        mocked_es.side_effect = lambda **kwargs: mock.Mock()
+        es_context = ConnectionContextPooled(self._get_config())
+
+        with es_context() as conn_1:
+            with es_context() as conn_2:
+                ok_(conn_1._connection is not conn_2._connection)
+        eq_(mocked_es.call_count, 2)
+
+    def test_waiting_for_a_client(self, mocked_es):
+        mocked_es.side_effect = lambda **kwargs: mock.Mock()
+        config = self._get_config()
+        config.elasticsearch_pool_size = 1
+        es_context = ConnectionContextPooled(config)
+        checked_out = threading.Event()
+        release = threading.Event()
+        clients = []
+
+        def hold_a_client():
+            with es_context() as conn:
+                clients.append(conn._connection)
+                checked_out.set()
+                release.wait()
+
+        a_thread = threading.Thread(target=hold_a_client)
+        a_thread.start()
+        checked_out.wait()
+        threading.Timer(0.1, release.set).start()
+        # the pool is full until the other thread is done
+        with es_context() as conn:
+            clients.append(conn._connection)
+        a_thread.join()
+
+        eq_(clients[0], clients[1])
+        eq_(mocked_es.call_count, 1)
+        eq_(config.metrics.timing.call_args[0][0], 'elasticsearch.pool.wait')
+
+    def test_checkout_timeout(self, mocked_es):
+        mocked_es.side_effect = lambda **kwargs: mock.Mock()
+        config = self._get_config()
+        config.elasticsearch_pool_size = 1
+        config.elasticsearch_pool_checkout_timeout = 0.1
+        es_context = ConnectionContextPooled(config)
+
+        def wait_for_a_client():
+            with es_context():
+                pass
+
+        with es_context() as conn:
+            assert_raises(PoolCheckoutTimeout, wait_for_a_client)
+            # it is retried like any other connection error
+            ok_(isinstance(
+                PoolCheckoutTimeout('N/A', 'timeout', None),
+                es_context.operational_exceptions
+            ))
+        config.metrics.increment.assert_any_call(
+            'elasticsearch.pool.timeout', 1
+        )
+        # the client that was in use is still there to be reused
+        with es_context() as conn_2:
+            eq_(conn_2._connection, conn._connection)
+        eq_(mocked_es.call_count, 1)
+
+    def test_failed_clients_are_evicted(self, mocked_es):
+        mocked_es.side_effect = lambda **kwargs: mock.Mock()
+        config = self._get_config()
+        es_context = ConnectionContextPooled(config)
+
+        def fail():
+            with es_context():
+                raise elasticsearch.exceptions.ConnectionError('boom')
+        assert_raises(elasticsearch.exceptions.ConnectionError, fail)
+
+        with es_context():
+            pass
+        eq_(mocked_es.call_count, 2)
+        config.metrics.increment.assert_any_call(
+            'elasticsearch.pool.evicted', 1
+        )
+
+        # other errors leave the client healthy
+        def other_error():
+            with es_context():
+                raise KeyError('not a connection problem')
+        assert_raises(KeyError, other_error)
+        with es_context():
+            pass
+        eq_(mocked_es.call_count, 2)
+
+    def test_idle_clients_expire(self, mocked_es):
+        mocked_es.side_effect = lambda **kwargs: mock.Mock()
+        config = self._get_config()
+        config.elasticsearch_pool_max_idle = 0
+        es_context = ConnectionContextPooled(config)
+
+        with es_context() as conn:
+            first_client = conn._connection
+        with es_context() as conn:
+            ok_(conn._connection is not first_client)
+        ok_(first_client.transport.close.called)
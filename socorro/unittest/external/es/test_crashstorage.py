@@ -2,8 +2,15 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import json
+import os
+import shutil
+import tempfile
+import time
+
 import elasticsearch
 import mock
+from elasticsearch.serializer import JSONSerializer
 
 from nose.tools import eq_, ok_, assert_raises
 
@@ -137,6 +144,19 @@ a_raw_crash = {
 }
 
 
+def assert_indexed_with(index_mock, body, **kwargs):
+    """Assert that the last document indexed was `body`. Crash documents
+    are sent to Elasticsearch as strings of JSON, so they are compared once
+    decoded, with the dates encoded the way the client encodes them.
+    """
+    call_kwargs = dict(index_mock.call_args[1])
+    eq_(
+        json.loads(call_kwargs.pop('body')),
+        json.loads(json.dumps(body, default=JSONSerializer().default))
+    )
+    eq_(call_kwargs, kwargs)
+
+
 class TestRawCrashRedactor(TestCaseWithConfig):
     """Test the custom RawCrashRedactor class does indeed redact crashes.
     """
@@ -325,6 +345,12 @@ class TestESCrashStorage(ElasticsearchTestCase):
     def tearDown(self):
         pass
 
+    def test_is_mutator(self):
+        # the crash is changed in place while it is being saved, so it
+        # must not be shared with other crash stores
+        es_storage = ESCrashStorage(config=self.config)
+        ok_(es_storage.is_mutator())
+
     def test_get_index_for_crash_static_name(self):
         """Test a static index name.
         """
@@ -427,7 +453,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
             'index': 'socorro_integration_test_reports'
         }
 
-        sub_mock.index.assert_called_with(
+        assert_indexed_with(
+            sub_mock.index,
             body=document,
             **additional
         )
@@ -486,7 +513,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
             'index': 'socorro_integration_test_reports'
         }
 
-        sub_mock.index.assert_called_with(
+        assert_indexed_with(
+            sub_mock.index,
             body=document,
             **additional
         )
@@ -560,7 +588,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
             'index': 'socorro_integration_test_reports'
         }
 
-        sub_mock.index.assert_called_with(
+        assert_indexed_with(
+            sub_mock.index,
             body=document,
             **additional
         )
@@ -618,7 +647,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
             'index': 'socorro_integration_test_reports'
         }
 
-        sub_mock.index.assert_called_with(
+        assert_indexed_with(
+            sub_mock.index,
             body=document,
             **additional
         )
@@ -745,7 +775,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
             'index': 'socorro_integration_test_reports'
         }
 
-        sub_mock.index.assert_called_with(
+        assert_indexed_with(
+            sub_mock.index,
             body=document,
             **additional
         )
@@ -774,7 +805,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
         }
 
         def mock_index(*args, **kwargs):
-            if 'bogus-field' in kwargs['body']['processed_crash']:
+            body = json.loads(kwargs['body'])
+            if 'bogus-field' in body['processed_crash']:
                 raise elasticsearch.exceptions.TransportError(
                     400,
                     'RemoteTransportException[[i-5exxx97][inet[/172.3.9.12:'
@@ -815,7 +847,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
             },
             'raw_crash': {},
         }
-        es_class_mock().index.assert_called_with(
+        assert_indexed_with(
+            es_class_mock().index,
             index=self.config.elasticsearch.elasticsearch_index,
             doc_type=self.config.elasticsearch.elasticsearch_doctype,
             body=expected_doc,
@@ -846,7 +879,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
         }
 
         def mock_index(*args, **kwargs):
-            if 'bogus-field' in kwargs['body']['processed_crash']:
+            body = json.loads(kwargs['body'])
+            if 'bogus-field' in body['processed_crash']:
                 raise elasticsearch.exceptions.TransportError(
                     400,
                     'RemoteTransportException[[i-f94dae31][inet[/172.31.1.54:'
@@ -880,7 +914,8 @@ class TestESCrashStorage(ElasticsearchTestCase):
             },
             'raw_crash': {},
         }
-        es_class_mock().index.assert_called_with(
+        assert_indexed_with(
+            es_class_mock().index,
             index=self.config.elasticsearch.elasticsearch_index,
             doc_type=self.config.elasticsearch.elasticsearch_doctype,
             body=expected_doc,
@@ -950,21 +985,270 @@ class TestESCrashStorage(ElasticsearchTestCase):
             crash_id
         )
 
-    def test_crash_size_capture(self):
+    @mock.patch('socorro.external.es.connection_context.elasticsearch')
+    def test_crash_size_capture(self, espy_mock):
         """Verify we capture raw/processed crash sizes in ES crashstorage"""
+        sub_mock = mock.MagicMock()
+        espy_mock.Elasticsearch.return_value = sub_mock
         es_storage = ESCrashStorage(config=self.config)
 
-        es_storage._submit_crash_to_elasticsearch = mock.Mock()
-
+        raw_crash = deepcopy(a_raw_crash)
+        processed_crash = deepcopy(a_processed_crash)
         es_storage.save_raw_and_processed(
-            raw_crash=a_raw_crash,
+            raw_crash=raw_crash,
             dumps=None,
-            processed_crash=a_processed_crash,
+            processed_crash=processed_crash,
             crash_id=a_processed_crash['uuid']
         )
 
-        mock_calls = [str(call) for call in self.config.metrics.mock_calls]
-        # NOTE(willkg): The sizes of these json documents depend on what's in them. If we changed
-        # a_processed_crash and a_raw_crash, then these numbers will change.
-        assert 'call.histogram(\'processor.es.raw_crash_size\', 27)' in mock_calls
-        assert 'call.histogram(\'processor.es.processed_crash_size\', 1785)' in mock_calls
+        # The sizes are those of the JSON that was sent to ES.
+        body = sub_mock.index.call_args[1]['body']
+        raw_crash_json = json.dumps(
+            raw_crash,
+            default=JSONSerializer().default
+        )
+        processed_crash_json = json.dumps(
+            processed_crash,
+            default=JSONSerializer().default
+        )
+        ok_(raw_crash_json in body)
+        ok_(processed_crash_json in body)
+
+        self.config.metrics.histogram.assert_any_call(
+            'processor.es.raw_crash_size',
+            len(raw_crash_json)
+        )
+        self.config.metrics.histogram.assert_any_call(
+            'processor.es.processed_crash_size',
+            len(processed_crash_json)
+        )
+
+
+BOGUS_FIELD_ERROR = (
+    'IllegalArgumentException[Document contains at least one immense term '
+    'in field="processed_crash.bogus-field.full" (whose UTF8 encoding is '
+    'longer than the max length 32766)]; nested: '
+    'MaxBytesLengthExceededException[bytes can be at most 32766 in length; '
+    'got 98489]; '
+)
+
+
+class TestESBulkCrashStorage(ElasticsearchTestCase):
+    """These tests are self-contained and use Mock where necessary.
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _get_storage(self, **extra_values):
+        values = {
+            'items_per_bulk_load': 100,
+            'bulk_load_max_latency': 60,
+            'index_creator_class': mock.Mock(),
+        }
+        values.update(extra_values)
+        config = self.get_tuned_config(ESBulkCrashStorage, values)
+        return ESBulkCrashStorage(config=config)
+
+    def _save(self, es_storage, crash_id, **extra_fields):
+        processed_crash = {
+            'date_processed': '2012-04-08 10:56:41.558922',
+            'foo': 'bar',
+        }
+        processed_crash.update(extra_fields)
+        es_storage.save_raw_and_processed({}, None, processed_crash, crash_id)
+
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_flush_on_count(self, es_class_mock, bulk_mock):
+        bulk_mock.return_value = (2, [])
+        es_storage = self._get_storage(items_per_bulk_load=2)
+
+        for x in range(5):
+            self._save(es_storage, 'crash%d' % x)
+        es_storage.close()
+
+        # the batches are sent by several threads, in no particular order
+        batches = sorted(
+            (call[0][1] for call in bulk_mock.call_args_list),
+            key=lambda x: x[0]['_id']
+        )
+        eq_(
+            [[x['_id'] for x in a_batch] for a_batch in batches],
+            [['crash0', 'crash1'], ['crash2', 'crash3'], ['crash4']]
+        )
+        first_action = batches[0][0]
+        # documents are sent already serialized
+        eq_(json.loads(first_action['_source'])['processed_crash']['foo'], 'bar')
+
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_flush_on_bytes(self, es_class_mock, bulk_mock):
+        bulk_mock.return_value = (1, [])
+        es_storage = self._get_storage(bytes_per_bulk_load=1)
+
+        for x in range(3):
+            self._save(es_storage, 'crash%d' % x)
+        es_storage.close()
+
+        eq_(bulk_mock.call_count, 3)
+
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_flush_on_latency(self, es_class_mock, bulk_mock):
+        bulk_mock.return_value = (1, [])
+        es_storage = self._get_storage(bulk_load_max_latency=0.05)
+
+        self._save(es_storage, 'crash0')
+        for x in range(100):
+            if bulk_mock.called:
+                break
+            time.sleep(0.05)
+        # the crash was sent without waiting for more crashes or a close
+        eq_(bulk_mock.call_count, 1)
+        es_storage.close()
+        eq_(bulk_mock.call_count, 1)
+
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_bogus_field_is_removed_and_retried(
+        self, es_class_mock, bulk_mock
+    ):
+        sent_documents = []
+
+        def mock_bulk(es, actions, **kwargs):
+            errors = []
+            for action in actions:
+                document = json.loads(action['_source'])
+                sent_documents.append(document)
+                if 'bogus-field' in document['processed_crash']:
+                    errors.append({'index': {
+                        '_id': action['_id'],
+                        'status': 400,
+                        'error': BOGUS_FIELD_ERROR,
+                    }})
+            return len(actions) - len(errors), errors
+
+        bulk_mock.side_effect = mock_bulk
+        es_storage = self._get_storage(dead_letter_path=self.tempdir)
+
+        self._save(es_storage, 'crash0', **{'bogus-field': 'x' * 100})
+        self._save(es_storage, 'crash1')
+        es_storage.close()
+
+        eq_(bulk_mock.call_count, 2)
+        # only the failed crash is sent again, without the field
+        eq_(len(sent_documents), 3)
+        retried = sent_documents[2]
+        eq_(retried['crash_id'], 'crash0')
+        ok_('bogus-field' not in retried['processed_crash'])
+        eq_(retried['removed_fields'], 'processed_crash.bogus-field')
+        eq_(os.listdir(self.tempdir), [])
+
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_failures_are_dead_lettered_on_unexpected_error(
+        self, es_class_mock, bulk_mock
+    ):
+        def mock_bulk(es, actions, **kwargs):
+            errors = [
+                {'index': {
+                    '_id': action['_id'],
+                    'status': 400,
+                    'error': BOGUS_FIELD_ERROR,
+                }}
+                for action in actions
+            ]
+            return 0, errors
+
+        bulk_mock.side_effect = mock_bulk
+        es_storage = self._get_storage(dead_letter_path=self.tempdir)
+
+        self._save(es_storage, 'crash0', **{'bogus-field': 'x'})
+        self._save(es_storage, 'crash1', **{'bogus-field': 'x'})
+        # the crashes were serialized when they were saved, it is their
+        # serialization after the field is removed that fails
+        es_storage.serialize_crash_document = mock.Mock(
+            side_effect=elasticsearch.exceptions.SerializationError
+        )
+        es_storage.close()
+
+        eq_(bulk_mock.call_count, 1)
+        # none of the failed crashes of the round are lost
+        eq_(sorted(os.listdir(self.tempdir)), ['crash0.json', 'crash1.json'])
+
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_failed_crash_is_dead_lettered(self, es_class_mock, bulk_mock):
+        def mock_bulk(es, actions, **kwargs):
+            errors = [
+                {'index': {
+                    '_id': action['_id'],
+                    'status': 400,
+                    'error': 'MapperParsingException[failed to parse]',
+                }}
+                for action in actions if action['_id'] == 'crash0'
+            ]
+            return len(actions) - len(errors), errors
+
+        bulk_mock.side_effect = mock_bulk
+        es_storage = self._get_storage(dead_letter_path=self.tempdir)
+
+        self._save(es_storage, 'crash0')
+        self._save(es_storage, 'crash1')
+        es_storage.close()
+
+        # a failure that can't be fixed is not retried
+        eq_(bulk_mock.call_count, 1)
+        eq_(os.listdir(self.tempdir), ['crash0.json'])
+        with open(os.path.join(self.tempdir, 'crash0.json')) as f:
+            dead_letter = json.load(f)
+        eq_(dead_letter['_id'], 'crash0')
+        eq_(dead_letter['error'], 'MapperParsingException[failed to parse]')
+        eq_(dead_letter['_source']['processed_crash']['foo'], 'bar')
+
+    @mock.patch('socorro.external.es.crashstorage.time.sleep')
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_transport_failure_is_retried(
+        self, es_class_mock, bulk_mock, sleep_mock
+    ):
+        def mock_bulk(es, actions, **kwargs):
+            if bulk_mock.call_count == 1:
+                raise elasticsearch.exceptions.ConnectionError(
+                    'N/A',
+                    'no ES',
+                    None
+                )
+            return len(actions), []
+
+        bulk_mock.side_effect = mock_bulk
+        es_storage = self._get_storage(dead_letter_path=self.tempdir)
+
+        self._save(es_storage, 'crash0')
+        es_storage.close()
+
+        eq_(bulk_mock.call_count, 2)
+        ok_(sleep_mock.called)
+        eq_(os.listdir(self.tempdir), [])
+
+    @mock.patch('socorro.external.es.crashstorage.time.sleep')
+    @mock.patch('elasticsearch.helpers.bulk')
+    @mock.patch('elasticsearch.Elasticsearch')
+    def test_retries_are_limited(self, es_class_mock, bulk_mock, sleep_mock):
+        bulk_mock.return_value = (0, [
+            {'index': {'_id': 'crash0', 'status': 429, 'error': 'busy'}}
+        ])
+        es_storage = self._get_storage(
+            bulk_load_retries=2,
+            dead_letter_path=self.tempdir,
+        )
+
+        self._save(es_storage, 'crash0')
+        es_storage.close()
+
+        eq_(bulk_mock.call_count, 3)
+        eq_(os.listdir(self.tempdir), ['crash0.json'])
@@ -1,6 +1,6 @@
 import os
 import shutil
-from mock import Mock
+from mock import Mock, patch
 from configman import ConfigurationManager
 from nose.tools import eq_, ok_, assert_raises
 
@@ -25,25 +25,26 @@ class TestFSDatedRadixTreeStorage(TestCase):
         super(TestFSDatedRadixTreeStorage, self).tearDown()
         shutil.rmtree(self.fsrts.config.fs_root)
 
-    def _common_config_setup(self):
+    def _common_config_setup(self, **values):
         mock_logging = Mock()
         required_config = FSDatedRadixTreeStorage.get_required_config()
         required_config.add_option('logger', default=mock_logging)
+        values.update({
+            'logger': mock_logging,
+            'minute_slice_interval': 1,
+            'fs_root': os.environ['resource.fs.fs_root'],
+        })
         config_manager = ConfigurationManager(
           [required_config],
           app_name='testapp',
           app_version='1.0',
           app_description='app description',
-          values_source_list=[{
-            'logger': mock_logging,
-            'minute_slice_interval': 1,
-            'fs_root': os.environ['resource.fs.fs_root'],
-          }],
+          values_source_list=[values],
           argv_source=[]
         )
         return config_manager
 
-    def _make_test_crash(self):
+    def _make_test_crash(self, crash_id=CRASH_ID_1):
         self.fsrts.save_raw_crash(
             {  # raw crash
                 "test": "TEST"
@@ -52,7 +53,7 @@ class TestFSDatedRadixTreeStorage(TestCase):
                 'foo': 'bar',
                 self.fsrts.config.dump_field: 'baz'
             }),
-            self.CRASH_ID_1
+            crash_id
         )
 
     def test_save_raw_crash(self):
@@ -253,3 +254,72 @@ class TestFSDatedRadixTreeStorage(TestCase):
         eq_(list(self.fsrts.new_crashes()), [])
         self.fsrts.remove(self.CRASH_ID_1)
         del self.fsrts._current_slot
+
+    def _get_slot_base(self, crash_id, slot):
+        return self.fsrts._get_dated_parent_directory(crash_id, slot)
+
+    def test_new_crashes_watching(self):
+        with self._common_config_setup(
+            watch_for_new_crashes=True,
+            new_crash_wait_time=0.1,
+        ).context() as config:
+            self.fsrts = FSDatedRadixTreeStorage(config)
+        try:
+            self.fsrts._current_slot = lambda: ['00', '00_00']
+            self._make_test_crash()
+            self.fsrts._current_slot = lambda: ['00', '00_01']
+            # the first call scans for the crashes that are already there
+            eq_(list(self.fsrts.new_crashes()), [self.CRASH_ID_1])
+            ok_(self.fsrts._notifier is not None)
+
+            # from then on, crashes are seen as they arrive, even in the
+            # slot that is in use
+            self._make_test_crash(self.CRASH_ID_2)
+            eq_(list(self.fsrts.new_crashes()), [self.CRASH_ID_2])
+            slot_base = self._get_slot_base(self.CRASH_ID_2, ['00', '00_01'])
+            ok_(os.path.isdir(slot_base))
+            ok_(not os.listdir(slot_base))
+            eq_(list(self.fsrts.new_crashes()), [])
+
+            # once the slot is no longer in use, it is removed
+            self.fsrts._current_slot = lambda: ['00', '00_02']
+            eq_(list(self.fsrts.new_crashes()), [])
+            ok_(not os.path.exists(slot_base))
+        finally:
+            self.fsrts.close()
+
+    def test_new_crashes_watching_current_slot(self):
+        with self._common_config_setup(
+            watch_for_new_crashes=True,
+            new_crash_wait_time=0.1,
+        ).context() as config:
+            self.fsrts = FSDatedRadixTreeStorage(config)
+        try:
+            self.fsrts._get_current_date = lambda: '20071025'
+            self.fsrts._current_slot = lambda: ['00', '00_00']
+            self._make_test_crash()
+            # the crash is in the slot in use when the watching starts, so
+            # the first scan skips it and no event will ever report it
+            eq_(list(self.fsrts.new_crashes()), [self.CRASH_ID_1])
+            eq_(list(self.fsrts.new_crashes()), [])
+
+            self.fsrts._current_slot = lambda: ['00', '00_01']
+            eq_(list(self.fsrts.new_crashes()), [])
+            slot_base = self._get_slot_base(self.CRASH_ID_1, ['00', '00_00'])
+            ok_(not os.path.exists(slot_base))
+        finally:
+            self.fsrts.close()
+
+    def test_new_crashes_watching_unavailable(self):
+        with self._common_config_setup(
+            watch_for_new_crashes=True,
+        ).context() as config:
+            self.fsrts = FSDatedRadixTreeStorage(config)
+        self.fsrts._current_slot = lambda: ['00', '00_00']
+        self._make_test_crash()
+        self.fsrts._current_slot = lambda: ['00', '00_01']
+        with patch('socorro.external.fs.crashstorage.pyinotify', None):
+            eq_(list(self.fsrts.new_crashes()), [self.CRASH_ID_1])
+            eq_(list(self.fsrts.new_crashes()), [])
+        ok_(self.fsrts._notifier is None)
+        eq_(self.fsrts.logger.warning.call_count, 1)
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from mock import Mock
+from nose.tools import eq_, ok_, assert_raises
+
+from configman.dotdict import DotDict
+
+from socorro.external.crashstorage_base import CrashIDNotFound, Redactor
+from socorro.external.fs.crashstorage import (
+    IndexedArchiveWritingCrashStore,
+    IndexedArchiveReadingCrashStore,
+)
+from socorro.unittest.testbase import TestCase
+
+
+class TestIndexedArchiveCrashStores(TestCase):
+
+    def setUp(self):
+        super(TestIndexedArchiveCrashStores, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.archive_name = os.path.join(self.temp_dir, 'crashes.archive')
+
+    def tearDown(self):
+        super(TestIndexedArchiveCrashStores, self).tearDown()
+        shutil.rmtree(self.temp_dir)
+
+    def _get_config(self, **options):
+        config = DotDict()
+        config.logger = Mock()
+        config.redactor_class = Redactor
+        config.forbidden_keys = 'url, email'
+        config.archive_name = self.archive_name
+        config.block_size = 100
+        config.compress_blocks = True
+        config.update(options)
+        return config
+
+    def _crash_id(self, x):
+        return '091204bd-87c0-42ba-8f58-5544921412%02d' % x
+
+    def _write_archive(self, number_of_crashes, **options):
+        writer = IndexedArchiveWritingCrashStore(self._get_config(**options))
+        for x in range(number_of_crashes):
+            writer.save_processed({
+                'crash_id': self._crash_id(x),
+                'payload': 'crash number %d' % x,
+                'url': 'http://example.com/%d' % x,
+                'some_date': datetime(1960, 5, 4, 15, x),
+            })
+        writer.close()
+
+    def _check_archive(self, number_of_crashes, **options):
+        reader = IndexedArchiveReadingCrashStore(self._get_config(**options))
+        try:
+            crash_ids = list(reader.new_crashes())
+            eq_(
+                crash_ids,
+                [self._crash_id(x) for x in range(number_of_crashes)]
+            )
+
+            # any crash can be fetched without reading the ones before it
+            for x in reversed(range(number_of_crashes)):
+                processed_crash = reader.get_unredacted_processed(
+                    self._crash_id(x)
+                )
+                eq_(processed_crash.payload, 'crash number %d' % x)
+                eq_(processed_crash.url, 'http://example.com/%d' % x)
+                eq_(
+                    processed_crash.some_date,
+                    '1960-05-04T15:%02d:00' % x
+                )
+
+            if number_of_crashes:
+                redacted_crash = reader.get_processed(self._crash_id(0))
+                ok_('url' not in redacted_crash)
+
+            assert_raises(
+                CrashIDNotFound,
+                reader.get_unredacted_processed,
+                'not-there'
+            )
+        finally:
+            reader.close()
+
+    def test_compressed_blocks(self):
+        self._write_archive(10)
+        self._check_archive(10)
+
+        # with blocks of 100 bytes, the crashes are spread over many blocks
+        reader = IndexedArchiveReadingCrashStore(self._get_config())
+        ok_(reader.compressed)
+        ok_(len(set(x[0] for x in reader.index.values())) > 1)
+        reader.close()
+
+    def test_uncompressed_blocks(self):
+        self._write_archive(10, compress_blocks=False, block_size=1000)
+        self._check_archive(10)
+
+    def test_one_big_block(self):
+        self._write_archive(10, block_size=1024 * 1024)
+        self._check_archive(10)
+        reader = IndexedArchiveReadingCrashStore(self._get_config())
+        eq_(len(set(x[0] for x in reader.index.values())), 1)
+        reader.close()
+
+    def test_empty_archive(self):
+        self._write_archive(0)
+        self._check_archive(0)
+
+    def test_incomplete_archive(self):
+        writer = IndexedArchiveWritingCrashStore(self._get_config())
+        writer.save_processed({'crash_id': self._crash_id(1)})
+        writer.archive_fp.flush()
+        assert_raises(
+            ValueError,
+            IndexedArchiveReadingCrashStore,
+            self._get_config()
+        )
+        writer.close()
+        # closing twice is harmless
+        writer.close()
+        reader = IndexedArchiveReadingCrashStore(self._get_config())
+        eq_(list(reader.new_crashes()), [self._crash_id(1)])
+        reader.close()
@@ -2,10 +2,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from nose.tools import eq_, ok_
+import threading
+
+import mock
+from nose.tools import eq_, ok_, assert_raises
 import psycopg2
 
-from socorro.external.postgresql.connection_context import ConnectionContext
+from socorro.external.postgresql import connection_context
+from socorro.external.postgresql.connection_context import (
+    ConnectionContext,
+    ConnectionContextPooled,
+    PoolCheckoutTimeout,
+)
+from socorro.lib.util import DotDict
 from socorro.unittest.testbase import TestCase
 from configman import Namespace
 
@@ -88,3 +97,250 @@ class TestConnectionContext(TestCase):
         eq_(_closes, 3)
         eq_(_commits, 0)
         eq_(_rollbacks, 0)
+
+
+def _mock_connection(dsn):
+    connection = mock.MagicMock()
+    connection.closed = 0
+    connection.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+
+    def close():
+        connection.closed = 1
+    connection.close.side_effect = close
+    return connection
+
+
+@mock.patch(
+    'socorro.external.postgresql.connection_context.psycopg2.connect'
+)
+class TestConnectionContextPooled(TestCase):
+
+    def setUp(self):
+        super(TestConnectionContextPooled, self).setUp()
+        connection_context._pools.clear()
+
+    def tearDown(self):
+        super(TestConnectionContextPooled, self).tearDown()
+        connection_context._pools.clear()
+
+    def _get_config(self):
+        config = DotDict()
+        config.logger = mock.Mock()
+        config.metrics = mock.Mock()
+        config.database_hostname = 'host'
+        config.database_name = 'name'
+        config.database_port = 5432
+        config.database_username = 'user'
+        config.database_password = 'password'
+        config.database_pool_min_size = 0
+        config.database_pool_max_size = 2
+        config.database_pool_checkout_timeout = 5
+        config.database_pool_max_idle = 300
+        config.database_pool_max_lifetime = 3600
+        config.database_pool_validation_interval = 30
+        return config
+
+    def test_connections_are_reused(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        config = self._get_config()
+        postgres = ConnectionContextPooled(config)
+
+        with postgres() as connection:
+            first_connection = connection._connection
+        ok_(not first_connection.close.called)
+        with postgres() as connection:
+            eq_(connection._connection, first_connection)
+        # even by another context for the same database
+        another_postgres = ConnectionContextPooled(config)
+        with another_postgres() as connection:
+            eq_(connection._connection, first_connection)
+        # and by the services that close their connections
+        connection = postgres.connection()
+        eq_(connection._connection, first_connection)
+        connection.close()
+        ok_(connection.closed)
+        eq_(mocked_connect.call_count, 1)
+        eq_(postgres.pool.number_of_connections, 1)
+
+        config.metrics.increment.assert_any_call('postgresql.pool.new', 1)
+        config.metrics.increment.assert_any_call('postgresql.pool.reuse', 1)
+
+    def test_forked_process_gets_its_own_connections(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        postgres = ConnectionContextPooled(self._get_config())
+
+        with postgres() as connection:
+            parent_connection = connection._connection
+        # a forked process, even with a context made by its parent, doesn't
+        # use the connections it inherited
+        with mock.patch(
+            'socorro.external.postgresql.connection_context.os.getpid',
+            return_value=-1
+        ):
+            with postgres() as connection:
+                ok_(connection._connection is not parent_connection)
+            postgres.close()
+        ok_(not parent_connection.close.called)
+        with postgres() as connection:
+            eq_(connection._connection, parent_connection)
+        eq_(mocked_connect.call_count, 2)
+
+    def test_connections_in_use_are_not_shared(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        postgres = ConnectionContextPooled(self._get_config())
+
+        with postgres() as connection_1:
+            with postgres() as connection_2:
+                ok_(connection_1._connection is not connection_2._connection)
+        eq_(mocked_connect.call_count, 2)
+
+    def test_waiting_for_a_connection(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        config = self._get_config()
+        config.database_pool_max_size = 1
+        postgres = ConnectionContextPooled(config)
+        checked_out = threading.Event()
+        release = threading.Event()
+        connections = []
+
+        def hold_a_connection():
+            with postgres() as connection:
+                connections.append(connection._connection)
+                checked_out.set()
+                release.wait()
+
+        a_thread = threading.Thread(target=hold_a_connection)
+        a_thread.start()
+        checked_out.wait()
+        threading.Timer(0.1, release.set).start()
+        # the pool is full until the other thread is done
+        with postgres() as connection:
+            connections.append(connection._connection)
+        a_thread.join()
+
+        eq_(connections[0], connections[1])
+        eq_(mocked_connect.call_count, 1)
+        eq_(config.metrics.timing.call_args[0][0], 'postgresql.pool.wait')
+
+    def test_checkout_timeout(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        config = self._get_config()
+        config.database_pool_max_size = 1
+        config.database_pool_checkout_timeout = 0
+        postgres = ConnectionContextPooled(config)
+        connection = postgres.connection()
+        assert_raises(PoolCheckoutTimeout, postgres.connection)
+        # it is retried like any other operational error
+        ok_(postgres.is_operational_exception(PoolCheckoutTimeout('x')))
+        connection.close()
+        postgres.connection()
+
+    def test_returned_connections_are_rolled_back(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        postgres = ConnectionContextPooled(self._get_config())
+        with postgres() as connection:
+            raw_connection = connection._connection
+            raw_connection.get_transaction_status.return_value = (
+                psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+            )
+        eq_(raw_connection.rollback.call_count, 1)
+        eq_(len(postgres.pool.idle), 1)
+
+    def test_failed_connections_are_evicted(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        config = self._get_config()
+        postgres = ConnectionContextPooled(config)
+
+        def fail():
+            with postgres():
+                raise psycopg2.OperationalError('server closed the connection')
+        assert_raises(psycopg2.OperationalError, fail)
+        eq_(postgres.pool.number_of_connections, 0)
+
+        with postgres():
+            pass
+        eq_(mocked_connect.call_count, 2)
+        config.metrics.increment.assert_any_call(
+            'postgresql.pool.evicted', 1
+        )
+
+        # other errors leave the connection healthy
+        def other_error():
+            with postgres():
+                raise KeyError('not a connection problem')
+        assert_raises(KeyError, other_error)
+        with postgres():
+            pass
+        eq_(mocked_connect.call_count, 2)
+
+        # a connection broken under our feet is not reused
+        with postgres() as connection:
+            connection._connection.closed = 2
+        with postgres():
+            pass
+        eq_(mocked_connect.call_count, 3)
+
+    def test_idle_connections_are_validated(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        config = self._get_config()
+        config.database_pool_validation_interval = 0
+        postgres = ConnectionContextPooled(config)
+
+        with postgres() as connection:
+            first_connection = connection._connection
+        with postgres() as connection:
+            eq_(connection._connection, first_connection)
+        cursor = first_connection.cursor.return_value.__enter__.return_value
+        cursor.execute.assert_called_with('SELECT 1')
+
+        cursor.execute.side_effect = psycopg2.OperationalError('gone')
+        with postgres() as connection:
+            ok_(connection._connection is not first_connection)
+        ok_(first_connection.close.called)
+        config.metrics.increment.assert_any_call(
+            'postgresql.pool.invalid', 1
+        )
+
+    def test_connections_expire(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        config = self._get_config()
+        config.database_pool_max_idle = 0
+        postgres = ConnectionContextPooled(config)
+
+        with postgres() as connection:
+            first_connection = connection._connection
+        ok_(first_connection.close.called)
+        eq_(postgres.pool.idle, [])
+
+        # but the minimum number of connections is kept
+        config.database_pool_min_size = 1
+        with postgres() as connection:
+            second_connection = connection._connection
+        with postgres() as connection:
+            eq_(connection._connection, second_connection)
+
+        # however long they have lived
+        config.database_pool_max_lifetime = 0
+        with postgres() as connection:
+            pass
+        ok_(second_connection.close.called)
+
+    def test_force_reconnect_and_close(self, mocked_connect):
+        mocked_connect.side_effect = _mock_connection
+        postgres = ConnectionContextPooled(self._get_config())
+        raw_connections = []
+        with postgres() as connection_1:
+            with postgres() as connection_2:
+                raw_connections.append(connection_1._connection)
+                raw_connections.append(connection_2._connection)
+        # the idle connections of the pool are shared with other threads,
+        # they are kept
+        postgres.force_reconnect()
+        ok_(not any(x.close.called for x in raw_connections))
+        eq_(postgres.pool.number_of_connections, 2)
+
+        postgres.close()
+        ok_(all(x.close.called for x in raw_connections))
+        eq_(postgres.pool.number_of_connections, 0)
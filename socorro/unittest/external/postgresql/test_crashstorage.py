@@ -2,6 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import json
+import threading
 import time
 
 import mock
@@ -12,6 +14,7 @@ from configman import ConfigurationManager
 from configman.dotdict import DotDict
 
 from socorro.database.transaction_executor import (
+    TransactionExecutor,
     TransactionExecutorWithLimitedBackoff,
     TransactionExecutorWithInfiniteBackoff
 )
@@ -218,6 +221,7 @@ class TestPostgresBasicCrashStorage(TestCase):
         config.backoff_delays = [1]
         config.wait_log_interval = 10
         config.logger = mock.Mock()
+        config.processed_crashes_per_batch = 0
 
         mocked_database_connection_source = config.database_class.return_value
         mocked_connection = (
@@ -250,6 +254,7 @@ class TestPostgresBasicCrashStorage(TestCase):
         config.backoff_delays = [1]
         config.wait_log_interval = 10
         config.logger = mock.Mock()
+        config.processed_crashes_per_batch = 0
 
         mocked_database_connection_source = config.database_class.return_value
         mocked_connection = (
@@ -289,6 +294,7 @@ class TestPostgresBasicCrashStorage(TestCase):
         config.backoff_delays = [1]
         config.wait_log_interval = 10
         config.logger = mock.Mock()
+        config.processed_crashes_per_batch = 0
 
         mocked_database_connection_source = config.database_class.return_value
         mocked_connection = (
@@ -484,6 +490,7 @@ class TestPostgresCrashStorage(TestCase):
         config.backoff_delays = [1]
         config.wait_log_interval = 10
         config.logger = mock.Mock()
+        config.processed_crashes_per_batch = 0
 
         mocked_database_connection_source = config.database_class.return_value
         mocked_connection = (
@@ -517,6 +524,7 @@ class TestPostgresCrashStorage(TestCase):
         config.backoff_delays = [1]
         config.wait_log_interval = 10
         config.logger = mock.Mock()
+        config.processed_crashes_per_batch = 0
 
         mocked_database_connection_source = config.database_class.return_value
         mocked_connection = (
@@ -557,6 +565,7 @@ class TestPostgresCrashStorage(TestCase):
         config.backoff_delays = [1]
         config.wait_log_interval = 10
         config.logger = mock.Mock()
+        config.processed_crashes_per_batch = 0
 
         mocked_database_connection_source = config.database_class.return_value
         mocked_connection = (
@@ -662,3 +671,193 @@ class TestPostgresCrashStorage(TestCase):
                     'select raw_crash from raw_crashes_20120402 where uuid = %s',
                     ('936ce666-ff3b-4c7a-9674-367fe2120408',)
                 )
+
+
+class TestPostgresCrashStorageBatching(TestCase):
+    """
+    Tests of the batched saving of processed crashes where the actual
+    PostgreSQL part is mocked.
+    """
+
+    def setUp(self):
+        super(TestPostgresCrashStorageBatching, self).setUp()
+        self.crashstorages = []
+        self.executed = []
+
+    def tearDown(self):
+        super(TestPostgresCrashStorageBatching, self).tearDown()
+        for a_crashstorage in self.crashstorages:
+            a_crashstorage.close()
+
+    def _get_crashstorage(self, **values):
+        config = DotDict()
+        config.database_class = mock.MagicMock()
+        config.transaction_executor_class = TransactionExecutor
+        config.redactor_class = mock.Mock()
+        config.logger = mock.Mock()
+        config.processed_crashes_per_batch = 2
+        config.batch_max_latency = 60
+        config.update(values)
+
+        mocked_connection = (
+            config.database_class.return_value.return_value
+            .__enter__.return_value
+        )
+        mocked_cursor = (
+            mocked_connection.cursor.return_value.__enter__.return_value
+        )
+
+        def execute(sql, parameters=None):
+            self.executed.append((sql, parameters))
+
+        def fetchall():
+            sql, parameters = self.executed[-1]
+            if 'json_populate_recordset' in sql:
+                return [
+                    (x['uuid'], 1000 + i)
+                    for i, x in enumerate(json.loads(parameters[0]))
+                ]
+            return [(23,)]
+
+        mocked_cursor.execute.side_effect = execute
+        mocked_cursor.fetchall.side_effect = fetchall
+        mocked_cursor.mogrify.side_effect = (
+            lambda sql, values: 'UPSERT %s' % values['uuid']
+        )
+
+        crashstorage = PostgreSQLCrashStorage(config)
+        self.crashstorages.append(crashstorage)
+        return crashstorage
+
+    def _save_in_thread(self, crashstorage, processed_crash):
+        """save a crash from another thread, returning once it is waiting
+        in a batch.  The thread and a list that gets the exception raised
+        by the save, if any, are returned."""
+        errors = []
+
+        def save():
+            try:
+                crashstorage.save_processed(processed_crash)
+            except Exception as x:
+                errors.append(x)
+        number_pending = len(crashstorage._pending)
+        thread = threading.Thread(target=save)
+        thread.start()
+        while len(crashstorage._pending) == number_pending:
+            time.sleep(0.01)
+        return thread, errors
+
+    def test_a_full_batch_is_saved_together(self):
+        crashstorage = self._get_crashstorage()
+        a_crash = dict(a_processed_crash)
+        # a crash from the following week, without plugins
+        another_crash = dict(
+            a_processed_crash,
+            uuid='936ce666-ff3b-4c7a-9674-367fe2120416',
+            process_type=None
+        )
+
+        thread, errors = self._save_in_thread(crashstorage, a_crash)
+        eq_(self.executed, [])
+        # the first caller is still waiting for its batch to be saved
+        ok_(thread.is_alive())
+        crashstorage.save_processed(another_crash)
+        thread.join()
+        eq_(errors, [])
+
+        reports_sql = [
+            (sql, parameters) for sql, parameters in self.executed
+            if 'json_populate_recordset' in sql
+        ]
+        # one UPSERT for each week's partition of the reports table
+        eq_(len(reports_sql), 2)
+        ok_('NULL::reports_20120402' in reports_sql[0][0])
+        ok_('NULL::reports_20120416' in reports_sql[1][0])
+        rows = json.loads(reports_sql[0][1][0])
+        eq_([x['uuid'] for x in rows], [a_crash['uuid']])
+        eq_(rows[0]['signature'], a_crash['signature'])
+
+        # the plugins of the first crash were saved with its report id
+        plugin_inserts = [
+            parameters for sql, parameters in self.executed
+            if sql.startswith('insert into plugins_reports_20120402')
+        ]
+        eq_(plugin_inserts[0][0], 1000)
+
+        # and the processed crashes were sent in one statement each week
+        ok_(('UPSERT %s' % a_crash['uuid'], None) in self.executed)
+        ok_(('UPSERT %s' % another_crash['uuid'], None) in self.executed)
+
+    def test_a_crash_saved_twice_is_saved_once(self):
+        crashstorage = self._get_crashstorage()
+        thread, errors = self._save_in_thread(
+            crashstorage,
+            dict(a_processed_crash, signature='a')
+        )
+        crashstorage.save_processed(dict(a_processed_crash, signature='b'))
+        thread.join()
+        reports_sql = [
+            parameters for sql, parameters in self.executed
+            if 'json_populate_recordset' in sql
+        ]
+        rows = json.loads(reports_sql[0][0])
+        eq_([x['signature'] for x in rows], ['b'])
+
+    def test_close_saves_a_partial_batch(self):
+        crashstorage = self._get_crashstorage()
+        thread, errors = self._save_in_thread(
+            crashstorage,
+            dict(a_processed_crash)
+        )
+        eq_(self.executed, [])
+        crashstorage.close()
+        thread.join()
+        eq_(errors, [])
+        ok_(
+            ('UPSERT %s' % a_processed_crash['uuid'], None) in self.executed
+        )
+
+    def test_a_partial_batch_is_saved_after_the_latency(self):
+        crashstorage = self._get_crashstorage(batch_max_latency=0.01)
+        # by the time the save returns, the crash is in the database
+        crashstorage.save_processed(dict(a_processed_crash))
+        ok_(
+            any('json_populate_recordset' in sql for sql, _ in self.executed)
+        )
+
+    def test_a_broken_crash_fails_its_own_save(self):
+        crashstorage = self._get_crashstorage()
+        assert_raises(
+            KeyError,
+            crashstorage.save_processed,
+            {'uuid': a_processed_crash['uuid']}
+        )
+        eq_(crashstorage._pending, [])
+
+    def test_a_failed_batch_is_saved_one_crash_at_a_time(self):
+        crashstorage = self._get_crashstorage()
+        with mock.patch.object(
+            crashstorage,
+            '_save_batch_transaction',
+            side_effect=Exception('bad batch')
+        ):
+            thread, errors = self._save_in_thread(
+                crashstorage,
+                dict(a_processed_crash, uuid='bad')
+            )
+            crashstorage.save_processed(dict(a_processed_crash))
+            thread.join()
+        # the caller of the bad crash got its error, the other one didn't
+        eq_(len(errors), 1)
+        # the good crash was saved with the single row UPSERT
+        ok_(any(
+            sql.strip().startswith('WITH') and
+            'UPDATE reports_20120402' in sql
+            for sql, parameters in self.executed
+        ))
+        # the bad one was logged
+        crashstorage.config.logger.error.assert_called_with(
+            'failed to save processed crash %s',
+            'bad',
+            exc_info=True
+        )
@@ -16,6 +16,37 @@ from socorro.external.crashstorage_base import Redactor
 from socorro.unittest.testbase import TestCase
 
 
+class FakeConsumerChannel(object):
+    """a channel that pushes the deliveries it has been given to the
+    consumers of their queues as the connection processes data events"""
+
+    def __init__(self, deliveries):
+        # a list of (queue name, crash_id)
+        self.deliveries = list(deliveries)
+        self.consumers = {}
+        self.delivery_tag = 0
+        self.basic_qos = Mock()
+        self.basic_ack = Mock()
+        self.basic_reject = Mock()
+        self.basic_cancel = Mock()
+        # a broken channel fails like a lost connection would
+        self.broken = False
+
+    def basic_consume(self, callback, queue):
+        self.consumers[queue] = callback
+        return 'consumer-%s' % queue
+
+    def process_data_events(self, time_limit=0):
+        if self.broken:
+            raise IOError('connection reset by peer')
+        deliveries, self.deliveries = self.deliveries, []
+        for queue, crash_id in deliveries:
+            self.delivery_tag += 1
+            method_frame = DotDict()
+            method_frame.delivery_tag = self.delivery_tag
+            self.consumers[queue](self, method_frame, None, crash_id)
+
+
 class TestCrashStorage(TestCase):
 
     def _setup_config(self):
@@ -29,6 +60,11 @@ class TestCrashStorage(TestCase):
         config.redactor_class = Redactor
         config.forbidden_keys = Redactor.required_config.forbidden_keys.default
         config.throttle = 100
+        config.prefetch_count = 0
+        config.priority_queue_weight = 4
+        config.standard_queue_weight = 2
+        config.reprocessing_queue_weight = 1
+        config.consumer_idle_timeout = 0
         return config
 
     def test_constructor(self):
@@ -464,3 +500,161 @@ class TestCrashStorage(TestCase):
         expected = ['normal_crash_id', 'reprocessing_crash_id']
         for result in crash_store.new_crashes():
             eq_(expected.pop(), result)
+
+    def _setup_consumer(self, deliveries, **options):
+        config = self._setup_config()
+        config.transaction_executor_class = TransactionExecutor
+        config.prefetch_count = 10
+        config.update(options)
+        crash_store = RabbitMQCrashStorage(config)
+        crash_store.rabbitmq.config.standard_queue_name = 'socorro.normal'
+        crash_store.rabbitmq.config.reprocessing_queue_name = \
+            'socorro.reprocessing'
+        crash_store.rabbitmq.config.priority_queue_name = 'socorro.priority'
+        channel = FakeConsumerChannel(deliveries)
+        connection = crash_store.rabbitmq.return_value.__enter__.return_value
+        connection.channel = channel
+        connection.connection.process_data_events = \
+            channel.process_data_events
+        # no crash is a duplicate
+        crash_store._suppress_duplicate_jobs = Mock(return_value=False)
+        return crash_store, channel
+
+    def test_new_crashes_consumer_weighted(self):
+        deliveries = (
+            [('socorro.normal', 'normal%d' % x) for x in range(3)] +
+            [('socorro.reprocessing', 'reprocessing%d' % x)
+             for x in range(2)] +
+            [('socorro.priority', 'priority%d' % x) for x in range(4)]
+        )
+        crash_store, channel = self._setup_consumer(
+            deliveries,
+            priority_queue_weight=2,
+            standard_queue_weight=1,
+            reprocessing_queue_weight=1,
+        )
+
+        result = list(crash_store.new_crashes())
+
+        eq_(
+            result,
+            [
+                'priority0', 'normal0', 'reprocessing0',
+                'priority1', 'priority2', 'normal1', 'reprocessing1',
+                'priority3', 'normal2',
+            ]
+        )
+        channel.basic_qos.assert_called_once_with(prefetch_count=10)
+        eq_(
+            sorted(channel.consumers.keys()),
+            ['socorro.normal', 'socorro.priority', 'socorro.reprocessing']
+        )
+        eq_(channel.basic_cancel.call_count, 3)
+        ok_(not channel.basic_reject.called)
+
+    def test_new_crashes_consumer_acks_in_batches(self):
+        deliveries = [('socorro.normal', 'crash%d' % x) for x in range(4)]
+        crash_store, channel = self._setup_consumer(deliveries)
+
+        result = list(crash_store.new_crashes())
+        eq_(result, ['crash0', 'crash1', 'crash2', 'crash3'])
+        eq_(crash_store._unacked_delivery_tags, set([1, 2, 3, 4]))
+
+        # the first two can go with one ack, the fourth can't go with them
+        # because the third is still being processed
+        for crash_id in ('crash0', 'crash1', 'crash3'):
+            crash_store.ack_crash(crash_id)
+        crash_store._consume_acknowledgement_queue()
+        eq_(
+            channel.basic_ack.call_args_list,
+            [
+                ((), {'delivery_tag': 2, 'multiple': True}),
+                ((), {'delivery_tag': 4}),
+            ]
+        )
+        eq_(crash_store._unacked_delivery_tags, set([3]))
+        eq_(crash_store.acknowledgement_token_cache.keys(), ['crash2'])
+
+        channel.basic_ack.reset_mock()
+        crash_store.ack_crash('crash2')
+        crash_store._consume_acknowledgement_queue()
+        channel.basic_ack.assert_called_once_with(
+            delivery_tag=3,
+            multiple=True
+        )
+        eq_(crash_store._unacked_delivery_tags, set())
+        eq_(crash_store.acknowledgement_token_cache, {})
+
+    def test_new_crashes_consumer_gives_back_untaken_crashes(self):
+        deliveries = [('socorro.priority', 'crash%d' % x) for x in range(3)]
+        crash_store, channel = self._setup_consumer(deliveries)
+
+        crashes = crash_store.new_crashes()
+        eq_(next(crashes), 'crash0')
+        crashes.close()
+
+        eq_(channel.basic_cancel.call_count, 3)
+        eq_(
+            channel.basic_reject.call_args_list,
+            [
+                ((), {'delivery_tag': 2, 'requeue': True}),
+                ((), {'delivery_tag': 3, 'requeue': True}),
+            ]
+        )
+        eq_(crash_store._unacked_delivery_tags, set([1]))
+
+        # the rejected crashes can't be part of a multiple ack
+        crash_store.ack_crash('crash0')
+        crash_store._consume_acknowledgement_queue()
+        channel.basic_ack.assert_called_once_with(
+            delivery_tag=1,
+            multiple=True
+        )
+
+    def test_new_crashes_consumer_survives_reconnect(self):
+        deliveries = [('socorro.normal', 'crash%d' % x) for x in range(2)]
+        crash_store, channel = self._setup_consumer(deliveries)
+        crash_store.transaction = TransactionExecutorWithInfiniteBackoff(
+            crash_store.config,
+            crash_store.rabbitmq
+        )
+        crash_store.config.wait_log_interval = 0
+        crash_store.rabbitmq.operational_exceptions = (IOError,)
+        crash_store.rabbitmq.conditional_exceptions = ()
+
+        new_channel = FakeConsumerChannel([('socorro.priority', 'crash2')])
+        new_connection = MagicMock()
+        new_connection.channel = new_channel
+        new_connection.connection.process_data_events = \
+            new_channel.process_data_events
+
+        def force_reconnect():
+            crash_store.rabbitmq.return_value.__enter__.return_value = \
+                new_connection
+        crash_store.rabbitmq.force_reconnect.side_effect = force_reconnect
+
+        crashes = crash_store.new_crashes()
+        eq_(next(crashes), 'crash0')
+        eq_(crash_store._unacked_delivery_tags, set([1, 2]))
+        channel.broken = True
+        # the crash that was pushed on the lost channel is given up and the
+        # consumer starts over on the new one
+        eq_(next(crashes), 'crash2')
+        eq_(new_channel.consumers.keys(), channel.consumers.keys())
+        eq_(crash_store._unacked_delivery_tags, set([1]))
+        eq_(crash_store.acknowledgement_token_cache.keys(), ['crash2'])
+
+        # the crash from the old channel can't be acknowledged on the new
+        # one, so its tag doesn't keep the others from a multiple ack
+        crash_store.ack_crash('crash0')
+        crash_store.ack_crash('crash2')
+        crash_store._consume_acknowledgement_queue()
+        new_channel.basic_ack.assert_called_once_with(
+            delivery_tag=1,
+            multiple=True
+        )
+        ok_(not channel.basic_ack.called)
+        eq_(crash_store._unacked_delivery_tags, set())
+        eq_(list(crashes), [])
+        ok_(not channel.basic_cancel.called)
+        eq_(new_channel.basic_cancel.call_count, 3)
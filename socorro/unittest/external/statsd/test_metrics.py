@@ -71,3 +71,17 @@ class TestStatsdMetrics(TestCase):
             call('bar', 5),
             call('foo', 5),
         ])
+
+    def test_increment(self):
+        config = self.setup_config(statsd_class=dogstatsd.StatsClient)
+        with patch('socorro.external.statsd.dogstatsd.statsd') as statsd_obj:
+            statsd_metrics = StatsdMetrics(config)
+            statsd_metrics.increment('foo', 3)
+            statsd_obj.increment.assert_called_once_with('foo', 3)
+
+        config = self.setup_config(statsd_class=statsd.StatsClient)
+        statsd_metrics = StatsdMetrics(config)
+        statsd_metrics.statsd = Mock(spec=['incr', 'timing'])
+        statsd_metrics._has_histogram = False
+        statsd_metrics.increment('foo')
+        statsd_metrics.statsd.incr.assert_called_once_with('foo', 1)
@@ -2,7 +2,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import copy
+import json
+import os
+import shutil
+import tempfile
+import threading
 
 import mock
 from nose.tools import eq_, ok_, assert_raises
@@ -17,9 +21,11 @@ from socorro.external.crashstorage_base import (
     PrimaryDeferredProcessedStorage,
     Redactor,
     BenchmarkingCrashStorage,
+    PrefetchingCrashStorage,
+    CachingCrashStorage,
+    CrashIDNotFound,
     MemoryDumpsMapping,
     FileDumpsMapping,
-    socorrodotdict_to_dict
 )
 from socorro.lib.util import DotDict as SocorroDotDict
 from socorro.unittest.testbase import TestCase
@@ -78,78 +84,61 @@ class MutatingProcessedCrashCrashStorage(CrashStorageBase):
         del processed_crash['foo']
 
 
-def fake_quit_check():
-    return False
+class RedactingCrashStorage(CrashStorageBase):
+    saved = []
 
+    def is_mutator(self):
+        return True
 
-class Testsocorrodotdict_to_dict(TestCase):
-    def test_primitives(self):
-        # Test all the primitives
-        eq_(socorrodotdict_to_dict(None), None)
-        eq_(socorrodotdict_to_dict([]), [])
-        eq_(socorrodotdict_to_dict(''), '')
-        eq_(socorrodotdict_to_dict(1), 1)
-        eq_(socorrodotdict_to_dict({}), {})
-
-    def test_complex(self):
-        def comp(data, expected):
-            # First socorrodotdict_to_dict the data and compare it.
-            new_dict = socorrodotdict_to_dict(data)
-            eq_(new_dict, expected)
-
-            # Now deepcopy the new dict to make sure it's ok.
-            copy.deepcopy(new_dict)
-
-        # dict -> dict
-        comp({'a': 1}, {'a': 1})
-
-        # outer socorrodotdict -> dict
-        comp(SocorroDotDict({'a': 1}), {'a': 1})
-
-        # nested socorrodotdict -> dict
-        comp(
-            SocorroDotDict({
-                'a': 1,
-                'b': SocorroDotDict({
-                    'a': 2
-                })
-            }),
-            {'a': 1, 'b': {'a': 2}}
-        )
-        # inner socorrodotdict
-        comp(
-            {
-                'a': 1,
-                'b': SocorroDotDict({
-                    'a': 2
-                })
-            },
-            {'a': 1, 'b': {'a': 2}}
-        )
-        # in a list
-        comp(
-            {
-                'a': 1,
-                'b': [
-                    SocorroDotDict({
-                        'a': 2
-                    }),
-                    3,
-                    4
-                ]
-            },
-            {'a': 1, 'b': [{'a': 2}, 3, 4]}
-        )
-        # mixed dotdicts
-        comp(
-            DotDict({
-                'a': 1,
-                'b': SocorroDotDict({
-                    'a': 2
-                })
-            }),
-            {'a': 1, 'b': {'a': 2}}
-        )
+    def save_raw_and_processed(
+        self,
+        raw_crash,
+        dump,
+        processed_crash,
+        crash_id
+    ):
+        del processed_crash['json_dump']['sensitive']
+        raw_crash['StackTraces'] = None
+        self.saved.append(processed_crash)
+
+
+class KeyChurningCrashStorage(CrashStorageBase):
+    """behaves like the Elasticsearch stores: keys are removed from and
+    added to the crash in place while saving"""
+    def is_mutator(self):
+        return True
+
+    def save_raw_and_processed(
+        self,
+        raw_crash,
+        dump,
+        processed_crash,
+        crash_id
+    ):
+        for i in range(2000):
+            processed_crash['churn_%d' % i] = i
+            del processed_crash['churn_%d' % i]
+            raw_crash.pop('StackTraces', None)
+
+
+class SerializingCrashStorage(CrashStorageBase):
+    serialized = []
+
+    def save_raw_and_processed(
+        self,
+        raw_crash,
+        dump,
+        processed_crash,
+        crash_id
+    ):
+        for i in range(200):
+            self.serialized.append(
+                (json.dumps(raw_crash), json.dumps(processed_crash))
+            )
+
+
+def fake_quit_check():
+    return False
 
 
 class TestBase(TestCase):
@@ -465,6 +454,38 @@ class TestBase(TestCase):
             # in the processor.
             assert 'foo' not in processed_crash
 
+    def test_poly_crash_storage_views_are_taken_before_saving(self):
+        n = Namespace()
+        n.add_option(
+            'storage',
+            default=PolyCrashStorage,
+        )
+        n.add_option(
+            'logger',
+            default=mock.Mock(),
+        )
+        value = {
+            'storage_classes': (
+                'socorro.unittest.external.test_crashstorage_base'
+                '.NonMutatingProcessedCrashCrashStorage,'
+                'socorro.unittest.external.test_crashstorage_base'
+                '.MutatingProcessedCrashCrashStorage'
+            ),
+        }
+        cm = ConfigurationManager(n, values_source_list=[value])
+        with cm.context() as config:
+            processed_crash = {'foo': 'bar'}
+            poly_store = config.storage(config)
+            # the first store deletes 'foo' from the crash it shares with
+            # everyone, but the mutator's view was taken before that
+            poly_store.save_raw_and_processed(
+                {'ooid': '12345'},
+                '12345',
+                processed_crash,
+                'n'
+            )
+            ok_('foo' not in processed_crash)
+
     def test_poly_crash_storage_immutability_deeper(self):
         n = Namespace()
         n.add_option(
@@ -501,6 +522,196 @@ class TestBase(TestCase):
             eq_(processed_crash['foo']['other'], 'thing')
             eq_(processed_crash['bar']['something'], 'else')
 
+    def _concurrent_poly_store(self, config_manager_context):
+        poly_store = config_manager_context.storage(config_manager_context)
+        eq_(len(poly_store.stores), 3)
+        return poly_store
+
+    def _concurrent_poly_config_manager(self):
+        n = Namespace()
+        n.add_option(
+            'storage',
+            default=PolyCrashStorage,
+        )
+        n.add_option(
+            'logger',
+            default=mock.Mock(),
+        )
+        n.add_option(
+            'metrics',
+            default=mock.Mock(),
+        )
+        value = {
+            'storage_classes': (
+                'socorro.unittest.external.test_crashstorage_base.A,'
+                'socorro.unittest.external.test_crashstorage_base.A,'
+                'socorro.unittest.external.test_crashstorage_base'
+                '.MutatingProcessedCrashCrashStorage'
+            ),
+            'maximum_concurrent_saves': 3,
+        }
+        return ConfigurationManager(n, values_source_list=[value])
+
+    def test_poly_crash_storage_concurrent_saves(self):
+        cm = self._concurrent_poly_config_manager()
+        with cm.context() as config:
+            poly_store = self._concurrent_poly_store(config)
+            arrived = []
+            all_arrived = threading.Event()
+            lock = threading.Lock()
+
+            def save(raw_crash, dump, processed_crash, crash_id):
+                with lock:
+                    arrived.append(crash_id)
+                    if len(arrived) == 3:
+                        all_arrived.set()
+                # every store must be saving at the same time for this wait
+                # to end before its timeout
+                all_arrived.wait(5)
+                ok_(all_arrived.is_set())
+
+            for a_store in poly_store.stores.itervalues():
+                a_store.save_raw_and_processed = Mock(side_effect=save)
+
+            raw_crash = {'ooid': '12345'}
+            processed_crash = {'foo': 'bar'}
+            poly_store.save_raw_and_processed(
+                raw_crash,
+                '12345',
+                processed_crash,
+                'n'
+            )
+            eq_(arrived, ['n', 'n', 'n'])
+            stores = poly_store.stores
+            stores.storage0.save_raw_and_processed.assert_called_once_with(
+                raw_crash, '12345', processed_crash, 'n'
+            )
+            # the mutator still gets its own copy
+            args = stores.storage2.save_raw_and_processed.call_args[0]
+            eq_(args[2], processed_crash)
+            ok_(args[2] is not processed_crash)
+
+            eq_(
+                sorted(x[0][0] for x in config.metrics.histogram.call_args_list),
+                [
+                    'crashstorage.poly.storage0.save_raw_and_processed_time',
+                    'crashstorage.poly.storage1.save_raw_and_processed_time',
+                    'crashstorage.poly.storage2.save_raw_and_processed_time',
+                ]
+            )
+            poly_store.close()
+            ok_(poly_store._executor is None)
+
+    def test_poly_crash_storage_concurrent_saves_failures(self):
+        cm = self._concurrent_poly_config_manager()
+        with cm.context() as config:
+            poly_store = self._concurrent_poly_store(config)
+            for a_store in poly_store.stores.itervalues():
+                a_store.save_raw_and_processed = Mock()
+            poly_store.stores.storage0.save_raw_and_processed.side_effect = \
+                IOError('nope')
+            poly_store.stores.storage2.save_raw_and_processed.side_effect = \
+                KeyError('nope')
+
+            try:
+                poly_store.save_raw_and_processed({}, '', {}, 'n')
+                raise AssertionError('PolyStorageError was not raised')
+            except PolyStorageError as x:
+                eq_(
+                    [a_type for a_type, value, tb in x],
+                    [IOError, KeyError]
+                )
+            # a failure doesn't keep the others from saving
+            for a_store in poly_store.stores.itervalues():
+                eq_(a_store.save_raw_and_processed.call_count, 1)
+            eq_(config.logger.error.call_count, 2)
+            eq_(config.metrics.histogram.call_count, 3)
+            poly_store.close()
+
+    def test_poly_crash_storage_concurrent_mutator_and_serializer(self):
+        n = Namespace()
+        n.add_option(
+            'storage',
+            default=PolyCrashStorage,
+        )
+        n.add_option(
+            'logger',
+            default=mock.Mock(),
+        )
+        value = {
+            'storage_classes': (
+                'socorro.unittest.external.test_crashstorage_base'
+                '.KeyChurningCrashStorage,'
+                'socorro.unittest.external.test_crashstorage_base'
+                '.SerializingCrashStorage'
+            ),
+            'maximum_concurrent_saves': 2,
+        }
+        cm = ConfigurationManager(n, values_source_list=[value])
+        with cm.context() as config:
+            poly_store = config.storage(config)
+            del SerializingCrashStorage.serialized[:]
+            raw_crash = SocorroDotDict({'StackTraces': 'lots'})
+            processed_crash = SocorroDotDict(
+                ('key_%d' % i, i) for i in range(100)
+            )
+            expected = (json.dumps(raw_crash), json.dumps(processed_crash))
+
+            # a store changing the crash while another one iterates over it
+            # would raise 'dictionary changed size during iteration'
+            poly_store.save_raw_and_processed(
+                raw_crash,
+                '',
+                processed_crash,
+                'n'
+            )
+            eq_(len(SerializingCrashStorage.serialized), 200)
+            ok_(all(
+                x == expected for x in SerializingCrashStorage.serialized
+            ))
+            eq_(raw_crash.StackTraces, 'lots')
+            poly_store.close()
+
+    def test_poly_crash_storage_copy_on_write(self):
+        n = Namespace()
+        n.add_option(
+            'storage',
+            default=PolyCrashStorage,
+        )
+        n.add_option(
+            'logger',
+            default=mock.Mock(),
+        )
+        value = {
+            'storage_classes': (
+                'socorro.unittest.external.test_crashstorage_base'
+                '.RedactingCrashStorage'
+            ),
+        }
+        cm = ConfigurationManager(n, values_source_list=[value])
+        with cm.context() as config:
+            raw_crash = SocorroDotDict({'StackTraces': 'lots'})
+            threads = [{'frames': range(10)}]
+            processed_crash = SocorroDotDict({
+                'json_dump': {'sensitive': 'x', 'threads': threads},
+            })
+
+            poly_store = config.storage(config)
+            del RedactingCrashStorage.saved[:]
+            poly_store.save_raw_and_processed(
+                raw_crash,
+                '',
+                processed_crash,
+                'n'
+            )
+            eq_(processed_crash.json_dump['sensitive'], 'x')
+            eq_(raw_crash.StackTraces, 'lots')
+            saved = RedactingCrashStorage.saved[0]
+            eq_(saved, {'json_dump': {'threads': threads}})
+            # the part of the crash that the mutator didn't look at was not
+            # copied
+            ok_(dict.__getitem__(saved.json_dump, 'threads') is threads)
+
     def test_fallback_crash_storage(self):
         n = Namespace()
         n.add_option(
@@ -1127,3 +1338,296 @@ class TestDumpsMappings(TestCase):
         )
         ok_(fdm.as_file_dumps_mapping() is fdm)
         eq_(fdm.as_memory_dumps_mapping(), mdm)
+
+
+class FakeRawCrashStorage(CrashStorageBase):
+    """a source of raw crashes that counts how often it is read"""
+
+    def __init__(self, config, quit_check_callback=None):
+        super(FakeRawCrashStorage, self).__init__(config, quit_check_callback)
+        self.crashes = {
+            'abc': ({'name': 'abc'}, {'upload_file_minidump': 'x' * 10}),
+            'def': ({'name': 'def'}, {'upload_file_minidump': 'y' * 10}),
+        }
+        self.reads = []
+
+    def get_raw_crash(self, crash_id):
+        self.reads.append(('raw_crash', crash_id))
+        try:
+            return self.crashes[crash_id][0]
+        except KeyError:
+            raise CrashIDNotFound(crash_id)
+
+    def get_raw_dumps(self, crash_id):
+        self.reads.append(('dumps', crash_id))
+        return MemoryDumpsMapping(self.crashes[crash_id][1])
+
+    def get_raw_dumps_as_files(self, crash_id):
+        self.reads.append(('dumps_as_files', crash_id))
+        return MemoryDumpsMapping(
+            self.crashes[crash_id][1]
+        ).as_file_dumps_mapping(
+            crash_id,
+            self.config.temporary_file_system_storage_path,
+            self.config.dump_file_suffix
+        )
+
+
+class TestPrefetchingCrashStorage(TestCase):
+
+    def setUp(self):
+        super(TestPrefetchingCrashStorage, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestPrefetchingCrashStorage, self).tearDown()
+        shutil.rmtree(self.tempdir)
+
+    def _get_crashstorage(self, **values):
+        required_config = Namespace()
+        required_config.add_option('logger', default=Mock())
+        required_config.update(PrefetchingCrashStorage.get_required_config())
+        values.setdefault('wrapped_crashstore', FakeRawCrashStorage)
+        values.setdefault('temporary_file_system_storage_path', self.tempdir)
+        config_manager = ConfigurationManager(
+            [required_config],
+            app_name='testapp',
+            app_version='1.0',
+            app_description='app description',
+            values_source_list=[values],
+            argv_source=[]
+        )
+        with config_manager.context() as config:
+            return PrefetchingCrashStorage(config)
+
+    def test_prefetched_crash(self):
+        crashstorage = self._get_crashstorage()
+        wrapped = crashstorage.wrapped_crashstore
+        crashstorage.prefetch('abc')
+        eq_(crashstorage.get_raw_crash('abc'), {'name': 'abc'})
+        eq_(
+            crashstorage.get_raw_dumps('abc'),
+            {'upload_file_minidump': 'x' * 10}
+        )
+        eq_(wrapped.reads, [('raw_crash', 'abc'), ('dumps', 'abc')])
+        # the crash is no longer held once its dumps have been used
+        eq_(crashstorage._prefetched, {})
+        eq_(crashstorage._memory_in_use, 0)
+
+        # crashes that were not prefetched come from the wrapped store
+        eq_(crashstorage.get_raw_crash('def'), {'name': 'def'})
+        eq_(wrapped.reads[-1], ('raw_crash', 'def'))
+        crashstorage.close()
+
+    def test_dumps_are_spilled_to_files(self):
+        crashstorage = self._get_crashstorage(prefetch_memory_limit=10)
+        wrapped = crashstorage.wrapped_crashstore
+        crashstorage.prefetch('abc')
+        crashstorage._prefetched['abc'].fetched.wait()
+        crashstorage.prefetch('def')
+        crashstorage._prefetched['def'].fetched.wait()
+        ok_(not isinstance(
+            crashstorage._prefetched['abc'].dumps,
+            FileDumpsMapping
+        ))
+        # the memory limit was reached, so the dumps were streamed to files
+        # without going through memory
+        ok_(isinstance(
+            crashstorage._prefetched['def'].dumps,
+            FileDumpsMapping
+        ))
+        ok_(('dumps_as_files', 'def') in wrapped.reads)
+        ok_(('dumps', 'def') not in wrapped.reads)
+        eq_(crashstorage._memory_in_use, 10)
+
+        abc_dumps = crashstorage.get_raw_dumps_as_files('abc')
+        def_dumps = crashstorage.get_raw_dumps_as_files('def')
+        for dumps, content in ((abc_dumps, 'x'), (def_dumps, 'y')):
+            with open(dumps['upload_file_minidump']) as f:
+                eq_(f.read(), content * 10)
+        eq_(crashstorage._memory_in_use, 0)
+        crashstorage.close()
+
+    def test_fetch_errors_are_raised_to_the_caller(self):
+        crashstorage = self._get_crashstorage()
+        crashstorage.prefetch('nope')
+        assert_raises(CrashIDNotFound, crashstorage.get_raw_crash, 'nope')
+        eq_(crashstorage._prefetched, {})
+        crashstorage.close()
+
+    def test_unused_crashes_expire(self):
+        crashstorage = self._get_crashstorage(
+            prefetch_size=1,
+            prefetch_expiry=0,
+        )
+        crashstorage.prefetch('abc')
+        crashstorage._prefetched['abc'].fetched.wait()
+        # there is no room for this one until the unused crash expires
+        crashstorage.prefetch('def')
+        eq_(crashstorage._prefetched.keys(), ['def'])
+        crashstorage.close()
+        ok_(not os.listdir(self.tempdir))
+
+
+class FakeCrashStorage(FakeRawCrashStorage):
+    """a source of raw and processed crashes that counts how often it is
+    read"""
+
+    def __init__(self, config, quit_check_callback=None):
+        super(FakeCrashStorage, self).__init__(config, quit_check_callback)
+        self.processed_crashes = {
+            'abc': SocorroDotDict({
+                'uuid': 'abc',
+                'json_dump': SocorroDotDict({'frames': [1, 2, 3]}),
+            }),
+        }
+
+    def get_unredacted_processed(self, crash_id):
+        self.reads.append(('processed_crash', crash_id))
+        try:
+            return self.processed_crashes[crash_id]
+        except KeyError:
+            raise CrashIDNotFound(crash_id)
+
+    def save_processed(self, processed_crash):
+        self.processed_crashes[processed_crash['uuid']] = processed_crash
+
+
+class TestCachingCrashStorage(TestCase):
+
+    def _get_crashstorage(self, **values):
+        required_config = Namespace()
+        required_config.add_option('logger', default=Mock())
+        required_config.update(CachingCrashStorage.get_required_config())
+        values.setdefault('wrapped_crashstore', FakeCrashStorage)
+        config_manager = ConfigurationManager(
+            [required_config],
+            app_name='testapp',
+            app_version='1.0',
+            app_description='app description',
+            values_source_list=[values],
+            argv_source=[]
+        )
+        with config_manager.context() as config:
+            return CachingCrashStorage(config)
+
+    def test_read_through(self):
+        crashstorage = self._get_crashstorage()
+        wrapped = crashstorage.wrapped_crashstore
+        eq_(crashstorage.get_raw_crash('abc'), {'name': 'abc'})
+        eq_(crashstorage.get_raw_crash('abc'), {'name': 'abc'})
+        eq_(wrapped.reads, [('raw_crash', 'abc')])
+
+        processed_crash = crashstorage.get_unredacted_processed('abc')
+        eq_(processed_crash, wrapped.processed_crashes['abc'])
+        processed_crash = crashstorage.get_unredacted_processed('abc')
+        eq_(processed_crash, wrapped.processed_crashes['abc'])
+        eq_(wrapped.reads[1:], [('processed_crash', 'abc')])
+        # the copies keep the types of the original
+        ok_(isinstance(processed_crash, SocorroDotDict))
+        ok_(isinstance(processed_crash.json_dump, SocorroDotDict))
+        eq_(crashstorage.cache.hits, 2)
+
+        # dumps are not cached
+        crashstorage.get_raw_dumps('abc')
+        crashstorage.get_raw_dumps('abc')
+        eq_(wrapped.reads[-2:], [('dumps', 'abc'), ('dumps', 'abc')])
+
+    def test_callers_get_copies(self):
+        crashstorage = self._get_crashstorage()
+        processed_crash = crashstorage.get_unredacted_processed('abc')
+        processed_crash.json_dump.frames.append(4)
+        processed_crash = crashstorage.get_unredacted_processed('abc')
+        processed_crash.json_dump.frames.append(5)
+        eq_(
+            crashstorage.get_unredacted_processed('abc').json_dump.frames,
+            [1, 2, 3]
+        )
+
+    def test_not_found_is_cached(self):
+        crashstorage = self._get_crashstorage()
+        wrapped = crashstorage.wrapped_crashstore
+        assert_raises(CrashIDNotFound, crashstorage.get_raw_crash, 'xyz')
+        assert_raises(CrashIDNotFound, crashstorage.get_raw_crash, 'xyz')
+        eq_(wrapped.reads, [('raw_crash', 'xyz')])
+
+        # once it has expired, the wrapped store is asked again
+        crashstorage = self._get_crashstorage(cache_negative_expiry=0)
+        wrapped = crashstorage.wrapped_crashstore
+        assert_raises(CrashIDNotFound, crashstorage.get_raw_crash, 'xyz')
+        assert_raises(CrashIDNotFound, crashstorage.get_raw_crash, 'xyz')
+        eq_(wrapped.reads, [('raw_crash', 'xyz'), ('raw_crash', 'xyz')])
+
+    def test_expiry(self):
+        crashstorage = self._get_crashstorage(cache_expiry=0)
+        wrapped = crashstorage.wrapped_crashstore
+        crashstorage.get_raw_crash('abc')
+        crashstorage.get_raw_crash('abc')
+        eq_(wrapped.reads, [('raw_crash', 'abc'), ('raw_crash', 'abc')])
+
+    def test_size_is_bounded(self):
+        # each raw crash is 15 bytes of JSON, only one fits
+        crashstorage = self._get_crashstorage(cache_size_in_bytes=20)
+        wrapped = crashstorage.wrapped_crashstore
+        crashstorage.get_raw_crash('abc')
+        eq_(crashstorage.cache.weight, 15)
+        crashstorage.get_raw_crash('def')
+        crashstorage.get_raw_crash('abc')
+        eq_(len(wrapped.reads), 3)
+        eq_(len(crashstorage.cache), 1)
+        eq_(crashstorage.cache.evictions, 2)
+        eq_(crashstorage.cache.weight, 15)
+
+    def test_save_during_read_is_not_undone(self):
+        crashstorage = self._get_crashstorage()
+        wrapped = crashstorage.wrapped_crashstore
+        original_get = wrapped.get_unredacted_processed
+
+        def get_then_saved_elsewhere(crash_id):
+            processed_crash = original_get(crash_id)
+            # another thread saves the crash before this read is cached
+            crashstorage.save_processed(
+                SocorroDotDict({'uuid': 'abc', 'signature': 'new'})
+            )
+            return processed_crash
+        wrapped.get_unredacted_processed = get_then_saved_elsewhere
+
+        ok_('signature' not in crashstorage.get_unredacted_processed('abc'))
+        wrapped.get_unredacted_processed = original_get
+        # the stale crash was not cached
+        eq_(
+            crashstorage.get_unredacted_processed('abc'),
+            {'uuid': 'abc', 'signature': 'new'}
+        )
+        eq_(crashstorage._reads_in_progress, {})
+
+    def test_save_processed_invalidates(self):
+        crashstorage = self._get_crashstorage()
+        crashstorage.get_unredacted_processed('abc')
+        crashstorage.save_processed(
+            SocorroDotDict({'uuid': 'abc', 'signature': 'new'})
+        )
+        eq_(
+            crashstorage.get_unredacted_processed('abc'),
+            {'uuid': 'abc', 'signature': 'new'}
+        )
+        # a crash that was not found is forgotten once it has been saved
+        assert_raises(
+            CrashIDNotFound,
+            crashstorage.get_unredacted_processed,
+            'xyz'
+        )
+        crashstorage.save_processed({'uuid': 'xyz'})
+        eq_(crashstorage.get_unredacted_processed('xyz'), {'uuid': 'xyz'})
+
+    def test_get_processed_is_redacted(self):
+        crashstorage = self._get_crashstorage()
+        wrapped = crashstorage.wrapped_crashstore
+        wrapped.processed_crashes['abc'].json_dump.sensitive = 'secret'
+        ok_('sensitive' not in crashstorage.get_processed('abc').json_dump)
+        # redacting the crash didn't change the cached copy
+        ok_(
+            'sensitive' in
+            crashstorage.get_unredacted_processed('abc').json_dump
+        )
+        eq_(wrapped.reads, [('processed_crash', 'abc')])
@@ -0,0 +1,78 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from nose.tools import eq_, ok_
+
+from socorro.lib.lru_cache import LRUCache
+from socorro.unittest.testbase import TestCase
+
+
+class TestLRUCache(TestCase):
+
+    def test_get_and_put(self):
+        cache = LRUCache(3)
+        eq_(cache.get('a'), None)
+        eq_(cache.get('a', 'default'), 'default')
+        cache.put('a', 1)
+        eq_(cache.get('a'), 1)
+        ok_('a' in cache)
+        eq_(len(cache), 1)
+        eq_(cache.hits, 1)
+        eq_(cache.misses, 2)
+        eq_(cache.hit_rate, 1.0 / 3)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # touching 'a' makes 'b' the least recently used
+        cache.get('a')
+        cache.put('c', 3)
+        ok_('a' in cache)
+        ok_('b' not in cache)
+        ok_('c' in cache)
+        eq_(cache.evictions, 1)
+
+    def test_replacing_does_not_evict(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('a', 10)
+        eq_(len(cache), 2)
+        eq_(cache.get('a'), 10)
+        eq_(cache.evictions, 0)
+
+    def test_pop_and_clear(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        eq_(cache.pop('a'), 1)
+        eq_(cache.pop('a', 'gone'), 'gone')
+        cache.clear()
+        eq_(len(cache), 0)
+
+    def test_weight_is_bounded(self):
+        cache = LRUCache(None, max_weight=10)
+        cache.put('a', 1, weight=4)
+        cache.put('b', 2, weight=4)
+        eq_(cache.weight, 8)
+        cache.put('c', 3, weight=4)
+        ok_('a' not in cache)
+        eq_(cache.weight, 8)
+        eq_(cache.pop('b'), 2)
+        eq_(cache.weight, 4)
+        # an entry heavier than the limit isn't kept, and doesn't push out
+        # the others
+        cache.put('d', 4, weight=11)
+        ok_('d' not in cache)
+        ok_('c' in cache)
+        eq_(cache.weight, 4)
+        eq_(cache.evictions, 1)
+        # nor does it leave a stale value for its key behind
+        cache.put('c', 5, weight=11)
+        ok_('c' not in cache)
+        eq_(cache.weight, 0)
+
+    def test_empty_hit_rate(self):
+        eq_(LRUCache(1).hit_rate, 0.0)
@@ -0,0 +1,120 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+
+from nose.tools import eq_, ok_
+
+from socorro.lib.pipelined_task_manager import PipelinedTaskManager
+from socorro.lib.util import DotDict, SilentFakeLogger
+from socorro.unittest.testbase import TestCase
+
+
+class TestPipelinedTaskManager(TestCase):
+
+    def _get_config(self):
+        config = DotDict()
+        config.logger = SilentFakeLogger()
+        config.number_of_threads = 2
+        config.number_of_fetch_threads = 3
+        config.number_of_save_threads = 3
+        config.maximum_jobs_in_flight = 4
+        config.maximum_queue_size = 4
+        config.quit_on_empty_queue = True
+        config.idle_delay = 1
+        return config
+
+    def _iter_jobs(self, number_of_jobs, finished):
+        def iter_jobs():
+            for x in range(number_of_jobs):
+                yield (
+                    (x,),
+                    {'finished_func': lambda x=x: finished.append(x)}
+                )
+            while True:
+                yield None
+        return iter_jobs
+
+    def test_stages(self):
+        finished = []
+        saved = []
+        finishes = []
+
+        ptm = PipelinedTaskManager(
+            self._get_config(),
+            job_source_iterator=self._iter_jobs(10, finished),
+        )
+
+        def fetch(x):
+            if x == 3:
+                # nothing to do with this one
+                return None
+            return DotDict(x=x)
+
+        def process(state):
+            if state.x == 5:
+                raise Exception('bad crash')
+            state.y = state.x * 2
+
+        ptm.fetch_func = fetch
+        ptm.process_func = process
+        ptm.save_func = lambda state: saved.append(state.y)
+        ptm.finish_func = lambda state: finishes.append(state.x)
+        ptm.blocking_start()
+
+        eq_(
+            sorted(saved),
+            [x * 2 for x in range(10) if x not in (3, 5)]
+        )
+        # every fetched job was finished, even the one that failed
+        eq_(sorted(finishes), [x for x in range(10) if x != 3])
+        # and every job was acknowledged exactly once
+        eq_(sorted(finished), range(10))
+        eq_(ptm.jobs_in_flight, 0)
+
+    def test_jobs_in_flight_are_bounded(self):
+        finished = []
+        in_flight = []
+        high_water = []
+        lock = threading.Lock()
+
+        def fetch(x):
+            with lock:
+                in_flight.append(x)
+                high_water.append(len(in_flight))
+            return DotDict(x=x)
+
+        def save(state):
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(state.x)
+
+        config = self._get_config()
+        config.maximum_jobs_in_flight = 2
+        ptm = PipelinedTaskManager(
+            config,
+            job_source_iterator=self._iter_jobs(20, finished),
+        )
+        ptm.fetch_func = fetch
+        ptm.process_func = lambda state: None
+        ptm.save_func = save
+        ptm.blocking_start()
+
+        eq_(sorted(finished), range(20))
+        ok_(max(high_water) <= 2)
+
+    def test_without_stages(self):
+        finished = []
+        done = []
+
+        ptm = PipelinedTaskManager(
+            self._get_config(),
+            job_source_iterator=self._iter_jobs(10, finished),
+            task_func=done.append
+        )
+        ptm.blocking_start()
+
+        eq_(sorted(done), range(10))
+        eq_(sorted(finished), range(10))
@@ -0,0 +1,178 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import tempfile
+import time
+
+from nose.tools import eq_, ok_
+
+from socorro.lib.process_pool_task_manager import ProcessPoolTaskManager
+from socorro.lib.util import DotDict, SilentFakeLogger
+from socorro.unittest.testbase import TestCase
+
+
+class TestProcessPoolTaskManager(TestCase):
+
+    def setUp(self):
+        super(TestProcessPoolTaskManager, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestProcessPoolTaskManager, self).tearDown()
+        shutil.rmtree(self.tempdir)
+
+    def _get_config(self):
+        config = DotDict()
+        config.logger = SilentFakeLogger()
+        config.number_of_processes = 2
+        config.maximum_queue_size = 2
+        config.maximum_worker_setup_failures = 3
+        config.quit_on_empty_queue = True
+        config.idle_delay = 1
+        return config
+
+    def _touch(self, name):
+        with open(os.path.join(self.tempdir, name), 'w') as f:
+            f.write(str(os.getpid()))
+
+    def _read(self, name):
+        with open(os.path.join(self.tempdir, name)) as f:
+            return int(f.read())
+
+    def test_doing_work_in_processes(self):
+        finished = []
+
+        def iter_jobs():
+            for x in range(10):
+                yield ((str(x),), {'finished_func': lambda x=x: finished.append(x)})
+            while True:
+                yield None
+
+        ppm = ProcessPoolTaskManager(
+            self._get_config(),
+            job_source_iterator=iter_jobs,
+            task_func=self._touch
+        )
+        ppm.worker_setup_func = lambda: self._touch('setup-%s' % os.getpid())
+        ppm.blocking_start()
+
+        # the jobs ran in the workers, not here
+        for x in range(10):
+            ok_(self._read(str(x)) != os.getpid())
+        # each worker set itself up
+        setup_files = [
+            x for x in os.listdir(self.tempdir) if x.startswith('setup-')
+        ]
+        eq_(len(setup_files), 2)
+        # and the callbacks ran here, once per job
+        eq_(sorted(finished), range(10))
+        eq_(ppm._pending_callbacks, {})
+        ok_(not any(p.is_alive() for p in ppm.process_list))
+
+    def test_dead_worker_is_replaced(self):
+        finished = []
+
+        def die_on_3(name):
+            if name == '3':
+                os._exit(1)
+            self._touch(name)
+
+        def iter_jobs():
+            for x in range(6):
+                yield ((str(x),), {'finished_func': lambda x=x: finished.append(x)})
+            while True:
+                yield None
+
+        config = self._get_config()
+        config.number_of_processes = 1
+        ppm = ProcessPoolTaskManager(
+            config,
+            job_source_iterator=iter_jobs,
+            task_func=die_on_3
+        )
+        ppm.worker_check_interval = 0.1
+        ppm.blocking_start()
+
+        # the job that killed its worker is never acknowledged
+        eq_(sorted(finished), [0, 1, 2, 4, 5])
+        eq_(ppm._pending_callbacks, {})
+        eq_(len(ppm.process_list), 1)
+
+    def test_queued_jobs_are_dropped_when_the_parent_quits(self):
+        finished = []
+
+        def wait_on_0(name):
+            self._touch(name)
+            if name == '0':
+                while not os.path.exists(os.path.join(self.tempdir, 'go')):
+                    time.sleep(0.05)
+
+        def iter_jobs():
+            for x in range(6):
+                yield ((str(x),), {'finished_func': lambda x=x: finished.append(x)})
+            while True:
+                yield None
+
+        config = self._get_config()
+        config.number_of_processes = 1
+        ppm = ProcessPoolTaskManager(
+            config,
+            job_source_iterator=iter_jobs,
+            task_func=wait_on_0
+        )
+        ppm.worker_check_interval = 0.1
+        ppm.start()
+        while not os.path.exists(os.path.join(self.tempdir, '0')):
+            time.sleep(0.05)
+        ppm.quit = True
+        self._touch('go')
+        ppm.wait_for_completion()
+
+        # the job that was running finishes, the queued ones are never done
+        eq_(finished, [0])
+        for x in range(1, 6):
+            ok_(not os.path.exists(os.path.join(self.tempdir, str(x))))
+        ok_(not any(p.is_alive() for p in ppm.process_list))
+
+    def test_give_up_when_workers_fail_to_set_up(self):
+        def fail():
+            self._touch('setup-%s' % os.getpid())
+            raise IOError('no database')
+
+        def iter_jobs():
+            while True:
+                yield (('x',), {})
+
+        ppm = ProcessPoolTaskManager(
+            self._get_config(),
+            job_source_iterator=iter_jobs,
+            task_func=self._touch
+        )
+        ppm.worker_check_interval = 0.1
+        ppm.worker_setup_func = fail
+        ppm.blocking_start()
+
+        ok_(ppm.quit)
+        eq_(ppm.process_list, [])
+        # the first two workers are replaced after the first and second
+        # failures, their replacements make three failures in a row
+        setup_files = [
+            x for x in os.listdir(self.tempdir) if x.startswith('setup-')
+        ]
+        eq_(len(setup_files), 4)
+        ok_(not os.path.exists(os.path.join(self.tempdir, 'x')))
+
+    def test_death_token_is_dropped_when_no_worker_is_left(self):
+        config = self._get_config()
+        config.maximum_queue_size = 1
+        ppm = ProcessPoolTaskManager(config)
+        ppm.worker_check_interval = 0.1
+        ppm.task_queue.put((self._touch, (('x',), {})))
+        # the queue is full and there is no worker to empty it
+        ppm.quit = True
+        ppm.task_queue.put((None, None))
+        ok_(not ppm.task_queue.empty())
+        eq_(ppm.task_queue.queue.get(timeout=1)[1], ('x',))
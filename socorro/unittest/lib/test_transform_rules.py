@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import sys
+import threading
 
 from nose.tools import eq_, ok_, assert_raises
 from mock import Mock, MagicMock, patch
@@ -11,6 +12,7 @@ from configman.dotdict import DotDict
 from configman import Namespace
 
 from socorro.lib import transform_rules
+from socorro.lib.util import DotDict as SocorroDotDict
 from socorro.unittest.testbase import TestCase
 
 
@@ -76,6 +78,30 @@ class RuleTestBrokenCloseMethod(transform_rules.Rule):
         raise AttributeError("We're human")
 
 
+class RuleTestDeclared(transform_rules.Rule):
+    """copies one field of the raw crash to the processed crash, waiting
+    for 'wait_for' to be set by another rule first if it is given"""
+
+    def __init__(self, source, destination, wait_for=None, signal=None):
+        super(RuleTestDeclared, self).__init__(DotDict())
+        self.source = source
+        self.destination = destination
+        self.wait_for = wait_for
+        self.signal = signal
+        self.reads = ('raw_crash.%s' % source,)
+        self.writes = ('processed_crash.%s' % destination,)
+
+    def _action(self, raw_crash, raw_dumps, processed_crash, processor_meta):
+        if self.signal:
+            self.signal.set()
+        if self.wait_for:
+            # if the rules were run one at a time, this would time out
+            ok_(self.wait_for.wait(5))
+        processed_crash[self.destination] = raw_crash[self.source]
+        processor_meta.processor_notes.append(self.destination)
+        return True
+
+
 class TestTransformRules(TestCase):
 
     def test_kw_str_parse(self):
@@ -354,6 +380,203 @@ class TestTransformRules(TestCase):
         assert_expected(d, {'one': 2})
         assert_expected(quit_check_mock.call_count, 4)
 
+    def test_TransformRuleSystem_rule_levels(self):
+        a = RuleTestDeclared('a', 'A')
+        b = RuleTestDeclared('b', 'B')
+        # reads what 'b' writes
+        c = RuleTestDeclared('c', 'C')
+        c.reads = ('processed_crash.B',)
+        # writes part of what 'a' writes
+        d = RuleTestDeclared('d', 'A.d')
+        # undeclared rules run alone
+        e = transform_rules.Rule()
+        f = RuleTestDeclared('f', 'F')
+
+        rules = transform_rules.TransformRuleSystem()
+        rules.rules = [a, b, c, d, e, f]
+        eq_(rules._get_rule_levels(), [[a, b], [c, d], [e], [f]])
+
+    def test_TransformRuleSystem_apply_all_rules_concurrently(self):
+        quit_check_mock = Mock()
+        first_started = threading.Event()
+        second_started = threading.Event()
+        rules = transform_rules.TransformRuleSystem(quit_check=quit_check_mock)
+        rules.config.logger = Mock()
+        rules.rules = [
+            RuleTestDeclared('a', 'A', wait_for=second_started, signal=first_started),
+            RuleTestDeclared('b', 'B', wait_for=first_started, signal=second_started),
+            RuleTestDeclared('c', 'C'),
+        ]
+        rules.rules[2].reads = ('processed_crash.A', 'processed_crash.B')
+
+        raw_crash = {'a': 1, 'b': 2, 'c': 3}
+        processed_crash = {}
+        processor_meta = SocorroDotDict()
+        processor_meta.processor_notes = ['start']
+        rules.apply_all_rules_concurrently(
+            raw_crash,
+            {},
+            processed_crash,
+            processor_meta
+        )
+        rules.close()
+
+        eq_(processed_crash, {'A': 1, 'B': 2, 'C': 3})
+        # the notes come out in rule order regardless of which finished first
+        eq_(processor_meta.processor_notes, ['start', 'A', 'B', 'C'])
+        eq_(quit_check_mock.call_count, 2)
+
+    def test_TransformRuleSystem_apply_all_rules_concurrently_meta(self):
+        class RuleTestMeta(RuleTestDeclared):
+            def _action(self, raw_crash, raw_dumps, processed_crash,
+                        processor_meta):
+                processor_meta[self.destination] = raw_crash[self.source]
+                return True
+
+        rules = transform_rules.TransformRuleSystem()
+        rules.config.logger = Mock()
+        rules.rules = [
+            RuleTestMeta('a', 'A'),
+            RuleTestMeta('b', 'B'),
+        ]
+        processor_meta = SocorroDotDict()
+        processor_meta.processor_notes = []
+        processor_meta.A = 0
+        processor_meta.B = 0
+        rules.apply_all_rules_concurrently(
+            {'a': 1, 'b': 2},
+            {},
+            {},
+            processor_meta
+        )
+        rules.close()
+        # the stale values in the copy of the second rule don't undo what
+        # the first rule did
+        eq_(processor_meta.A, 1)
+        eq_(processor_meta.B, 2)
+
+    def test_TransformRuleSystem_apply_all_rules_concurrently_requires(self):
+        a = RuleTestDeclared('a', 'A')
+        a.requires = ('raw_crash.a',)
+        b = RuleTestDeclared('b', 'B')
+        b.requires = ('raw_crash.b',)
+        rules = transform_rules.TransformRuleSystem()
+        rules.rules = [a, b]
+
+        processed_crash = {}
+        processor_meta = SocorroDotDict()
+        processor_meta.processor_notes = []
+        rules.apply_all_rules_concurrently(
+            {'a': 1},
+            {},
+            processed_crash,
+            processor_meta
+        )
+        eq_(processed_crash, {'A': 1})
+        eq_(processor_meta.processor_notes, ['A'])
+
+    def test_TransformRuleSystem_rule_statistics(self):
+        config = DotDict()
+        config.logger = Mock()
+        config.chatty_rules = False
+        config.rule_metrics_class = Mock()
+        config.rule_statistics_summary_interval = 0
+        rules = transform_rules.TransformRuleSystem(config)
+        rules.rules = [
+            RuleTestLaughable(DotDict({'laughable': 'fred'})),
+            RuleTestLaughable(DotDict({'laughable': 'wilma'})),
+            RuleTestBrokenCloseMethod(config),
+        ]
+        rules.apply_all_rules()
+
+        stats = rules.rule_statistics.rules
+        eq_(stats['RuleTestLaughable']['applied'], 2)
+        eq_(stats['RuleTestLaughable']['predicate_true'], 1)
+        eq_(stats['RuleTestLaughable']['predicate_false'], 1)
+        eq_(stats['RuleTestLaughable']['exceptions'], 0)
+        # its action refers to an undefined name
+        eq_(stats['RuleTestBrokenCloseMethod']['exceptions'], 1)
+        ok_(stats['RuleTestBrokenCloseMethod']['wall_time'] >= 0)
+
+        metrics = rules.rule_metrics
+        eq_(metrics.capture_stats.call_count, 3)
+        ok_(
+            'rules.RuleTestLaughable.wall_time' in
+            metrics.capture_stats.call_args_list[0][0][0]
+        )
+        metrics.increment.assert_any_call(
+            'rules.RuleTestLaughable.predicate_false'
+        )
+        metrics.increment.assert_any_call(
+            'rules.RuleTestBrokenCloseMethod.exceptions',
+            1
+        )
+
+        table = rules.rule_statistics.summary_table().splitlines()
+        eq_(len(table), 3)
+        ok_(table[0].startswith('rule'))
+
+    def test_TransformRuleSystem_rule_statistics_loaded_rules(self):
+        config = DotDict()
+        config.logger = Mock()
+        config.chatty_rules = False
+        config.rule_statistics_summary_interval = 0
+
+        def assign_1(s, d):
+            d['one'] = 1
+            return True
+
+        rules = transform_rules.TransformRuleSystem(config)
+        rules.load_rules([
+            (True, '', '', assign_1, '', ''),
+            (RuleTestLaughable, '', '', RuleTestLaughable, '', ''),
+        ])
+        rules.apply_all_rules({}, {})
+
+        # the rules are named after what they wrap, not TransformRule
+        stats = rules.rule_statistics.rules
+        eq_(sorted(stats.keys()), ['RuleTestLaughable', 'assign_1'])
+
+    def test_TransformRuleSystem_nested_rule_exceptions(self):
+        config = DotDict()
+        config.logger = Mock()
+        config.chatty_rules = False
+        config.rule_statistics_summary_interval = 0
+        inner_rules = transform_rules.TransformRuleSystem(config)
+        inner_rules.rules = [RuleTestNoCloseMethod(config)]
+
+        class RuleTestNested(transform_rules.Rule):
+            def _action(self, *args, **kwargs):
+                # a rule that traps an exception, run as part of this one
+                RuleTestBrokenCloseMethod(config).action()
+                inner_rules.apply_all_rules()
+                return True
+
+        rules = transform_rules.TransformRuleSystem(config)
+        rules.rules = [RuleTestNested(config)]
+        rules.apply_all_rules()
+
+        # the nested rule system doesn't wipe out the exception that the
+        # action of the outer rule trapped before it
+        stats = rules.rule_statistics.rules
+        eq_(stats['RuleTestNested']['exceptions'], 1)
+
+    def test_TransformRuleSystem_rule_statistics_summary(self):
+        config = DotDict()
+        config.logger = Mock()
+        config.chatty_rules = False
+        config.rule_statistics_summary_interval = 60
+        rules = transform_rules.TransformRuleSystem(config)
+        rules.rules = [RuleTestNoCloseMethod(config)]
+
+        rules.apply_all_rules()
+        ok_(not config.logger.info.called)
+
+        rules._last_summary_time = 0
+        rules.apply_all_rules()
+        eq_(config.logger.info.call_count, 1)
+        ok_('RuleTestNoCloseMethod' in config.logger.info.call_args[0][2])
+
     def test_TransformRuleSystem_apply_all_until_action_succeeds(self):
 
         quit_check_mock = Mock()
@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import copy
+import json
+
+from nose.tools import eq_, ok_
+
+from socorro.lib.util import CopyOnWriteDotDict, DotDict
+from socorro.unittest.testbase import TestCase
+
+
+class TestCopyOnWriteDotDict(TestCase):
+
+    def _get_crash(self):
+        return DotDict({
+            'uuid': 'abc',
+            'json_dump': {
+                'sensitive': {'exploitability': 'high'},
+                'threads': [{'frames': [{'function': 'f'}]}],
+            },
+            'addons': [['a', '1'], ['b', '2']],
+        })
+
+    def test_changes_stay_in_the_copy(self):
+        crash = self._get_crash()
+        original = json.dumps(crash, sort_keys=True)
+        a_copy = CopyOnWriteDotDict(crash)
+
+        a_copy.uuid = 'def'
+        del a_copy['json_dump']['sensitive']
+        a_copy.json_dump.threads[0]['frames'][0]['function'] = 'g'
+        a_copy.addons.append(['c', '3'])
+        a_copy.get('json_dump')['new'] = 1
+        a_copy.setdefault('extra', {})['x'] = 1
+
+        eq_(json.dumps(crash, sort_keys=True), original)
+        eq_(a_copy.uuid, 'def')
+        eq_(
+            a_copy.json_dump,
+            {
+                'threads': [{'frames': [{'function': 'g'}]}],
+                'new': 1,
+            }
+        )
+        eq_(len(a_copy.addons), 3)
+        eq_(a_copy.extra, {'x': 1})
+
+    def test_untouched_parts_are_shared(self):
+        crash = self._get_crash()
+        a_copy = CopyOnWriteDotDict(crash)
+        del a_copy['addons']
+        a_copy['json_dump']['threads'][0]['frames'] = []
+
+        # nothing was copied just for being there
+        eq_(a_copy._shared_keys, set(['uuid']))
+        ok_(dict.__getitem__(a_copy.json_dump, 'sensitive') is
+            crash.json_dump['sensitive'])
+        eq_(len(crash.json_dump['threads'][0]['frames']), 1)
+        ok_('addons' in crash)
+
+    def test_reading_it_like_a_dict(self):
+        crash = self._get_crash()
+        a_copy = CopyOnWriteDotDict(crash)
+        eq_(a_copy, crash)
+        eq_(json.loads(json.dumps(a_copy)), json.loads(json.dumps(crash)))
+        eq_(sorted(a_copy.keys()), ['addons', 'json_dump', 'uuid'])
+
+        for key, value in a_copy.items():
+            if isinstance(value, dict):
+                value.clear()
+        for value in a_copy.values():
+            if isinstance(value, list):
+                del value[:]
+        eq_(a_copy, {'uuid': 'abc', 'json_dump': {}, 'addons': []})
+        eq_(crash, self._get_crash())
+
+        eq_(a_copy.pop('uuid'), 'abc')
+        eq_(a_copy.pop('uuid', None), None)
+        ok_('uuid' in crash)
+
+    def test_copies(self):
+        crash = self._get_crash()
+        a_copy = CopyOnWriteDotDict(crash)
+
+        deep_copy = copy.deepcopy(a_copy)
+        deep_copy.json_dump['threads'].pop()
+        eq_(crash, self._get_crash())
+
+        shallow_copy = copy.copy(a_copy)
+        del shallow_copy['json_dump']['sensitive']
+        ok_('sensitive' in a_copy.json_dump)
+        ok_('sensitive' in crash.json_dump)
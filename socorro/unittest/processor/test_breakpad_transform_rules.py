@@ -706,6 +706,145 @@ class TestBreakpadTransformRule2015(TestCase):
             ]
         )
 
+    @patch('socorro.processor.breakpad_transform_rules.StackwalkerPool')
+    def test_pooled_stackwalker(self, mocked_pool_class):
+        config = self.get_basic_config()
+        config.stackwalker_pool_size = 2
+        config.stackwalker_pool_command_line = (
+            BreakpadStackwalkerRule2015.required_config
+            .stackwalker_pool_command_line.default
+        )
+        config.stackwalker_pool_symbol_cache_size = 1024
+        config.stackwalker_pool_timeout = 30
+        config.stackwalker_pool_max_requests = 1000
+
+        raw_crash = copy.copy(canonical_standard_raw_crash)
+        raw_dumps = {config.dump_field: 'a_fake_dump.dump'}
+        processed_crash = DotDict()
+        processor_meta = self.get_basic_processor_meta()
+
+        mocked_pool = mocked_pool_class.return_value
+        mocked_pool.walk.return_value = (cannonical_stackwalker_output_str, 0)
+
+        rule = MyBreakpadStackwalkerRule2015(config)
+        mocked_pool_class.assert_called_once_with(
+            '/bin/stackwalker --pipe-server '
+            '--symbols-url https://localhost '
+            '--symbols-url https://localhost '
+            '--symbols-cache /mnt/socorro/symbols '
+            '--symbol-cache-max-bytes 1024',
+            size=2,
+            timeout=30,
+            max_requests=1000,
+            logger=config.logger,
+        )
+
+        # the call to be tested
+        rule.act(raw_crash, raw_dumps, processed_crash, processor_meta)
+
+        mocked_pool.walk.assert_called_once_with(
+            '%s.json' % raw_crash.uuid,
+            'a_fake_dump.dump'
+        )
+        eq_(processed_crash.json_dump, cannonical_stackwalker_output)
+        eq_(processed_crash.mdsw_return_code, 0)
+        eq_(processed_crash.mdsw_status_string, "OK")
+        ok_(processed_crash.success)
+
+        rule.close()
+        mocked_pool.close.assert_called_once_with()
+
+    @patch('socorro.processor.breakpad_transform_rules.StackwalkerPool')
+    def test_pooled_stackwalker_symbol_cache_stats(self, mocked_pool_class):
+        config = self.get_basic_config()
+        config.metrics = Mock()
+        config.stackwalker_pool_size = 1
+        config.stackwalker_pool_command_line = (
+            BreakpadStackwalkerRule2015.required_config
+            .stackwalker_pool_command_line.default
+        )
+        config.stackwalker_pool_symbol_cache_size = 1024
+        config.stackwalker_pool_timeout = 30
+        config.stackwalker_pool_max_requests = 1000
+
+        raw_crash = copy.copy(canonical_standard_raw_crash)
+        raw_dumps = {config.dump_field: 'a_fake_dump.dump'}
+        processed_crash = DotDict()
+        processor_meta = self.get_basic_processor_meta()
+
+        stackwalker_output = dict(cannonical_stackwalker_output)
+        stackwalker_output['symbol_cache_stats'] = {
+            'hits': 12,
+            'misses': 3,
+            'evictions': 1,
+            'loaded_modules': 40,
+            'loaded_bytes': 123456,
+        }
+        mocked_pool_class.return_value.walk.return_value = (
+            ujson.dumps(stackwalker_output),
+            0
+        )
+
+        rule = MyBreakpadStackwalkerRule2015(config)
+
+        # the call to be tested
+        rule.act(raw_crash, raw_dumps, processed_crash, processor_meta)
+
+        eq_(processed_crash.json_dump, cannonical_stackwalker_output)
+        config.metrics.increment.assert_any_call(
+            'processor.stackwalker.symbol_cache.hits',
+            value=12
+        )
+        config.metrics.increment.assert_any_call(
+            'processor.stackwalker.symbol_cache.misses',
+            value=3
+        )
+        config.metrics.increment.assert_any_call(
+            'processor.stackwalker.symbol_cache.evictions',
+            value=1
+        )
+        config.metrics.gauge.assert_any_call(
+            'processor.stackwalker.symbol_cache.loaded_modules',
+            40
+        )
+        config.metrics.gauge.assert_any_call(
+            'processor.stackwalker.symbol_cache.loaded_bytes',
+            123456
+        )
+
+    @patch('socorro.processor.breakpad_transform_rules.StackwalkerPool')
+    def test_pooled_stackwalker_timeout(self, mocked_pool_class):
+        config = self.get_basic_config()
+        config.stackwalker_pool_size = 1
+        config.stackwalker_pool_command_line = (
+            BreakpadStackwalkerRule2015.required_config
+            .stackwalker_pool_command_line.default
+        )
+        config.stackwalker_pool_symbol_cache_size = 1024
+        config.stackwalker_pool_timeout = 30
+        config.stackwalker_pool_max_requests = 1000
+
+        raw_crash = copy.copy(canonical_standard_raw_crash)
+        raw_dumps = {config.dump_field: 'a_fake_dump.dump'}
+        processed_crash = DotDict()
+        processor_meta = self.get_basic_processor_meta()
+
+        mocked_pool_class.return_value.walk.return_value = (None, 124)
+
+        rule = MyBreakpadStackwalkerRule2015(config)
+
+        # the call to be tested
+        rule.act(raw_crash, raw_dumps, processed_crash, processor_meta)
+
+        eq_(processed_crash.json_dump, {})
+        eq_(processed_crash.mdsw_return_code, 124)
+        eq_(processed_crash.mdsw_status_string, "unknown error")
+        ok_(not processed_crash.success)
+        eq_(
+            processor_meta.processor_notes,
+            ["MDSW terminated with SIGKILL due to timeout", ]
+        )
+
 
 class TestJitCrashCategorizeRule(TestCase):
 
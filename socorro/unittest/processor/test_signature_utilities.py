@@ -27,7 +27,10 @@ from socorro.processor.signature_utilities import (
     SigTrunc,
     SignatureShutdownTimeout,
     SignatureIPCMessageName,
+    SiglistMatcher,
+    _split_literal_prefix,
 )
+from socorro import siglists
 from socorro.unittest.processor import create_basic_fake_processor
 from socorro.unittest.testbase import TestCase
 
@@ -60,21 +63,19 @@ class TestCSignatureTool(TestCase):
 
     def test_c_config_tool_init(self):
         """test_C_config_tool_init: constructor test"""
-        expected_regex = sutil.DotDict()
-        expected_regex.irrelevant_signature_re = re.compile('ignored1')
-        expected_regex.prefix_signature_re = re.compile('pre1|pre2')
-        expected_regex.signatures_with_line_numbers_re = re.compile(
-            'fnNeedNumber'
-        )
         fixup_space = re.compile(r' (?=[\*&,])')
         fixup_comma = re.compile(r',(?! )')
 
         s, c = self.setup_config_c_sig_tool()
 
         assert c == s.config
-        assert expected_regex.irrelevant_signature_re == s.irrelevant_signature_re
-        assert expected_regex.prefix_signature_re == s.prefix_signature_re
-        assert expected_regex.signatures_with_line_numbers_re == s.signatures_with_line_numbers_re
+        assert s.irrelevant_signature_re.patterns == ('ignored1',)
+        assert s.prefix_signature_re.patterns == ('pre1', 'pre2')
+        assert s.signatures_with_line_numbers_re.patterns == ('fnNeedNumber',)
+        assert s.trim_dll_signature_re.patterns == ('foo32\.dll.*',)
+        assert s.irrelevant_signature_re.match('ignored1')
+        assert s.prefix_signature_re.match('pre2')
+        assert not s.prefix_signature_re.match('pre3')
         assert fixup_space.pattern == s.fixup_space.pattern
         assert fixup_comma.pattern == s.fixup_comma.pattern
 
@@ -137,6 +138,88 @@ class TestCSignatureTool(TestCase):
             r = s.normalize_signature(*args)
             assert e == r
 
+    def test_collapse(self):
+        s, c = self.setup_config_c_sig_tool()
+        template_args = ('<', '<', '>', 'T>', ('name omitted', 'IPC::ParamTraits'))
+        function_args = ('(', '', ')', '', ('anonymous namespace', 'operator'))
+        a = [
+            ('', template_args, ''),
+            ('f', template_args, 'f'),
+            ('A<B<C>, D>::E<F>', template_args, 'A<T>::E<T>'),
+            ('A<name omitted>', template_args, 'A<name omitted>'),
+            ('IPC::ParamTraits<X>::Write', template_args, 'IPC::ParamTraits<X>::Write'),
+            # unbalanced delimiters hide the text they leave unbalanced
+            ('a>b<c>d', template_args, 'ac'),
+            ('a<b', template_args, 'a<'),
+            ('f(int, (anonymous namespace)::G)', function_args, 'f'),
+            ('operator()(int)', function_args, 'operator()'),
+        ]
+        for function, args, expected in a:
+            assert s._collapse(function, *args) == expected
+
+    def test_collapse_long_function(self):
+        s, c = self.setup_config_c_sig_tool()
+        function = 'Outer<%s>::Inner<%s>::f' % (
+            ', '.join(['A<B<C>>'] * 2000),
+            ', '.join(['(anonymous namespace)::D'] * 2000),
+        )
+        assert (
+            s._collapse(function, '<', '<', '>', 'T>', ()) ==
+            'Outer<T>::Inner<T>::f'
+        )
+
+    def test_normalize_is_cached(self):
+        s, c = self.setup_config_c_sig_tool()
+        with mock.patch.object(
+            s,
+            '_normalize_function',
+            wraps=s._normalize_function
+        ) as mocked_normalize_function:
+            assert s.normalize_signature('m', 'f( *s)', 's', '1') == 'f'
+            assert s.normalize_signature('m', 'f( *s)', 's', '2') == 'f'
+            # the line number is appended outside of the cache
+            assert (
+                s.normalize_signature('m', 'fnNeedNumber', 's', '23') ==
+                'fnNeedNumber:23'
+            )
+            assert (
+                s.normalize_signature('m', 'fnNeedNumber', 's', '42') ==
+                'fnNeedNumber:42'
+            )
+            assert mocked_normalize_function.call_count == 2
+        assert len(s.normalize_cache) == 2
+        assert s.normalize_cache.hits == 2
+        assert s.normalize_cache.misses == 2
+
+    def test_normalize_cache_is_bounded(self):
+        s, c = self.setup_config_c_sig_tool()
+        s.normalize_cache.max_size = 2
+        for function in ('f1', 'f2', 'f3'):
+            s.normalize_signature('m', function)
+        assert len(s.normalize_cache) == 2
+        assert 'f1' not in s.normalize_cache
+        assert s.normalize_cache.evictions == 1
+
+    def test_normalize_cache_stats(self):
+        s, c = self.setup_config_c_sig_tool()
+        c.metrics = mock.Mock()
+        s.normalize_signature('m', 'f1')
+        s.normalize_signature('m', 'f1')
+
+        # not reported until the interval has passed
+        s._capture_normalize_cache_stats()
+        assert not c.metrics.gauge.called
+
+        s._last_stats_time = 0
+        s._capture_normalize_cache_stats()
+        c.metrics.gauge.assert_has_calls([
+            mock.call('processor.signature.normalize_cache.size', 1),
+            mock.call('processor.signature.normalize_cache.hits', 1),
+            mock.call('processor.signature.normalize_cache.misses', 1),
+            mock.call('processor.signature.normalize_cache.evictions', 0),
+            mock.call('processor.signature.normalize_cache.hit_rate', 0.5),
+        ])
+
     def test_generate_1(self):
         """test_generate_1: simple"""
         s, c = self.setup_config_c_sig_tool(['a', 'b', 'c'], ['d', 'e', 'f'])
@@ -258,6 +341,113 @@ class TestCSignatureTool(TestCase):
         assert sig == 'foo32.dll | g'
 
 
+class TestSiglistMatcher(TestCase):
+
+    # frames typical of the top of crashing threads
+    sample_frames = (
+        'nsThread::ProcessNextEvent',
+        'NS_ProcessNextEvent(nsIThread*, bool)',
+        'mozilla::ipc::MessagePump::Run(base::MessagePump::Delegate*)',
+        'MessageLoop::RunHandler()',
+        'js::RunScript(JSContext*, js::RunState&)',
+        'RtlUserThreadStart',
+        'KiFastSystemCallRet',
+        'NtWaitForSingleObject',
+        'WaitForMultipleObjectsEx',
+        'ZwWaitForMultipleObjects',
+        'xul.dll@0x1234',
+        'libxul.so@0xdeadbeef',
+        'XUL@0x0',
+        'libc.so@0x1f2b',
+        'libdvm.so @ 0x7a',
+        '@0x0',
+        '@0x1',
+        '@0xff',
+        'js::detail::HashTable<T>::lookup',
+        'js::HashSet<T>::put',
+        'std::list<T>::push_back',
+        'mozilla::MakeUnique<T>',
+        'mozilla::ipc::FatalError',
+        'moz_abort',
+        'CopyUTF16toUTF8',
+        'NS_LossyConvertUTF16toASCII::NS_LossyConvertUTF16toASCII',
+        '+[NSException raise:format:]',
+        '<lambda>::operator()',
+        'data@app@org.mozilla.firefox-1.apk@classes.dex@0x2a',
+        'aticfx32.dll@0x1234',
+        'nvwgf2um.dll@0x0',
+        'je_malloc',
+        'arena_dalloc',
+        'SEC_ASN1DecodeItem',
+        '',
+        'multi\nline abort',
+    )
+
+    @classmethod
+    def _corpus_for(cls, patterns):
+        """strings near the edges of what each pattern matches: a rendering
+        of the pattern as a plain string, and every prefix of it"""
+        corpus = set(cls.sample_frames)
+        for a_pattern in patterns:
+            rendering = a_pattern.replace('.*', 'Foo').replace('\\', '')
+            for a_length in range(len(rendering) + 1):
+                corpus.add(rendering[:a_length])
+            corpus.add(rendering + '::Bar')
+            corpus.add('x' + rendering)
+        return sorted(corpus)
+
+    def _assert_equivalent(self, patterns, corpus=None):
+        joined_re = re.compile('|'.join(patterns))
+        matcher = SiglistMatcher(patterns)
+        if corpus is None:
+            corpus = self._corpus_for(patterns)
+        for a_string in corpus:
+            assert (
+                bool(matcher.match(a_string)) ==
+                bool(joined_re.match(a_string))
+            ), (a_string, matcher.pattern)
+
+    def test_split_literal_prefix(self):
+        assert _split_literal_prefix('CFRelease') == ('CFRelease', '')
+        assert _split_literal_prefix('je_.*') == ('je_', '')
+        assert _split_literal_prefix('libc\\.so@.*') == ('libc.so@', '')
+        assert _split_literal_prefix('\\<name omitted\\>') == (
+            '<name omitted>',
+            ''
+        )
+        assert _split_literal_prefix('js::HashSet<.*>::.*') == (
+            'js::HashSet<',
+            '.*>::.*'
+        )
+        assert _split_literal_prefix('PR_Wai?t') == ('PR_Wa', 'i?t')
+        assert _split_literal_prefix('ab\\.+') == ('ab', '\\.+')
+        assert _split_literal_prefix('libdvm\\.so\\s*@') == (
+            'libdvm.so',
+            '\\s*@'
+        )
+        assert _split_literal_prefix('(Nt|Zw)?Wait') == ('', '(Nt|Zw)?Wait')
+        assert _split_literal_prefix('ab|cd') == ('', 'ab|cd')
+        assert _split_literal_prefix('ab(c|d)') == ('', 'ab(c|d)')
+
+    def test_edge_cases(self):
+        self._assert_equivalent(['abc', 'ab', 'abd.*', 'x.*y'])
+        self._assert_equivalent(['.*'])
+        self._assert_equivalent([''], ['', 'a'])
+        self._assert_equivalent(['.*abort', '.*free', '.*abort.*', 'fr.*ee'])
+        self._assert_equivalent(['a?b', 'a+c', 'a{2}d', 'a\\.?e'])
+        self._assert_equivalent(['ab|cd', 'a(b|c)d', '[ab]c', 'x\\dy'])
+        self._assert_equivalent(['a\\\\.*', 'a\\.*'], ['a\\', 'a.', 'ab', 'a'])
+
+    def test_equivalent_to_joined_siglists(self):
+        for a_siglist in (
+            siglists.IRRELEVANT_SIGNATURE_RE,
+            siglists.PREFIX_SIGNATURE_RE,
+            siglists.SIGNATURES_WITH_LINE_NUMBERS_RE,
+            siglists.TRIM_DLL_SIGNATURE_RE,
+        ):
+            self._assert_equivalent(a_siglist)
+
+
 class TestJavaSignatureTool(TestCase):
     def test_generate_signature_1(self):
         config = DotDict()
@@ -0,0 +1,157 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import shutil
+import sys
+import tempfile
+
+import ujson
+
+from mock import Mock, patch
+from nose.tools import eq_, ok_, assert_raises
+
+from socorro.processor.stackwalker_pool import (
+    StackwalkerPool,
+    TIMEOUT_RETURN_CODE,
+)
+from socorro.unittest.testbase import TestCase
+
+
+# a stand in for 'stackwalker --pipe-server': it answers every request with
+# the paths it was given.  A dump named 'hang' makes it stop answering, one
+# named 'crash' makes it exit.
+fake_stackwalker_source = r'''
+import json
+import os
+import sys
+import time
+
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    raw_crash_pathname, dump_pathname = line.rstrip('\n').split('\t')
+    if dump_pathname == 'hang':
+        time.sleep(60)
+    if dump_pathname == 'crash':
+        sys.exit(3)
+    sys.stdout.write(json.dumps({
+        'status': 'OK',
+        'raw_crash_pathname': raw_crash_pathname,
+        'dump_pathname': dump_pathname,
+        'pid': os.getpid(),
+    }) + '\n')
+    sys.stdout.flush()
+'''
+
+
+class TestStackwalkerPool(TestCase):
+
+    def setUp(self):
+        super(TestStackwalkerPool, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        script_pathname = os.path.join(self.tempdir, 'fake_stackwalker.py')
+        with open(script_pathname, 'w') as f:
+            f.write(fake_stackwalker_source)
+        self.command_line = '%s %s' % (sys.executable, script_pathname)
+
+    def tearDown(self):
+        super(TestStackwalkerPool, self).tearDown()
+        shutil.rmtree(self.tempdir)
+
+    def _get_pool(self, size=1, timeout=5, max_requests=100):
+        return StackwalkerPool(
+            self.command_line,
+            size=size,
+            timeout=timeout,
+            max_requests=max_requests,
+            logger=Mock(),
+        )
+
+    def test_workers_are_reused(self):
+        pool = self._get_pool()
+        try:
+            output_1, return_code_1 = pool.walk('raw1.json', 'dump1')
+            output_2, return_code_2 = pool.walk('raw2.json', 'dump2')
+        finally:
+            pool.close()
+
+        eq_(return_code_1, 0)
+        eq_(return_code_2, 0)
+        eq_(ujson.loads(output_1)['dump_pathname'], 'dump1')
+        eq_(ujson.loads(output_2)['raw_crash_pathname'], 'raw2.json')
+        pid_1 = ujson.loads(output_1)['pid']
+        pid_2 = ujson.loads(output_2)['pid']
+        eq_(pid_1, pid_2)
+
+    def test_workers_are_recycled(self):
+        pool = self._get_pool(max_requests=1)
+        try:
+            output_1, _ = pool.walk('raw1.json', 'dump1')
+            output_2, _ = pool.walk('raw2.json', 'dump2')
+        finally:
+            pool.close()
+
+        pid_1 = ujson.loads(output_1)['pid']
+        pid_2 = ujson.loads(output_2)['pid']
+        ok_(pid_1 != pid_2)
+
+    def test_timeout_kills_and_replaces_worker(self):
+        pool = self._get_pool(timeout=0.5)
+        try:
+            output, return_code = pool.walk('raw1.json', 'hang')
+            eq_(output, None)
+            eq_(return_code, TIMEOUT_RETURN_CODE)
+            eq_(pool.logger.warning.call_count, 1)
+
+            output, return_code = pool.walk('raw2.json', 'dump2')
+            eq_(return_code, 0)
+            eq_(ujson.loads(output)['dump_pathname'], 'dump2')
+        finally:
+            pool.close()
+
+    def test_dead_worker_is_replaced(self):
+        pool = self._get_pool()
+        try:
+            output, return_code = pool.walk('raw1.json', 'crash')
+            eq_(output, None)
+            eq_(return_code, 3)
+
+            output, return_code = pool.walk('raw2.json', 'dump2')
+            eq_(return_code, 0)
+            eq_(ujson.loads(output)['dump_pathname'], 'dump2')
+        finally:
+            pool.close()
+
+    def test_close(self):
+        pool = self._get_pool(size=2)
+        pool.walk('raw1.json', 'dump1')
+        workers = list(pool._all_workers)
+        eq_(len(workers), 1)
+
+        pool.close()
+
+        for a_worker in workers:
+            ok_(not a_worker.is_alive())
+        eq_(pool._all_workers, set())
+
+    @patch('socorro.processor.stackwalker_pool.subprocess.Popen')
+    def test_failed_spawn_returns_the_slot(self, popen_mock):
+        popen_mock.side_effect = OSError('no such file')
+        pool = self._get_pool(size=2)
+        try:
+            for i in range(3):
+                assert_raises(OSError, pool.walk, 'raw1.json', 'dump1')
+            eq_(pool._idle_workers.qsize(), 2)
+            eq_(pool._all_workers, set())
+
+            popen_mock.side_effect = None
+            popen_mock.reset_mock()
+            # with the stackwalker back, a checkout starts a worker again
+            # rather than blocking on an empty pool
+            pool._checkout()
+            eq_(popen_mock.call_count, 1)
+        finally:
+            pool.close()